@@ -0,0 +1,218 @@
+""" hbs_benchmark.py
+
+Benchmarks of the hot paths of the high bay storage system, run on the simulated hardware (hbs_sim_hardware.py).
+
+- positioning: loop iterations per second of move_xpos and move_xzpos on the simulated I/O board
+- sensors: calls per second of read_byte, read_port, get_xpos, get_ypos, get_zpos and read_sensors
+  (bus with constant port values, so only the decoding is measured)
+- decode_json: decoded MQTT messages per second (CommandRegistry)
+- save_to_file: milliseconds per write of the storage file
+- throughput: simulated boxes per hour of crane busy time of standard workloads (hbs_simulator.py),
+  failed jobs excluded. The workloads stay within the capacity of the rack, failed jobs are reported.
+
+The results are written as JSON file (default: benchmarks/bench_<commit>.json). With --compare, the changes
+against an earlier result file are printed:
+
+    python3 hbs_benchmark.py
+    python3 hbs_benchmark.py --compare benchmarks/bench_1a2b3c4.json
+
+SLW 05/2025
+"""
+
+import os
+import sys
+import json
+import time
+import timeit
+import random
+import logging
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+from hbs_commands import CommandRegistry
+from hbs_commands import ARGS_XZ, ARGS_XZ_NEW
+from hbs_controller import HBSController
+from hbs_operator import HBSOperator
+from hbs_sim_hardware import SimBus, SimTerminal
+from hbs_simulator import Simulator, random_jobs
+import io_extension
+
+RESULT_DIR = "benchmarks"
+TIME_SCALE = 4.0            # the simulated crane runs faster than real time
+# Standard workloads: (jobs per hour, hours, share of stores, initial fill level).
+# The arrival rate is above the capacity of the crane, so the crane is always busy. Store and destore
+# workloads send less jobs than the 50 storage places.
+WORKLOADS = {"store_only": (600, 0.06, 1.0, 0.0),
+             "destore_only": (600, 0.06, 0.0, 1.0),
+             "mixed": (600, 0.5, 0.5, 0.5)}
+
+
+class StaticBus:
+    """ I2C bus with constant input ports: crane at x=4, y=DEFAULT, z=9 """
+
+    def __init__(self):
+        self._ports = {(0x20, 0x12): 0xff & ~0x08, (0x20, 0x13): 0xff & ~(0x08 | 0x40),
+                       (0x24, 0x12): 0xff, (0x24, 0x13): 0xfd}
+
+
+    def read_byte_data(self, address, register):
+        return self._ports.get((address, register), 0xff)
+
+
+    def write_byte_data(self, address, register, value):
+        pass
+
+
+def _calls_per_second(func):
+    """ Calls of func per second, measured for at least 0.2 s """
+    number, duration = timeit.Timer(func).autorange()
+    return round(number / duration, 1)
+
+
+def bench_positioning():
+    """ Loop iterations per second of the positioning loops """
+    op = HBSOperator(SimTerminal(), io=io_extension.IOExtension(bus=SimBus(x=1, y=1, z=1, time_scale=TIME_SCALE)))
+    op._break_time = 0.0
+    for target in (10, 1, 6, 2, 9, 3):
+        op.move_xpos(target)
+    for x, z in ((10, 10), (1, 1), (7, 4), (2, 8), (9, 2)):
+        op.move_xzpos(x, z)
+    result = {}
+    moves = op.stats.summary()["moves"]
+    for axis in ("x", "xz"):
+        summary = moves[axis]
+        result[axis + "_loops_per_s"] = round(summary["loops"]["mean"] / summary["mean"], 1)
+        result[axis + "_polls_per_loop"] = round(summary["polls"]["mean"] / summary["loops"]["mean"], 2)
+    return result
+
+
+def bench_sensors():
+    """ Calls per second of the sensor decoding """
+    io = io_extension.IOExtension(bus=StaticBus())
+    op = HBSOperator(SimTerminal(), io=io)
+    return {"read_byte": _calls_per_second(lambda: io.read_byte(1)),
+            "read_port": _calls_per_second(lambda: io.read_port(1)),
+            "get_xpos": _calls_per_second(op.get_xpos),
+            "get_ypos": _calls_per_second(op.get_ypos),
+            "get_zpos": _calls_per_second(op.get_zpos),
+            "read_sensors": _calls_per_second(op.read_sensors)}
+
+
+def bench_decode_json():
+    """ Decoded messages per second, mix of valid and invalid messages """
+    registry = CommandRegistry()
+    for name, args in (("store", ARGS_XZ), ("destore", ARGS_XZ), ("rearrange", ARGS_XZ_NEW),
+                       ("store_random", ()), ("show_occupancy", ()), ("occupancy", ())):
+        registry.register(name, None, args)
+    payloads = [b'{"operation": "STORE", "x": 3, "z": 2}',
+                b'{"operation": "destore", "x": 10, "z": 5}',
+                b'{"operation": "REARRANGE", "x": 10, "z": 5, "x_new": 1, "z_new": 1}',
+                b'{"operation": "STORE_RANDOM"}',
+                b'{"operation": "occupancy"}']
+    invalid = [b'{"operation": "STORE", "x": "3"}', b'no json']
+
+    def decode_all():
+        for payload in payloads:
+            registry.decode(payload)
+
+    result = {"valid_per_s": round(_calls_per_second(decode_all) * len(payloads), 1)}
+    # Invalid messages are logged and printed, keep the output clean
+    logging.disable(logging.ERROR)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result["invalid_per_s"] = round(_calls_per_second(lambda: [registry.decode(p) for p in invalid])
+                                            * len(invalid), 1)
+    finally:
+        logging.disable(logging.NOTSET)
+    return result
+
+
+def bench_save_to_file():
+    """ Milliseconds per write of the storage file """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            os.makedirs("obj")
+            ctr = HBSController(None, HBSOperator(SimTerminal(), io=io_extension.IOExtension(bus=StaticBus())))
+            ctr.load_storage_file()
+            for place_nr in random.Random(1).sample(range(1, 51), 25):
+                ctr._storage_places[place_nr].update(taken=True, timestamp=time.time())
+            number, duration = timeit.Timer(ctr.save_to_file).autorange()
+        finally:
+            os.chdir(cwd)
+    return {"ms_per_save": round(1000.0 * duration / number, 4)}
+
+
+def bench_throughput():
+    """ Simulated boxes per hour of crane busy time of the standard workloads, without failed jobs """
+    result = {}
+    for name, (rate, hours, store_share, fill) in sorted(WORKLOADS.items()):
+        sim = Simulator(fill=fill, seed=1)
+        with contextlib.redirect_stdout(sys.stderr):
+            report = sim.run(random_jobs(rate, hours, store_share, rng=sim.rng))
+        result[name + "_boxes_per_h"] = round(report["done"] / report["busy_h"], 1) if report["busy_h"] else 0.0
+        result[name + "_failed"] = sum(report["failed"].values())
+    return result
+
+
+BENCHMARKS = {"positioning": bench_positioning, "sensors": bench_sensors, "decode_json": bench_decode_json,
+              "save_to_file": bench_save_to_file, "throughput": bench_throughput}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(names=None):
+    """ Runs the benchmarks, returns the results as dictionary """
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        print("running " + name + " ...", file=sys.stderr)
+        results[name] = bench()
+    return {"commit": git_commit(), "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(), "results": results}
+
+
+def compare(old, new):
+    """ Prints the changes of all metrics against an earlier result """
+    print("{:<40} {:>14} {:>14} {:>8}".format("metric (" + old["commit"] + " -> " + new["commit"] + ")",
+                                              "old", "new", "change"))
+    for name, metrics in new["results"].items():
+        for metric, value in metrics.items():
+            old_value = old["results"].get(name, {}).get(metric)
+            change = "{:+.1f}%".format(100.0 * (value / old_value - 1.0)) if old_value else ""
+            print("{:<40} {:>14} {:>14} {:>8}".format(name + "." + metric, str(old_value), str(value), change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the high bay storage system")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--output", help="result file, default: benchmarks/bench_<commit>.json")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    args = parser.parse_args(argv)
+
+    result = run(args.benchmarks)
+    output = args.output or os.path.join(RESULT_DIR, "bench_" + result["commit"] + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="UTF-8") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result["results"], indent=2))
+    print("results written to " + output, file=sys.stderr)
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as f:
+            compare(json.load(f), result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+""" hbs_bitset.py
+
+Compact occupancy representation of a storage rack.
+
+Bit n-1 of the bitset is set, if the storage place n is taken. The bits are kept in a Python integer,
+so the size of the rack is not limited. Encoded as bytes (little endian), 50 places need 7 bytes.
+The bitset is used for the MQTT state topics, the storage file and to find the differences between
+two states.
+
+SLW 05/2025
+"""
+
+import base64
+
+
+class OccupancyBitset:
+    """ Occupancy of the storage places 1 ... size """
+    __slots__ = ("size", "bits")
+
+    def __init__(self, size, bits=0):
+        self.size = size
+        self.bits = bits
+
+
+    @classmethod
+    def from_places(cls, storage_places, size=None):
+        """ Creates the bitset from the storage places dict: place number -> {'taken': bool, ...} """
+        bits = 0
+        for place_nr, place in storage_places.items():
+            if place['taken']:
+                bits |= 1 << (place_nr - 1)
+        return cls(size or len(storage_places), bits)
+
+
+    @classmethod
+    def from_bytes(cls, data, size=None):
+        return cls(size or 8 * len(data), int.from_bytes(data, "little"))
+
+
+    @classmethod
+    def from_base64(cls, text, size=None):
+        return cls.from_bytes(base64.b64decode(text), size)
+
+
+    def to_bytes(self):
+        """ Returns the bitset as bytes, (size + 7) // 8 bytes, little endian """
+        return self.bits.to_bytes((self.size + 7) // 8, "little")
+
+
+    def to_base64(self):
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+
+    def to_string(self, taken='*', free='_'):
+        """ Returns one character per place, e.g. '_**_*___' """
+        # Binary digits in reversed order: place 1 first
+        digits = format(self.bits, "0{}b".format(self.size))[::-1]
+        return digits.replace('1', taken).replace('0', free)
+
+
+    def set(self, place_nr, taken=True):
+        if taken:
+            self.bits |= 1 << (place_nr - 1)
+        else:
+            self.bits &= ~(1 << (place_nr - 1))
+
+
+    def copy(self):
+        return OccupancyBitset(self.size, self.bits)
+
+
+    def count(self):
+        """ Number of taken places """
+        return bin(self.bits).count('1')
+
+
+    def diff(self, other):
+        """ Returns the places, which are taken in this bitset, but not in the other one and vice versa:
+            (taken, freed) as lists of place numbers """
+        return _places(self.bits & ~other.bits), _places(other.bits & ~self.bits)
+
+
+    def __getitem__(self, place_nr):
+        return bool(self.bits >> (place_nr - 1) & 1)
+
+
+    def __eq__(self, other):
+        return isinstance(other, OccupancyBitset) and (self.size, self.bits) == (other.size, other.bits)
+
+
+    def __repr__(self):
+        return "OccupancyBitset({}, {:#x})".format(self.size, self.bits)
+
+
+def _places(bits):
+    """ Place numbers of the set bits """
+    places = []
+    while bits:
+        low = bits & -bits
+        places.append(low.bit_length())
+        bits ^= low
+    return places
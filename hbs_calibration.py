@@ -0,0 +1,275 @@
+""" hbs_calibration.py
+
+Travel time calibration of the high bay storage system.
+
+Calibration drives the crane through a representative set of moves (X, Z and combined XZ moves of all
+distances in both directions, Y moves to the rack and to the stations) and measures the duration of
+each move. TravelTimeMatrix stores the mean durations and estimates the travel time between any two
+crane positions:
+- single axis moves: measured time of the distance, linear interpolation for unmeasured distances,
+- XZ moves: measured time of the pair, otherwise the slower axis multiplied with the learned overlap
+  factor (measured XZ time / slower single axis time).
+The travel times between all storage places and the I/O stations are precomputed as table and saved,
+so that placement and sequencing decisions can use them as cost model.
+
+The calibration must be started with an empty gripper.
+
+SLW 05/2025
+"""
+
+import time
+import json
+import pickle
+import logging
+
+from hbs_collections import Msg
+from hbs_collections import YPos
+
+MATRIX_VERSION = 1
+REPEAT = 2                  # measurements per move
+XZ_DISTANCES = (2, 5, 9)    # X and Z distances of the calibrated XZ moves
+N_PLACES = 50
+# Position of the crane in front of the I/O stations: (x, z)
+STATIONS = {"input": (10, 1), "output": (1, 2)}
+
+
+def place_position(place_nr):
+    """ Position (x, z) of the crane in front of a storage place: gripper above the box level,
+        where put_box starts and get_box ends """
+    x = (place_nr - 1) % 10 + 1
+    z_level = (place_nr - 1) // 10 + 1
+    return x, z_level * 2
+
+
+def location_position(location):
+    """ Position (x, z) of a storage place number or an I/O station ('input', 'output') """
+    if location in STATIONS:
+        return STATIONS[location]
+    return place_position(location)
+
+
+def _interpolate(points, distance):
+    """ Linear interpolation of the travel time for a distance. points: sorted list of (distance, time).
+        Outside the measured range, the nearest two points are extrapolated. Returns None without points. """
+    if not points:
+        return None
+    if len(points) == 1:
+        d, t = points[0]
+        return t * distance / d
+    for (d0, t0), (d1, t1) in zip(points, points[1:]):
+        if distance <= d1:
+            break
+    return max(0.0, t0 + (t1 - t0) * (distance - d0) / (d1 - d0))
+
+
+class TravelTimeMatrix:
+    """ Measured travel times of the crane and the derived times between storage places and stations """
+
+    def __init__(self):
+        self._axis = {}         # (axis, direction, distance) -> [total time, count], axis 'x' or 'z'
+        self._xz = {}           # (x1, z1, x2, z2) -> [total time, count]
+        self._y = {}            # (from YPos name, to YPos name) -> [total time, count]
+        self._table = {}        # (location, location) -> travel time, see build()
+        self.calibrated = None  # time of the calibration
+
+
+    @staticmethod
+    def _add(table, key, duration):
+        entry = table.setdefault(key, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+
+
+    def record_axis(self, axis, start, target, duration):
+        direction = "up" if target > start else "down"
+        self._add(self._axis, (axis, direction, abs(target - start)), duration)
+
+
+    def record_xz(self, start, target, duration):
+        self._add(self._xz, start + target, duration)
+
+
+    def record_y(self, start, target, duration):
+        self._add(self._y, (start.name, target.name), duration)
+
+
+    def axis_time(self, axis, start, target):
+        """ Travel time of a single axis move, None if the axis has not been calibrated """
+        if start == target:
+            return 0.0
+        direction = "up" if target > start else "down"
+        points = sorted((d, total / count) for (a, dr, d), (total, count) in self._axis.items()
+                        if a == axis and dr == direction)
+        return _interpolate(points, abs(target - start))
+
+
+    def y_time(self, start, target):
+        """ Travel time of a Y move, None if it has not been calibrated """
+        if start is target:
+            return 0.0
+        entry = self._y.get((start.name, target.name))
+        return entry[0] / entry[1] if entry else None
+
+
+    @property
+    def overlap(self):
+        """ Mean ratio of the measured XZ times to the time of the slower axis """
+        ratios = []
+        for (x1, z1, x2, z2), (total, count) in self._xz.items():
+            slower = max(self.axis_time("x", x1, x2) or 0.0, self.axis_time("z", z1, z2) or 0.0)
+            if slower > 0:
+                ratios.append(total / count / slower)
+        return sum(ratios) / len(ratios) if ratios else 1.0
+
+
+    def move_time(self, start, target, overlap=None):
+        """ Travel time from the position start (x, z) to the position target (x, z) with move_xzpos.
+            Returns None, if the axes have not been calibrated. """
+        entry = self._xz.get(start + target)
+        if entry:
+            return entry[0] / entry[1]
+        t_x = self.axis_time("x", start[0], target[0])
+        t_z = self.axis_time("z", start[1], target[1])
+        if t_x is None or t_z is None:
+            return None
+        if t_x == 0.0 or t_z == 0.0:
+            return t_x + t_z
+        return max(t_x, t_z) * (self.overlap if overlap is None else overlap)
+
+
+    def build(self):
+        """ Precomputes the travel times between all storage places and I/O stations """
+        overlap = self.overlap
+        locations = list(range(1, N_PLACES + 1)) + list(STATIONS)
+        positions = {loc: location_position(loc) for loc in locations}
+        self._table = {(a, b): self.move_time(positions[a], positions[b], overlap)
+                       for a in locations for b in locations}
+
+
+    def travel_time(self, a, b):
+        """ Travel time between two locations (storage place number, 'input' or 'output'),
+            None if not calibrated """
+        if (a, b) in self._table:
+            return self._table[(a, b)]
+        return self.move_time(location_position(a), location_position(b))
+
+
+    def summary(self):
+        """ Returns the calibrated travel times as dictionary (JSON compatible) """
+        axes = {}
+        for (axis, direction, distance), (total, count) in sorted(self._axis.items()):
+            axes.setdefault(axis, {}).setdefault(direction, {})[str(distance)] = round(total / count, 3)
+        y = {'/'.join(key): round(total / count, 3) for key, (total, count) in sorted(self._y.items())}
+        return {"calibrated": self.calibrated, "axes": axes, "y": y, "xz_pairs": len(self._xz),
+                "overlap": round(self.overlap, 3)}
+
+
+    def to_json(self):
+        return json.dumps(self.summary(), separators=(',', ':'))
+
+
+    def save(self, filename):
+        """ Saves the measurements and the table to a file """
+        state = {"version": MATRIX_VERSION, "axis": self._axis, "xz": self._xz, "y": self._y,
+                 "table": self._table, "calibrated": self.calibrated}
+        with open(filename, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+
+    def load(self, filename):
+        """ Loads the measurements and the table from a file. Returns True on success. """
+        try:
+            with open(filename, 'rb') as f:
+                state = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return False
+        if not isinstance(state, dict) or state.get("version") != MATRIX_VERSION:
+            return False
+        self._axis, self._xz, self._y = state["axis"], state["xz"], state["y"]
+        self._table, self.calibrated = state["table"], state["calibrated"]
+        return True
+
+
+class Calibration:
+    """ Measures the travel times of the crane and builds a new TravelTimeMatrix """
+
+    def __init__(self, op, repeat=REPEAT):
+        self.op = op
+        self.repeat = repeat
+        self.matrix = TravelTimeMatrix()
+
+
+    def run(self):
+        """ Drives the calibration moves. Returns the message of the result (e.g. Msg.okay).
+            On success, self.matrix holds the new travel times. """
+        logname = "Calibration.run"
+        logging.info(logname)
+        t_start = time.monotonic()
+        for step in (self._calibrate_y, self._calibrate_x, self._calibrate_z, self._calibrate_xz):
+            result = step()
+            if result is not Msg.okay:
+                logging.error("%s: %s failed: %s", logname, step.__name__, result.name)
+                return result
+        self.matrix.calibrated = time.time()
+        self.matrix.build()
+        logging.info("%s: done in %.1f s, overlap %.2f", logname, time.monotonic() - t_start, self.matrix.overlap)
+        return Msg.okay
+
+
+    def _timed(self, move, *args):
+        """ Runs a move, returns (result, duration) """
+        t_start = time.monotonic()
+        result = move(*args)
+        return result, time.monotonic() - t_start
+
+
+    def _calibrate_y(self):
+        """ Y moves to the rack and to the input station, with the gripper below the box level """
+        op = self.op
+        result = op.move_ypos(YPos.DEFAULT)
+        if result is not Msg.okay: return result
+        result = op.move_xzpos(*STATIONS["input"])
+        if result is not Msg.okay: return result
+        for _ in range(self.repeat):
+            for start, target in ((YPos.DEFAULT, YPos.STORE), (YPos.STORE, YPos.DEFAULT),
+                                  (YPos.DEFAULT, YPos.DESTORE), (YPos.DESTORE, YPos.DEFAULT)):
+                result, duration = self._timed(op.move_ypos, target)
+                if result is not Msg.okay: return result
+                self.matrix.record_y(start, target, duration)
+        return Msg.okay
+
+
+    def _calibrate_axis(self, axis, move):
+        """ Moves of all distances in both directions: 1 -> 1 + d -> 1 """
+        for distance in range(1, 10):
+            for _ in range(self.repeat):
+                for start, target in ((1, 1 + distance), (1 + distance, 1)):
+                    result, duration = self._timed(move, target)
+                    if result is not Msg.okay: return result
+                    self.matrix.record_axis(axis, start, target, duration)
+        return Msg.okay
+
+
+    def _calibrate_x(self):
+        result = self.op.move_xzpos(1, 1)
+        if result is not Msg.okay: return result
+        return self._calibrate_axis("x", self.op.move_xpos)
+
+
+    def _calibrate_z(self):
+        result = self.op.move_xzpos(1, 1)
+        if result is not Msg.okay: return result
+        return self._calibrate_axis("z", self.op.move_zpos)
+
+
+    def _calibrate_xz(self):
+        result = self.op.move_xzpos(1, 1)
+        if result is not Msg.okay: return result
+        for dx in XZ_DISTANCES:
+            for dz in XZ_DISTANCES:
+                for _ in range(self.repeat):
+                    for start, target in (((1, 1), (1 + dx, 1 + dz)), ((1 + dx, 1 + dz), (1, 1))):
+                        result, duration = self._timed(self.op.move_xzpos, *target)
+                        if result is not Msg.okay: return result
+                        self.matrix.record_xz(start, target, duration)
+        return Msg.okay
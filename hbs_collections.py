@@ -33,6 +33,7 @@ class YPos(Enum):
     DEFAULT = 1
     STORE = 2
     UNDEFINED = -1
+    CONFLICT = -2       # several Y sensors active, see hbs_sensors.py
 
 # Messages
 class Msg(Enum):
@@ -0,0 +1,124 @@
+""" hbs_commands.py
+
+Command schema registry for the MQTT interface of the high bay storage system.
+
+Each operation declares its handler and its arguments (name and type) once. Decoding a message
+parses the JSON, looks up the operation and validates all arguments in a single pass, so the
+cost per message does not grow with the number of registered operations.
+orjson is used for parsing when it is installed, otherwise the standard json module.
+
+SLW 05/2025
+"""
+
+import json
+import logging
+
+from hbs_collections import Msg
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+DEBUG = False
+
+# Frequently used argument lists
+ARGS_XZ = (("x", int), ("z", int))
+ARGS_XZ_NEW = ARGS_XZ + (("x_new", int), ("z_new", int))
+
+
+class Command:
+    """ Schema of a single operation: handler, argument names and types, LCD format """
+    __slots__ = ("name", "handler", "args", "lcd_format", "read_only")
+
+    def __init__(self, name, handler, args=(), lcd_format="", read_only=False):
+        self.name = name
+        self.handler = handler
+        self.args = tuple(args)
+        self.lcd_format = lcd_format
+        self.read_only = read_only      # query without side effects, may run in parallel to the crane
+
+
+    def lcd_text(self, args):
+        """ Returns the add-on text for the LCD display, e.g. '10/5' """
+        if not self.lcd_format:
+            return ""
+        return self.lcd_format.format(*args)
+
+
+class CommandRegistry:
+    """ Registry of all operations available via MQTT """
+
+    def __init__(self):
+        self._commands = {}
+
+
+    def register(self, name, handler, args=(), lcd_format="", read_only=False):
+        """ Registers an operation.
+            name: operation keyword (case insensitive)
+            handler: function to be called with the decoded arguments
+            args: sequence of (argument name, type) tuples
+            lcd_format: format string for the arguments shown on the LCD display
+            read_only: True for queries, which are answered immediately from the MQTT thread """
+        if not lcd_format and args:
+            lcd_format = ' '.join(("{}/{}",) * (len(args) // 2))
+        command = Command(name.casefold(), handler, args, lcd_format, read_only)
+        self._commands[command.name] = command
+        return command
+
+
+    def decode(self, payload):
+        """ Decodes a received message (bytes or str). Checks the syntax and the arguments.
+            Returns: message, command, arguments (tuple) """
+        logname = "CommandRegistry.decode"
+        if DEBUG:
+            print(logname + ": " + str(payload))
+
+        # Convert json format to Python dictionary
+        try:
+            json_dict = _json_loads(payload)
+        except ValueError:
+            json_dict = None
+        if not isinstance(json_dict, dict):
+            return self._error(logname + ": JSON format error", Msg.err_json_format)
+        # Keywords are case insensitive
+        json_dict = {str(key).casefold(): value for key, value in json_dict.items()}
+        # Extract the requested action
+        operation = json_dict.get("operation")
+        if not isinstance(operation, str):
+            return self._error(logname + ": keyword 'operation' missing", Msg.err_json_noop)
+        command = self._commands.get(operation.casefold())
+        if command is None:
+            return self._error(logname + ": command not recognized: '" + operation + "'",
+                               Msg.err_cmd_unknown)
+        # Collect and validate the arguments
+        args = []
+        for arg_name, arg_type in command.args:
+            value = json_dict.get(arg_name)
+            if type(value) is not arg_type:
+                return self._error(logname + ": wrong arguments", Msg.err_wrong_args)
+            args.append(value)
+        # Success!
+        if DEBUG:
+            print("Okay! Command:", command.name, "Arguments:", args)
+        return Msg.okay, command, tuple(args)
+
+
+    def _error(self, msg, result):
+        logging.error(msg)
+        print(msg)
+        return result, None, ()
+
+
+    def __contains__(self, name):
+        return name.casefold() in self._commands
+
+
+    def __getitem__(self, name):
+        return self._commands[name.casefold()]
+
+
+    @property
+    def names(self):
+        return tuple(self._commands)
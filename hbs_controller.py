@@ -13,13 +13,24 @@ import os
 import logging
 
 from hbs_collections import Msg
-from hbs_user_terminal import UserTerminal
+from hbs_collections import YPos
 from hbs_operator import HBSOperator
+from hbs_stats import timed
+from hbs_bitset import OccupancyBitset
+from hbs_calibration import Calibration
+from hbs_calibration import TravelTimeMatrix
 
 
 # Location of the storage file
 STORE_DIR = "obj"
 STORE_FILE = "storage_places.pkl"
+DRIFT_FILE = "drift_baselines.pkl"
+BRAKE_FILE = "x_brake_profile.pkl"
+TRAVEL_FILE = "travel_times.pkl"
+STATS_FILE = "cycle_stats.pkl"
+POSITION_FILE = "position.pkl"      # exists only after a clean shutdown
+STORE_VERSION = 2       # storage file: 1 -> dict of places, 2 -> occupancy bitset and timestamps
+N_PLACES = 50
 
 DEBUG = False
 
@@ -27,10 +38,16 @@ DEBUG = False
 class HBSController:
     """class for storage-management of high-bay storage"""
  
-    def __init__(self, ut):       			    # expects the user termianl as argument
+    def __init__(self, ut, op=None):       	    # expects the user termianl as argument
         logname = "HBSController.__init__"
         logging.info(logname)
-        self.op = HBSOperator(ut)  # create an operator instance
+        self.op = op if op is not None else HBSOperator(ut)   # operator instance, op: e.g. a simulated operator
+        self._storage_places = {}
+        self._occupancy = OccupancyBitset(N_PLACES)
+        # copies of the storage places and the occupancy for read-only queries from other threads
+        self._snapshot = {}
+        self._snapshot_bits = OccupancyBitset(N_PLACES)
+        self.travel_times = TravelTimeMatrix()      # cost model, see calibrate()
         
         
     def load_storage_file(self):
@@ -66,6 +83,7 @@ class HBSController:
         place_nr = (z_pos - 1) * 10 + x_pos
         self._storage_places[place_nr]['taken'] = True
         self._storage_places[place_nr]['timestamp'] = time.time()
+        self._occupancy.set(place_nr, True)
         self.save_to_file()
 
 
@@ -74,6 +92,7 @@ class HBSController:
         place_nr = (z_pos - 1) * 10 + x_pos
         self._storage_places[place_nr]['taken'] = False
         self._storage_places[place_nr]['timestamp'] = None
+        self._occupancy.set(place_nr, False)
         self.save_to_file()
         
         
@@ -84,6 +103,7 @@ class HBSController:
         return self._storage_places[place_nr]['taken']
         
         
+    @timed("store")
     def store_box(self, xpos, zlevel):
         """get new box from io-station 1 & put box in storage place (x,z).
            Return: message of action """
@@ -116,6 +136,7 @@ class HBSController:
         return Msg.okay              
                     
 
+    @timed("destore")
     def destore_box(self, xpos, zlevel):
         """get box from storage place (x,z) & put box io-station 2
            Return: message of action """
@@ -205,6 +226,7 @@ class HBSController:
             return Msg.err_storage_empty
 
 
+    @timed("rearrange")
     def rearrange_box(self, old_xpos, old_zlevel, new_xpos, new_zlevel):
         """get box from (old_xpos, old_zlevel) & put box in (new_xpos, new_zlevel)"""
         logname = "HBSController.rearrange_box: "
@@ -269,29 +291,135 @@ class HBSController:
 
 
     def save_to_file(self):
-        """writes storage_places dict into file"""
+        """writes the occupancy (bitset) and the timestamps of the taken places into the file"""
+        self._update_snapshot()
+        data = {"version": STORE_VERSION,
+                "size": self._occupancy.size,
+                "occupancy": self._occupancy.to_bytes(),
+                "timestamps": {place_nr: place['timestamp'] for place_nr, place in self._storage_places.items()
+                               if place['timestamp'] is not None}}
         with open(self._storage_file, 'wb') as f:
-            pickle.dump(self._storage_places, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+
+    def _update_snapshot(self):
+        """ Replaces the snapshot for read-only queries. A snapshot is never modified,
+            so other threads can read it without locking. """
+        self._snapshot = {place_nr: dict(place) for place_nr, place in self._storage_places.items()}
+        self._snapshot_bits = self._occupancy.copy()
+
+
+    def slot_state(self, x_pos, z_pos):
+        """ Returns the state of a storage place from the snapshot, None for invalid places """
+        if not (1 <= x_pos <= 10 and 1 <= z_pos <= 5):
+            return None
+        return self._snapshot.get((z_pos - 1) * 10 + x_pos)
 
 
     def load_from_file(self):
-        """read storage_places dict from file"""
-        okay = True
+        """read storage_places dict from file, version 1 and 2 are supported"""
         try:
             with open(self._storage_file, 'rb') as f:
-                self._storage_places = pickle.load(f)
-        except IOError:
-            okay = False
-        return okay
+                data = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return False
+        if data.get("version") == STORE_VERSION:
+            occupancy = OccupancyBitset.from_bytes(data["occupancy"], data["size"])
+            self._storage_places = {}
+            for place_nr in range(1, occupancy.size + 1):
+                self._storage_places[place_nr] = {'x': (place_nr - 1) % 10 + 1, 'z': (place_nr - 1) // 10 + 1,
+                                                  'taken': occupancy[place_nr],
+                                                  'timestamp': data["timestamps"].get(place_nr)}
+        else:
+            # version 1: dict of places
+            self._storage_places = data
+        self._occupancy = OccupancyBitset.from_places(self._storage_places)
+        self._update_snapshot()
+        return True
             
 
+    def load_statistics(self):
+        """ Loads the recorded travel times (learned timeouts), the baselines of the drift detection,
+            the learned brake points of the X axis and the calibrated travel times, if available """
+        logname = "HBSController.load_statistics"
+        for filename, obj in ((STATS_FILE, self.op.stats), (DRIFT_FILE, self.op.drift), (BRAKE_FILE, self.op.brake),
+                              (TRAVEL_FILE, self.travel_times)):
+            filename = os.path.join(STORE_DIR, filename)
+            if os.path.isfile(filename) and not obj.load(filename):
+                logging.error(logname + ": file i/o error for " + filename)
+
+
+    def save_statistics(self):
+        """ Saves the recorded travel times, the baselines of the drift detection and the brake points """
+        self.op.stats.save(os.path.join(STORE_DIR, STATS_FILE))
+        self.op.drift.save(os.path.join(STORE_DIR, DRIFT_FILE))
+        self.op.brake.save(os.path.join(STORE_DIR, BRAKE_FILE))
+
+
+    @timed("calibrate")
+    def calibrate(self):
+        """ Measures the travel times of the crane (empty gripper!) and saves the travel time matrix.
+            Return: message of action """
+        logname = "HBSController.calibrate"
+        calibration = Calibration(self.op)
+        result = calibration.run()
+        if result is not Msg.okay:
+            return result
+        self.travel_times = calibration.matrix
+        try:
+            self.travel_times.save(os.path.join(STORE_DIR, TRAVEL_FILE))
+        except IOError:
+            logging.error(logname + ": file i/o error for " + TRAVEL_FILE)
+            return Msg.err_storage_io
+        return Msg.okay
+
+
+    def save_position(self):
+        """ Saves the current position of the operator for a warm restart.
+            Must only be called at a clean shutdown. Returns True, if the position has been saved. """
+        logname = "HBSController.save_position"
+        xpos, ypos, zpos = self.op.read_sensors()
+        if xpos < 0 or ypos.value < 0 or zpos < 0:
+            logging.info("%s: position undefined (%s, %s, %s), not saved", logname, xpos, ypos.name, zpos)
+            return False
+        position = {'x': xpos, 'y': ypos.value, 'z': zpos}
+        try:
+            with open(os.path.join(STORE_DIR, POSITION_FILE), 'wb') as f:
+                pickle.dump(position, f, pickle.HIGHEST_PROTOCOL)
+        except IOError as err:
+            logging.error("%s: %s", logname, err)
+            return False
+        logging.info("%s: %s", logname, position)
+        return True
+
+
+    def restore_position(self):
+        """ Compares the position saved at the last clean shutdown with a snapshot of the sensors.
+            Returns the set of axes ('x', 'y', 'z'), whose position has been confirmed.
+            The file is removed, so that a crash or a power loss always leads to a full initialization. """
+        logname = "HBSController.restore_position"
+        filename = os.path.join(STORE_DIR, POSITION_FILE)
+        if not os.path.isfile(filename):
+            return set()
+        try:
+            with open(filename, 'rb') as f:
+                saved = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            logging.error("%s: file i/o error for %s", logname, filename)
+            saved = {}
+        os.remove(filename)
+
+        xpos, ypos, zpos = self.op.read_sensors()
+        current = {'x': xpos, 'y': ypos.value, 'z': zpos}
+        confirmed = {axis for axis in current if saved.get(axis) == current[axis]}
+        logging.info("%s: saved %s, sensors %s, confirmed %s", logname, saved, current, sorted(confirmed))
+        return confirmed
+
+
     def print_all(self):
         logname = "HBSController.print_all: "
         
-        try:
-            with open(self._storage_file, 'rb') as f:
-                self._storage_places = pickle.load(f)
-        except IOError:
+        if not self.load_from_file():
             err_msg = logname + "file i/o error for " + self._storage_file
             logging.error(logname + "file i/o error for " + self._storage_file)
             print(err_msg)
@@ -320,6 +448,20 @@ class HBSController:
     @property
     def occupancy(self):
         return self._storage_places
+    
+    @property
+    def snapshot(self):
+        """ Consistent copy of the storage places, must not be modified """
+        return self._snapshot
+    
+    @property
+    def occupancy_bits(self):
+        """ Consistent copy of the occupancy bitset, must not be modified """
+        return self._snapshot_bits
+    
+    @property
+    def stats(self):
+        return self.op.stats
              
     @property
     def x(self):
@@ -337,6 +479,7 @@ class HBSController:
 #=======================================================================================================
             
 if __name__ == "__main__":
+    from hbs_user_terminal import UserTerminal
     
     ut = UserTerminal()
     hbs_ctr = HBSController(ut)
@@ -0,0 +1,175 @@
+""" hbs_conveyor.py
+
+Belts of the I/O stations of the high bay storage system.
+
+The belts are driven by background threads, so that they run in parallel to the crane:
+- the input belt is started when a box is to be stored and stops by itself at the light barrier.
+  When the crane arrives at the input station, the box is already staged.
+- the output belt discharges a dropped box for a fixed time (there is no sensor at the output),
+  the crane is released immediately.
+The I/O stations run either inwards or outwards, so an input run waits for a running discharge.
+An input run is not needed, if a box has been staged already (e.g. in advance for the next job).
+
+SLW 05/2025
+"""
+
+import time
+import logging
+import threading
+
+from hbs_collections import Msg
+from hbs_logging import events
+
+INPUT_TIMEOUT = 5.0     # seconds until the box must reach the light barrier
+INPUT_OVERRUN = 0.3     # seconds the belt keeps running after the light barrier has been interrupted
+POLL_TIME = 0.01        # seconds between two reads of the light barrier
+OUTPUT_TIME = 6.0       # seconds to discharge a box at the output station
+
+
+class Conveyor:
+    """ Belts of the I/O stations, running in background threads """
+
+    def __init__(self, io, pins, emergency):
+        self.io = io
+        self.pins = pins
+        self._emergency = emergency         # function, returns True if the emergency stop is active
+        self._input_thread = None
+        self._input_result = Msg.okay
+        self._input_lock = threading.Lock()     # the input belt is started by the run loop and the MQTT thread
+        self._abort = threading.Event()
+        self._output_thread = None
+        self._output_result = Msg.okay
+        self._output_end = 0.0              # monotonic time, when the discharge ends
+        self._output_lock = threading.Lock()
+
+
+    def start_input(self):
+        """ Starts the input belt in the background. It stops when the box has reached the light barrier.
+            A running discharge is finished first. """
+        with self._input_lock:
+            if self._input_thread is not None and self._input_thread.is_alive():
+                return
+            self._abort.clear()
+            self._input_thread = threading.Thread(target=self._run_input, name="InputBelt", daemon=True)
+            self._input_thread.start()
+
+
+    def wait_input(self):
+        """ Waits until the input belt has stopped. Returns the result, e.g. Msg.okay if the box is staged. """
+        thread = self._input_thread
+        if thread is None:
+            return self._input_result
+        thread.join()
+        with self._input_lock:
+            if self._input_thread is thread:
+                self._input_thread = None
+        return self._input_result
+
+
+    def abort_input(self):
+        """ Stops the input belt, e.g. if the crane can't reach the input station """
+        self._abort.set()
+        self.wait_input()
+
+
+    def start_output(self, duration=OUTPUT_TIME):
+        """ Starts the discharge of a box at the output station. If the belt is already running,
+            the discharge time is extended for the new box. """
+        with self._output_lock:
+            self._output_end = time.monotonic() + duration
+            if self._output_thread is not None:
+                return
+            self._output_thread = threading.Thread(target=self._run_output, name="OutputBelt", daemon=True)
+            self._output_thread.start()
+
+
+    def wait_output(self):
+        """ Waits until the discharge has finished. Returns its result. """
+        thread = self._output_thread
+        if thread is not None:
+            thread.join()
+        return self._output_result
+
+
+    @property
+    def output_busy(self):
+        """ True, while a box is discharged """
+        return self._output_thread is not None
+
+
+    def stop(self):
+        """ Waits for the belts to finish, e.g. at the end of the program """
+        self.wait_input()
+        self.wait_output()
+
+
+    def box_staged(self):
+        """ True, if a box interrupts the light barrier of the input station """
+        return bool(self.io.read_byte(3) & 0x02)
+
+
+    def _run_input(self):
+        logname = "Conveyor._run_input"
+        self.wait_output()
+        if self.box_staged():
+            self._input_result = Msg.okay
+            return
+        t_start = time.monotonic()
+        t_end = t_start + INPUT_TIMEOUT
+        result = Msg.err_input_belt
+        self.io.set_port(self.pins.io1_in, True)
+        self.io.set_port(self.pins.io2_in, True)
+        while time.monotonic() < t_end and not self._abort.is_set():
+            if self._emergency():
+                result = Msg.err_emrg_stop
+                break
+            if self.box_staged():
+                time.sleep(INPUT_OVERRUN)
+                result = Msg.okay
+                break
+            time.sleep(POLL_TIME)
+        self.io.set_port(self.pins.io1_in, False)
+        self.io.set_port(self.pins.io2_in, False)
+
+        # Check the light barrier whether the box is in the right position
+        if result is Msg.okay and not self.box_staged():
+            result = Msg.err_input_belt
+        if self._abort.is_set() and result is not Msg.okay:
+            result = Msg.err_input_belt
+        duration = time.monotonic() - t_start
+        if result is not Msg.okay:
+            logging.error("%s: %s after %.2f s", logname, result.name, duration)
+        events.record("belt", "input", None, duration, result,
+                      logging.INFO if result is Msg.okay else logging.ERROR)
+        self._input_result = result
+
+
+    def _run_output(self):
+        logname = "Conveyor._run_output"
+        t_start = time.monotonic()
+        result = Msg.okay
+        self.io.set_port(self.pins.io1_out, True)
+        self.io.set_port(self.pins.io2_out, True)
+        while True:
+            with self._output_lock:
+                remaining = self._output_end - time.monotonic()
+                if remaining <= 0:
+                    # Stop the output-station
+                    self.io.set_port(self.pins.io1_out, False)
+                    self.io.set_port(self.pins.io2_out, False)
+                    self._output_thread = None
+                    break
+            if self._emergency():
+                self.io.set_port(self.pins.io1_out, False)
+                self.io.set_port(self.pins.io2_out, False)
+                with self._output_lock:
+                    self._output_thread = None
+                result = Msg.err_emrg_stop
+                break
+            time.sleep(min(remaining, 0.05))
+        duration = time.monotonic() - t_start
+        if result is not Msg.okay:
+            logging.error("%s: %s after %.2f s", logname, result.name, duration)
+        events.record("belt", "output", None, duration, result,
+                      logging.INFO if result is Msg.okay else logging.ERROR)
+        self._output_result = result
@@ -0,0 +1,119 @@
+""" hbs_drift.py
+
+Predictive maintenance for the high bay storage system.
+
+The travel time between two neighbouring sensors of an axis (a segment) is very stable as long as the
+mechanics are in good condition. Belt wear or friction in the gearbox slowly increase these times.
+DriftDetector learns a baseline (mean and standard deviation) per axis and segment and compares the
+mean of the most recent samples against it. A statistically significant slowdown is reported as
+warning long before the fixed timeouts of the operator would fire.
+
+SLW 05/2025
+"""
+
+import math
+import pickle
+import logging
+from collections import deque
+
+BASELINE_SAMPLES = 30       # number of samples to learn the baseline
+RECENT_SAMPLES = 10         # number of recent samples compared against the baseline
+Z_LIMIT = 4.0               # significance: deviation of the recent mean in standard errors
+MIN_SLOWDOWN = 0.10         # relevance: minimum relative slowdown (10%)
+
+
+class SegmentBaseline:
+    """ Baseline and recent samples of a single segment """
+
+    def __init__(self):
+        self.count, self.mean, self._m2 = 0, 0.0, 0.0       # Welford's algorithm
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+        self.drifting = False
+
+
+    @property
+    def learned(self):
+        return self.count >= BASELINE_SAMPLES
+
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.count - 1))
+
+
+    def learn(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+
+class DriftDetector:
+    """ Detects slowly increasing travel times per axis and segment """
+
+    def __init__(self, on_warning=None):
+        self._segments = {}
+        self.on_warning = on_warning    # callback(key, slowdown) for new warnings, slowdown as ratio
+
+
+    def update(self, key, duration):
+        """ Adds a measured travel time for a segment, e.g. key = ('x', 3, 4, False).
+            Returns True, if the segment is drifting. """
+        seg = self._segments.get(key)
+        if seg is None:
+            seg = self._segments[key] = SegmentBaseline()
+        if not seg.learned:
+            seg.learn(duration)
+            return False
+
+        seg.recent.append(duration)
+        if len(seg.recent) < RECENT_SAMPLES:
+            return seg.drifting
+        recent_mean = sum(seg.recent) / len(seg.recent)
+        slowdown = recent_mean / seg.mean - 1.0
+        std_err = max(seg.std, 0.01 * seg.mean) / math.sqrt(len(seg.recent))
+        drifting = slowdown >= MIN_SLOWDOWN and (recent_mean - seg.mean) / std_err >= Z_LIMIT
+
+        if drifting and not seg.drifting:
+            logging.warning("DriftDetector.update: segment %s slowed down by %.0f%%", key, 100 * slowdown)
+            if self.on_warning is not None:
+                self.on_warning(key, slowdown)
+        elif seg.drifting and not drifting:
+            logging.info("DriftDetector.update: segment %s back to normal", key)
+        seg.drifting = drifting
+        return drifting
+
+
+    def reset(self, axis=None):
+        """ Forgets the baselines, e.g. after maintenance. axis None -> all axes """
+        for key in list(self._segments):
+            if axis is None or key[0].startswith(axis):
+                del self._segments[key]
+
+
+    def status(self):
+        """ Returns a dictionary with the drifting segments and their slowdown in percent """
+        result = {}
+        for key, seg in list(self._segments.items()):     # may be called from another thread
+            if seg.drifting:
+                recent_mean = sum(seg.recent) / len(seg.recent)
+                result['/'.join(str(k) for k in key)] = round(100 * (recent_mean / seg.mean - 1.0), 1)
+        return result
+
+
+    def save(self, filename):
+        """ Saves the baselines to a file """
+        with open(filename, 'wb') as f:
+            pickle.dump(self._segments, f, pickle.HIGHEST_PROTOCOL)
+
+
+    def load(self, filename):
+        """ Loads the baselines from a file. Returns True on success. """
+        try:
+            with open(filename, 'rb') as f:
+                self._segments = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return False
+        return True
@@ -0,0 +1,82 @@
+""" hbs_lcd_renderer.py
+
+Double buffered renderer for the character LCD of the user terminal.
+
+The renderer keeps two screen states: the desired one, which is written by the user terminal,
+and the current one, which is shown on the display. flush() compares both states and sends only
+the changed character cells via I2C. It is called by the UI worker in the background at a limited
+refresh rate, so writing text to the display never waits for the slow PCF8574 expander.
+
+SLW 05/2025
+"""
+
+import threading
+
+MAX_GAP = 2             # unchanged cells between two changes, which are rewritten rather than skipped
+
+
+class LCDRenderer:
+    """ Frame buffer for a character LCD (RPLCD CharLCD) """
+
+    def __init__(self, lcd, rows=4, cols=20):
+        self._lcd = lcd
+        self._rows, self._cols = rows, cols
+        self._desired = [[' '] * cols for _ in range(rows)]
+        self._current = [[' '] * cols for _ in range(rows)]
+        self._lock = threading.Lock()
+        self._pending = False
+        self._lcd.clear()
+
+
+    def set_line(self, row, text):
+        """ Sets the text of a display row. The text is cut or filled with blanks to the row length. """
+        text = text[:self._cols].ljust(self._cols)
+        with self._lock:
+            self._desired[row] = list(text)
+            self._pending = True
+
+
+    def set_lines(self, lines):
+        """ Sets the text of all display rows """
+        with self._lock:
+            for row, text in enumerate(lines[:self._rows]):
+                self._desired[row] = list(text[:self._cols].ljust(self._cols))
+            self._pending = True
+
+
+    def clear(self):
+        self.set_lines([''] * self._rows)
+
+
+    def flush(self):
+        """ Sends all changed cells to the display """
+        with self._lock:
+            desired = [row[:] for row in self._desired]
+            self._pending = False
+        for row in range(self._rows):
+            current = self._current[row]
+            wanted = desired[row]
+            col = 0
+            while col < self._cols:
+                if current[col] == wanted[col]:
+                    col += 1
+                    continue
+                # Find the end of the changed run, small gaps are included
+                start = end = col
+                gap = 0
+                while col < self._cols and gap <= MAX_GAP:
+                    if current[col] != wanted[col]:
+                        end = col
+                        gap = 0
+                    else:
+                        gap += 1
+                    col += 1
+                self._lcd.cursor_pos = (row, start)
+                self._lcd.write_string(''.join(wanted[start:end + 1]))
+                current[start:end + 1] = wanted[start:end + 1]
+
+
+    @property
+    def pending(self):
+        """ True, if there are changes which have not been sent to the display """
+        return self._pending
@@ -0,0 +1,408 @@
+""" hbs_loadgen.py
+
+MQTT load generator and latency measurement of the high bay storage system.
+
+The load generator publishes a configurable mix of commands to hochregallager/set at a given rate
+(Poisson or constant arrivals), subscribes to hochregallager/result and hochregallager/status and
+reports the latency from the command to its result (histogram per operation), the throughput and
+the status changes.
+
+The results carry no reference to the command. They are matched like the system answers them:
+- commands for the crane are executed in the order of arrival, so their results are matched FIFO,
+- read-only queries (e.g. position) are answered immediately, their result is matched by its prefix.
+
+Without --broker, the load runs against a local broker stand-in (LocalBroker) and a simulated system
+(SimHBS): the message flow of hbs_main (decoding, query handling, command buffer, status) with the
+slot logic of HBSController and the simulated crane of hbs_simulator, time_scale times faster than
+real time. So ingestion and queueing can be stress-tested on a PC:
+
+    python3 hbs_loadgen.py --rate 2 --duration 60 --mix store=3,destore=3,rearrange=1,show_occupancy=1
+    python3 hbs_loadgen.py --broker 192.168.1.94 --rate 0.05 --count 20
+
+SLW 05/2025
+"""
+
+import sys
+import json
+import time
+import queue
+import random
+import logging
+import argparse
+import threading
+import contextlib
+from collections import deque
+
+from hbs_collections import Msg
+from hbs_collections import SysStatus
+from hbs_commands import CommandRegistry
+from hbs_commands import ARGS_XZ, ARGS_XZ_NEW
+from hbs_mqtt_client import TOPIC_SUB, TOPIC_RESULT, TOPIC_STATUS
+from hbs_stats import Histogram
+
+DEFAULT_MIX = "store=3,destore=3,rearrange=1,show_occupancy=1"
+# Read-only queries: operation -> prefix of the result
+QUERIES = {"occupancy_bits": "occupancy_bits:", "position": "position:", "queue": "queue:"}
+OPERATIONS = ("store", "destore", "rearrange", "show_occupancy", "store_random", "destore_random") + tuple(QUERIES)
+DRAIN_TIMEOUT = 60.0        # seconds to wait for the outstanding results
+TIME_SCALE = 20.0           # the simulated crane runs faster than real time
+# Upper bounds of the latency buckets in seconds
+BUCKETS = (0.01, 0.1, 1.0, 10.0, 60.0, 300.0)
+
+
+class LocalBroker:
+    """ In-process stand-in of the MQTT broker. The messages are delivered in the order of publication
+        by a separate thread, like the network thread of paho. """
+
+    def __init__(self):
+        self._subscribers = {}      # topic -> list of callbacks (topic, payload)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._deliver, name="LocalBroker", daemon=True)
+        self._thread.start()
+
+
+    def subscribe(self, topic, callback):
+        self._subscribers.setdefault(topic, []).append(callback)
+
+
+    def publish(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._queue.put((topic, payload))
+
+
+    def _deliver(self):
+        logname = "LocalBroker._deliver"
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            topic, payload = message
+            for callback in list(self._subscribers.get(topic, ())):
+                try:
+                    callback(topic, payload)
+                except Exception:
+                    logging.exception("%s: callback failed on %s", logname, topic)
+
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class PahoTransport:
+    """ Connection to the MQTT broker of a running system, same interface as LocalBroker """
+
+    def __init__(self, broker):
+        import paho.mqtt.client as mqtt
+        from hbs_mqtt_client import SERVER_PORT, MQTT_USERNAME, MQTT_PASSWORD, QOS
+
+        self._qos = QOS
+        self._connected = threading.Event()
+        self.client = mqtt.Client()
+        self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        self.client.on_connect = lambda client, userdata, flags, rc: rc == 0 and self._connected.set()
+        self.client.connect(broker, SERVER_PORT)
+        self.client.loop_start()
+        if not self._connected.wait(10.0):
+            raise OSError("no connection to the MQTT broker " + broker)
+
+
+    def subscribe(self, topic, callback):
+        self.client.message_callback_add(topic, lambda client, userdata, msg: callback(msg.topic, msg.payload))
+        self.client.subscribe(topic, self._qos.get(topic, 0))
+
+
+    def publish(self, topic, payload):
+        self.client.publish(topic, payload, self._qos.get(topic, 0))
+
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class SimHBS:
+    """ Simulated system on the local broker: message flow of hbs_main, crane of hbs_simulator """
+
+    def __init__(self, broker, fill=0.5, time_scale=TIME_SCALE, seed=None):
+        from hbs_simulator import KinematicModel, SimOperator, SimController
+
+        random.seed(seed)           # the random places of HBSController
+        self.broker = broker
+        self.time_scale = time_scale
+        self.op = SimOperator(KinematicModel())
+        self.ctr = SimController(self.op, fill, random.Random(seed))
+        self._status = None
+        self._cmd_buffer = deque()              # (result, command, arguments)
+        self._cmd_event = threading.Event()
+        self._stop = False
+        self._commands = CommandRegistry()
+        self._commands.register("store", self.ctr.store_box, ARGS_XZ)
+        self._commands.register("destore", self.ctr.destore_box, ARGS_XZ)
+        self._commands.register("rearrange", self.ctr.rearrange_box, ARGS_XZ_NEW)
+        self._commands.register("store_random", self.ctr.store_box_random)
+        self._commands.register("destore_random", self.ctr.destore_box_random)
+        self._commands.register("show_occupancy", self.show_occupancy)
+        self._commands.register("occupancy_bits", self.get_occupancy_bits, read_only=True)
+        self._commands.register("position", self.get_position, read_only=True)
+        self._commands.register("queue", self.get_queue, read_only=True)
+        broker.subscribe(TOPIC_SUB, self._message_handler)
+        self._thread = threading.Thread(target=self.run, name="SimHBS", daemon=True)
+        self._thread.start()
+
+
+    def show_occupancy(self):
+        return 'occupancy:' + self.ctr.occupancy_bits.to_string()
+
+
+    def get_occupancy_bits(self):
+        return 'occupancy_bits:' + self.ctr.occupancy_bits.to_base64()
+
+
+    def get_position(self):
+        op = self.op
+        return 'position:' + json.dumps({"x": op.x, "y": op.y.name, "z": op.z})
+
+
+    def get_queue(self):
+        return 'queue:' + json.dumps([{"operation": cmd.name, "args": list(args)}
+                                      for result, cmd, args in list(self._cmd_buffer) if cmd is not None])
+
+
+    def _message_handler(self, topic, payload):
+        """ Decodes a command, answers queries immediately and queues the commands for the crane """
+        result, cmd, args = self._commands.decode(payload)
+        if result is Msg.okay and cmd.read_only:
+            self.broker.publish(TOPIC_RESULT, cmd.handler(*args))
+            return
+        self._cmd_buffer.append((result, cmd, args))
+        self._cmd_event.set()
+
+
+    def run(self):
+        """ Executes the queued commands. The crane moves take the simulated time divided by time_scale. """
+        logname = "SimHBS.run"
+        self.set_status(SysStatus.ready)
+        while not self._stop:
+            if not self._cmd_buffer:
+                self._cmd_event.wait(0.1)
+                self._cmd_event.clear()
+                continue
+            self.set_status(SysStatus.busy)
+            result, cmd, args = self._cmd_buffer.popleft()
+            if result is Msg.okay:
+                t_start = self.op.now
+                try:
+                    result = cmd.handler(*args)
+                except Exception:
+                    logging.exception("%s: %s failed", logname, cmd.name)
+                    result = Msg.err_internal
+                time.sleep((self.op.now - t_start) / self.time_scale)
+            self.broker.publish(TOPIC_RESULT, result.name if isinstance(result, Msg) else result)
+            if not self._cmd_buffer:
+                self.set_status(SysStatus.ready)
+
+
+    def set_status(self, status):
+        if status != self._status:
+            self._status = status
+            self.broker.publish(TOPIC_STATUS, SysStatus(status).name)
+
+
+    def stop(self):
+        self._stop = True
+        self._cmd_event.set()
+        self._thread.join()
+
+
+def parse_mix(mix):
+    """ Parses a command mix like 'store=3,destore=3,show_occupancy=1'. Returns {operation: weight}. """
+    weights = {}
+    for item in mix.split(','):
+        operation, _, weight = item.strip().partition('=')
+        operation = operation.strip().lower()
+        if operation not in OPERATIONS:
+            raise ValueError("unknown operation in mix: " + operation)
+        weights[operation] = float(weight) if weight else 1.0
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("empty mix")
+    return weights
+
+
+def buckets(latencies):
+    """ Number of latencies per bucket: {'<=0.01': n, ..., '>300.0': n} """
+    counts = dict.fromkeys(["<=" + str(bound) for bound in BUCKETS] + [">" + str(BUCKETS[-1])], 0)
+    for latency in latencies:
+        for bound in BUCKETS:
+            if latency <= bound:
+                counts["<=" + str(bound)] += 1
+                break
+        else:
+            counts[">" + str(BUCKETS[-1])] += 1
+    return counts
+
+
+class LoadGenerator:
+    """ Publishes the commands of a mix and measures the latency of their results """
+
+    def __init__(self, transport, mix, rate, process="poisson", seed=None):
+        self.transport = transport
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.rate = rate                    # commands per second
+        self.process = process
+        self.rng = random.Random(seed)
+        self._pending = deque()             # crane commands: (operation, time sent)
+        self._pending_queries = {prefix: deque() for prefix in QUERIES.values()}
+        self._latencies = {}                # operation -> list of latencies
+        self._results = {}                  # operation -> {result name: count}
+        self._status = {}                   # status -> number of changes
+        self._unmatched = 0
+        self._sent = {}
+        self._t_first = self._t_last = None
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        transport.subscribe(TOPIC_RESULT, self._on_result)
+        transport.subscribe(TOPIC_STATUS, self._on_status)
+
+
+    def message(self, operation):
+        """ Returns the MQTT message of an operation with random storage places """
+        rng = self.rng
+        msg = {"operation": operation.upper()}
+        if operation in ("store", "destore", "rearrange"):
+            msg.update(x=rng.randint(1, 10), z=rng.randint(1, 5))
+        if operation == "rearrange":
+            msg.update(x_new=rng.randint(1, 10), z_new=rng.randint(1, 5))
+        return json.dumps(msg)
+
+
+    def _send(self, operation):
+        payload = self.message(operation)
+        with self._lock:
+            t = time.monotonic()
+            if self._t_first is None:
+                self._t_first = t
+            if operation in QUERIES:
+                self._pending_queries[QUERIES[operation]].append((operation, t))
+            else:
+                self._pending.append((operation, t))
+            self._sent[operation] = self._sent.get(operation, 0) + 1
+        self.transport.publish(TOPIC_SUB, payload)
+
+
+    def _on_result(self, topic, payload):
+        """ Matches a result to its command: queries by the prefix, crane commands in FIFO order """
+        t = time.monotonic()
+        result = payload.decode(errors="replace") if isinstance(payload, bytes) else str(payload)
+        name = result.partition(':')[0]
+        with self._lock:
+            pending = self._pending_queries.get(name + ':')
+            if not pending:
+                pending = self._pending
+            if not pending:
+                self._unmatched += 1
+                return
+            operation, t_sent = pending.popleft()
+            self._latencies.setdefault(operation, []).append(t - t_sent)
+            results = self._results.setdefault(operation, {})
+            results[name] = results.get(name, 0) + 1
+            self._t_last = t
+            self._done.notify_all()
+
+
+    def _on_status(self, topic, payload):
+        status = payload.decode(errors="replace") if isinstance(payload, bytes) else str(payload)
+        with self._lock:
+            self._status[status] = self._status.get(status, 0) + 1
+
+
+    @property
+    def outstanding(self):
+        return len(self._pending) + sum(len(pending) for pending in self._pending_queries.values())
+
+
+    def run(self, duration=None, count=None, drain=DRAIN_TIMEOUT):
+        """ Publishes commands for duration seconds and/or count commands, then waits up to drain seconds
+            for the outstanding results. Returns the report. """
+        t_start = time.monotonic()
+        t_next, n = t_start, 0
+        while (count is None or n < count) and (duration is None or t_next - t_start < duration):
+            delay = t_next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._send(self.rng.choices(self.operations, self.weights)[0])
+            n += 1
+            t_next += self.rng.expovariate(self.rate) if self.process == "poisson" else 1.0 / self.rate
+        t_sent = time.monotonic()
+        with self._done:
+            self._done.wait_for(lambda: self.outstanding == 0, drain)
+        return self.report(t_sent - t_start)
+
+
+    def report(self, send_time):
+        """ Returns the report as dictionary (JSON compatible) """
+        with self._lock:
+            operations, all_latencies = {}, []
+            for operation, sent in sorted(self._sent.items()):
+                latencies = self._latencies.get(operation, [])
+                all_latencies.extend(latencies)
+                hist = Histogram(len(latencies) or 1)
+                for latency in latencies:
+                    hist.add(latency)
+                operations[operation] = {"sent": sent, "results": self._results.get(operation, {}),
+                                         "latency": hist.summary(), "buckets": buckets(latencies)}
+            total = Histogram(len(all_latencies) or 1)
+            for latency in all_latencies:
+                total.add(latency)
+            sent = sum(self._sent.values())
+            elapsed = (self._t_last - self._t_first) if self._t_last is not None else 0.0
+            return {"sent": sent, "answered": len(all_latencies), "outstanding": self.outstanding,
+                    "unmatched": self._unmatched,
+                    "send_rate_per_s": round(sent / send_time, 3) if send_time > 0 else 0.0,
+                    "throughput_per_s": round(len(all_latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+                    "latency": total.summary(), "buckets": buckets(all_latencies),
+                    "operations": operations, "status": dict(self._status)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MQTT load generator of the high bay storage system")
+    parser.add_argument("--broker", help="MQTT broker of a running system, default: local simulated system")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operations with weights, default: " + DEFAULT_MIX)
+    parser.add_argument("--rate", type=float, default=1.0, help="commands per second")
+    parser.add_argument("--process", choices=("poisson", "constant"), default="poisson", help="arrival process")
+    parser.add_argument("--duration", type=float, help="seconds to send commands")
+    parser.add_argument("--count", type=int, help="number of commands to send")
+    parser.add_argument("--drain", type=float, default=DRAIN_TIMEOUT, help="seconds to wait for the results")
+    parser.add_argument("--time-scale", type=float, default=TIME_SCALE, help="speed of the simulated crane")
+    parser.add_argument("--fill", type=float, default=0.5, help="initial fill level of the simulated rack")
+    parser.add_argument("--seed", type=int, help="seed of the random generators")
+    args = parser.parse_args(argv)
+    if args.duration is None and args.count is None:
+        parser.error("--duration or --count is required")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as err:
+        parser.error(str(err))
+
+    logging.basicConfig(level=logging.WARNING)
+    sim = None
+    # The decoder and the controller print rejected commands, the report is written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.broker:
+            transport = PahoTransport(args.broker)
+        else:
+            transport = LocalBroker()
+            sim = SimHBS(transport, args.fill, args.time_scale, args.seed)
+        loadgen = LoadGenerator(transport, mix, args.rate, args.process, args.seed)
+        report = loadgen.run(args.duration, args.count, args.drain)
+        if sim is not None:
+            sim.stop()
+        transport.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
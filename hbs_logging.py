@@ -0,0 +1,174 @@
+""" hbs_logging.py
+
+Low overhead logging for the high bay storage system.
+
+- setup_logging() routes the standard logging module through a queue. The log file is written by a
+  background thread and rotated by size, old files are compressed with gzip.
+- EventLog keeps structured event records (monotonic timestamp, kind, axis, target, duration, result)
+  in an in-memory ring buffer. A background writer flushes them as JSON lines to a rotated file.
+  Recording an event only appends a tuple, formatting is done by the writer.
+
+SLW 05/2025
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import queue
+import shutil
+import logging
+import threading
+import logging.handlers
+from collections import deque
+from collections import namedtuple
+
+LOG_DIR = "logfiles"
+LOG_FILE = "hbs.log"
+EVENT_FILE = "hbs_events.jsonl"
+MAX_BYTES = 1024 * 1024         # rotate files at 1 MB
+BACKUP_COUNT = 5                # number of compressed files to keep
+
+Event = namedtuple("Event", ("t", "level", "kind", "axis", "target", "duration", "result"))
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    """ Compresses a rotated log file """
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def setup_logging(log_dir=LOG_DIR, level=logging.INFO, console=False):
+    """ Configures the logging module: the callers only put the records into a queue,
+        a listener thread writes them to a rotated, compressed log file (and optionally to the console).
+        Starts the writer of the event log as well.
+        Returns the listener, which should be stopped at the end of the program. """
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, LOG_FILE),
+                                                        maxBytes=MAX_BYTES,
+                                                        backupCount=BACKUP_COUNT)
+    file_handler.namer = _gzip_namer
+    file_handler.rotator = _gzip_rotator
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s',
+                                                datefmt='%Y-%m-%d %H:%M:%S'))
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    events.start(log_dir)
+    return listener
+
+
+class EventLog:
+    """ Structured event log with an in-memory ring buffer and a background file writer """
+
+    def __init__(self, ring_size=1000, level=logging.INFO, flush_interval=1.0,
+                 max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.level = level
+        self._ring = deque(maxlen=ring_size)
+        self._pending = deque(maxlen=10 * ring_size)
+        self._flush_interval = flush_interval
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._filename = None
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+
+    def record(self, kind, axis=None, target=None, duration=None, result=None, level=logging.INFO):
+        """ Records an event. Costs a single tuple, nothing is formatted here. """
+        if level < self.level:
+            return
+        event = Event(time.monotonic(), level, kind, axis, target, duration, result)
+        self._ring.append(event)
+        if self._thread is not None:
+            self._pending.append(event)
+
+
+    def recent(self, count=None):
+        """ Returns the last events from the ring buffer (oldest first) """
+        events = list(self._ring)
+        if count is not None:
+            events = events[-count:]
+        return events
+
+
+    def start(self, log_dir=LOG_DIR):
+        """ Starts the background writer """
+        if self._thread is not None:
+            return
+        self._filename = os.path.join(log_dir, EVENT_FILE)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="EventLogWriter", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """ Stops the writer after flushing all pending events """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def _run(self):
+        # Wall clock time of the monotonic zero point, used for readable timestamps in the file
+        offset = time.time() - time.monotonic()
+        self._file = open(self._filename, "a", encoding="UTF-8")
+        while not self._stop.wait(self._flush_interval):
+            self._flush(offset)
+        self._flush(offset)
+        self._file.close()
+        self._file = None
+
+
+    def _flush(self, offset):
+        if not self._pending:
+            return
+        lines = []
+        while self._pending:
+            event = self._pending.popleft()
+            record = event._asdict()
+            record["t"] = round(event.t, 4)
+            record["time"] = round(event.t + offset, 3)
+            for key in ("target", "result"):
+                if hasattr(record[key], "name"):    # Msg, YPos
+                    record[key] = record[key].name
+            if event.duration is not None:
+                record["duration"] = round(event.duration, 4)
+            lines.append(json.dumps(record, default=str))
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+        if self._file.tell() >= self._max_bytes:
+            self._rotate()
+
+
+    def _rotate(self):
+        """ Compresses the current file and starts a new one """
+        self._file.close()
+        for idx in range(self._backup_count - 1, 0, -1):
+            src = "{}.{}.gz".format(self._filename, idx)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}.gz".format(self._filename, idx + 1))
+        _gzip_rotator(self._filename, self._filename + ".1.gz")
+        self._file = open(self._filename, "a", encoding="UTF-8")
+
+
+# Event log of the system, used like the logging module
+events = EventLog()
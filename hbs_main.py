@@ -7,9 +7,10 @@ SLW 03/2025
 
 import os
 import logging
-import time
 import json
+import threading
 from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
 
 from hbs_collections import SysStatus
 from hbs_collections import Msg
@@ -17,8 +18,19 @@ from hbs_collections import YPos
 from hbs_user_terminal import UserTerminal
 from hbs_controller import HBSController
 from hbs_mqtt_client import MQTTClient
+from hbs_commands import CommandRegistry
+from hbs_commands import ARGS_XZ, ARGS_XZ_NEW
+from hbs_startup import StartupSequencer
+from hbs_bitset import OccupancyBitset
+from hbs_trace import TraceRecorder
+import hbs_logging
 
 HOME_DIR = os.path.join("/home", os.getlogin(), "iot", "high_bay_storage")
+STATS_FILE = os.path.join("logfiles", "hbs_stats.json")
+MQTT_TIMEOUT = 10.0     # seconds to wait for the connection to the broker
+STORE_COMMANDS = ("store", "store_random")                          # jobs fetching a box from the input belt
+# jobs using the belts or the input station (calibrate drives the fork into the input station)
+BELT_COMMANDS = STORE_COMMANDS + ("destore", "destore_random", "calibrate")
 DEBUG = False
 
 
@@ -28,37 +40,79 @@ class HBS:
         logname = "HBS:__init__"
         
         os.chdir(HOME_DIR)
-        now = time.localtime()
-        log_filename = os.path.join("logfiles",
-                                    "hbs_{:04d}-{:02d}-{:02d}_{:02d}-{:02d}-{:02d}.log".format(
-                                    now[0], now[1], now[2], now[3], now[4], now[5]))
-        logging.basicConfig(filename = log_filename,
-                            format='%(asctime)s %(levelname)-8s %(message)s',
-                            level=logging.INFO,
-                            datefmt='%Y-%m-%d %H:%M:%S')
+        self._log_listener = hbs_logging.setup_logging()
+        self.trace = TraceRecorder()            # workload trace of the received commands
+        self.trace.start()
         logging.info(logname + "HBS program start")
                 
         self.ut = UserTerminal()
-        self.ut.wait_for_any_key(1)
         self.hbs_ctr = HBSController(self.ut)
-        self.mqttc = MQTTClient(server_ip=self.ut.get_ip())
+        self.mqttc = MQTTClient()           # the broker address is set after the network detection
         self._status = SysStatus.busy
         self._prog_end = False
         self._manual_axis = -1   		# -1 -> off, 0 -> X, 1 -> y, 2 -> z
         self._sys_shutdown = False
-        self._cmd_buffer = []
-        self._cmd_functions = {
-            "store"     : 		(self.hbs_ctr.store_box, 2),
-            "destore"   : 		(self.hbs_ctr.destore_box, 2),
-            "rearrange" : 		(self.hbs_ctr.rearrange_box, 4),
-            "store_random": 	(self.hbs_ctr.store_box_random, 0),
-            "destore_random": 	(self.hbs_ctr.destore_box_random, 0),
-            "init_x"    : 		(self.hbs_ctr.op.init_xpos, 0),
-            "init_y"    : 		(self.hbs_ctr.op.init_ypos, 0),
-            "init_z"    : 		(self.hbs_ctr.op.init_zpos, 0),
-            "show_occupancy":   (self.show_occupancy, 0),
-            "shutdown"  :   	(self.init_shutdown, 0)
-        }
+        self._cmd_buffer = []                   # (result, command, arguments, trace entry)
+        self._cmd_event = threading.Event()     # set when a command is received
+        self._current_cmd = None                # command executed by the run loop
+        self._lookahead_lock = threading.Lock()
+        self._running = False                   # set while the run loop accepts commands
+        self._published_occupancy = OccupancyBitset(0)
+        self._position = (-1, YPos.UNDEFINED, -1)   # crane position after the last command, see publish_state
+        self._commands = CommandRegistry()
+        self._commands.register("store", self.hbs_ctr.store_box, ARGS_XZ)
+        self._commands.register("destore", self.hbs_ctr.destore_box, ARGS_XZ)
+        self._commands.register("rearrange", self.hbs_ctr.rearrange_box, ARGS_XZ_NEW)
+        self._commands.register("store_random", self.hbs_ctr.store_box_random)
+        self._commands.register("destore_random", self.hbs_ctr.destore_box_random)
+        self._commands.register("init_x", self.hbs_ctr.op.init_xpos)
+        self._commands.register("init_y", self.hbs_ctr.op.init_ypos)
+        self._commands.register("init_z", self.hbs_ctr.op.init_zpos)
+        self._commands.register("show_occupancy", self.show_occupancy)
+        self._commands.register("calibrate", self.hbs_ctr.calibrate)
+        # Read-only queries, answered immediately, even while the crane is moving
+        self._commands.register("occupancy", self.get_occupancy, read_only=True)
+        self._commands.register("occupancy_bits", self.get_occupancy_bits, read_only=True)
+        self._commands.register("slot", self.get_slot, ARGS_XZ, read_only=True)
+        self._commands.register("position", self.get_position, read_only=True)
+        self._commands.register("queue", self.get_queue, read_only=True)
+        self._commands.register("stats", self.show_stats, read_only=True)
+        self._commands.register("drift", self.show_drift, read_only=True)
+        self._commands.register("travel_times", self.show_travel_times, read_only=True)
+        self._commands.register("drift_reset", self.reset_drift)
+        self.hbs_ctr.op.drift.on_warning = self._drift_warning
+        self._commands.register("shutdown", self.init_shutdown)
+
+
+    def startup(self):
+        """ Runs the startup phases concurrently:
+            - network detection and connection to the MQTT broker
+            - loading of the storage file
+            - initialization of the axes
+            Returns True, if all phases were successful. """
+        logname = "HBS.startup"
+        seq = StartupSequencer()
+        # The statistics must be loaded before the first axis move records its times
+        seq.run("statistics", self.hbs_ctr.load_statistics)
+        seq.start("connect", self._connect, seq)
+        seq.start("storage", self.load_storage)
+        success = seq.run("axes", self.start_operator)
+        success = seq.wait("storage") and success
+        success = seq.wait("connect") and success
+        timings = seq.report()
+        print(logname + ": Startup times [s]: " + str(timings))
+        self.publish_state()
+        return success
+
+
+    def _connect(self, seq):
+        """ Detects the network and connects to the MQTT broker running on this system """
+        with seq.phase("network"):
+            if not self.ut.detect_network():
+                return False
+        self.mqttc.server_ip = self.ut.get_ip()
+        with seq.phase("mqtt"):
+            return self.start_mqtt()
 
 
     def load_storage(self):
@@ -78,28 +132,105 @@ class HBS:
             String format: 'occupancy:_**_**_*______*______**_**__*_********___***_*_*__' """
         logname = "HBS:show:_occupancy"
         self.ut.show_occupancy(self.hbs_ctr.occupancy)
-        # generate occupancy string for return message
-        ocp = 'occupancy:'
-        for key in range(1, 51):
-            if self.hbs_ctr.occupancy[key]['taken']:
-                ocp += '*'
-            else:
-                ocp += '_'
+        ocp = 'occupancy:' + self.hbs_ctr.occupancy_bits.to_string()
         logging.info(logname + ": " + ocp)
         return ocp
         
+        
+    # Read-only queries --------------------------------------------------------------
+    """ The queries are executed in the thread of the MQTT client.
+        They must only read the snapshot of the storage places and thread safe data. """
+    
+    def get_occupancy(self):
+        """ Returns the occupancy string, format like show_occupancy """
+        return 'occupancy:' + self.hbs_ctr.occupancy_bits.to_string()
+    
+    
+    def get_occupancy_bits(self):
+        """ Returns the occupancy as bitset, bit n-1 for place n, base64 encoded (little endian).
+            String format: 'occupancy_bits:AAAAAAAAAA==' """
+        return 'occupancy_bits:' + self.hbs_ctr.occupancy_bits.to_base64()
+    
+    
+    def get_slot(self, x, z):
+        """ Returns the state of a storage place.
+            String format: 'slot:{"x": 3, "z": 2, "taken": true, "timestamp": 1746000000.0}' """
+        place = self.hbs_ctr.slot_state(x, z)
+        if place is None:
+            return Msg.err_wrong_args
+        return 'slot:' + json.dumps({"x": x, "z": z, "taken": place['taken'], "timestamp": place['timestamp']})
+    
+    
+    def get_position(self):
+        """ Returns the position of the crane after the last command, recorded by the run loop.
+            The sensors are not read, the query must not interfere with a running move.
+            String format: 'position:{"x": 3, "y": "DEFAULT", "z": 2}' """
+        xpos, ypos, zpos = self._position
+        return 'position:' + json.dumps({"x": xpos, "y": ypos.name, "z": zpos})
+    
+    
+    def get_queue(self):
+        """ Returns the pending commands.
+            String format: 'queue:[{"operation": "store", "args": [3, 2]}]' """
+        queue = [{"operation": cmd.name, "args": list(args)}
+                 for result, cmd, args, entry in list(self._cmd_buffer) if cmd is not None]
+        return 'queue:' + json.dumps(queue)
+        
+        
+    def _run_query(self, cmd, args, entry):
+        """ Executes a read-only query and publishes the result """
+        logname = "HBS._run_query"
+        self.trace.started(entry)
+        try:
+            result = cmd.handler(*args)
+        except Exception:
+            logging.exception("%s: %s failed", logname, cmd.name)
+            result = Msg.err_internal
+        if isinstance(result, Msg):
+            result = result.name
+        self.mqttc.send_result(result)
+        self.trace.finished(entry, result)
+        
     
+    def show_stats(self):
+        """ Returns the cycle time statistics via MQTT. The local stats file is written at the program end.
+            String format: 'stats:{"moves": {...}, "operations": {...}, "errors": {...}}' """
+        return 'stats:' + self.hbs_ctr.stats.to_json()
+        
+        
+    def show_drift(self):
+        """ Returns the segments with increased travel times via MQTT.
+            String format: 'drift:{"x/3/4/False": 12.5}' (slowdown in percent) """
+        return 'drift:' + json.dumps(self.hbs_ctr.op.drift.status())
+        
+        
+    def show_travel_times(self):
+        """ Returns the calibrated travel times via MQTT.
+            String format: 'travel_times:{"calibrated": ..., "axes": {"x": {"up": {"1": 1.2, ...}}}, ...}' """
+        return 'travel_times:' + self.hbs_ctr.travel_times.to_json()
+        
+        
+    def reset_drift(self):
+        """ Resets the travel time baselines, e.g. after maintenance """
+        self.hbs_ctr.op.drift.reset()
+        return Msg.okay
+        
+        
+    def _drift_warning(self, segment, slowdown):
+        """ Callback of the drift detection, publishes a warning via MQTT """
+        logname = "HBS._drift_warning"
+        warning = 'drift:' + json.dumps({"segment": '/'.join(str(k) for k in segment),
+                                         "slowdown": round(100 * slowdown, 1)})
+        logging.warning(logname + ": " + warning)
+        self.mqttc.send_warning(warning)
+        
+        
     def start_mqtt(self):
         if not self.mqttc.connect(self._mqtt_message_handler):
             self.ut.print_msg("err_mqtt")
             return False
         # Wait for the MQTT client to be up and running
-        for idx in range(10):
-            if self.mqttc.is_connected:
-                break
-            time.sleep(1)
-        # Check whether we are online
-        if idx >= 10:
+        if not self.mqttc.wait_connected(MQTT_TIMEOUT):
             self.ut.print_msg("err_mqtt")
             return False
         # All okay
@@ -111,10 +242,40 @@ class HBS:
         """ Callback-Funktion für die MQTT Messages """
         logname = "HBS._mqtt_message_handler"
         
-        payload = json_msg.payload.decode().casefold()
-        logging.info(logname + ": Message received: " + payload)
-        print(logname + ": Message received: " + payload)
-        self._cmd_buffer.append(payload)
+        payload = json_msg.payload
+        msg = logname + ": Message received: " + payload.decode(errors="replace")
+        logging.info(msg)
+        print(msg)
+        entry = self.trace.received(payload)
+        result, cmd, args = self.decode_json(payload)
+        # Queries are answered immediately, all other commands wait for the crane
+        if result is Msg.okay and cmd.read_only:
+            self._run_query(cmd, args, entry)
+            return
+        self._cmd_buffer.append((result, cmd, args, entry))
+        self.mqttc.send_queue_depth(len(self._cmd_buffer))
+        if len(self._cmd_buffer) == 1:
+            self._look_ahead()
+        self._cmd_event.set()
+        
+        
+    def _look_ahead(self):
+        """ Prepares the next queued job while the current one is executed.
+            If the next job stores a box, the input belt stages it as soon as the belts are free:
+            immediately, if the current job does not use the belts, otherwise the operator starts
+            the belt after the box has been lifted or dropped.
+            Nothing is staged before the run loop is started (e.g. while the axes are initialized),
+            after an error or while the emergency stop is latched. """
+        with self._lookahead_lock:
+            next_job = self._cmd_buffer[0] if self._cmd_buffer else None
+            next_store = next_job is not None and next_job[0] is Msg.okay and next_job[1].name in STORE_COMMANDS
+            if not self._running or self._status not in (SysStatus.busy, SysStatus.ready) or self.ut.get_bt_red():
+                next_store = False
+            current = self._current_cmd
+            if next_store and (current is None or current.name not in BELT_COMMANDS):
+                self.hbs_ctr.op.conveyor.start_input()
+                next_store = False
+            self.hbs_ctr.op.stage_next = next_store
         
 
     def start_operator(self):
@@ -122,142 +283,116 @@ class HBS:
         logging.info(logname)
         self.set_status(SysStatus.busy)
 
-        for ax in ('y', 'z', 'x'):
-            self.ut.print_msg("init_" + ax)
-            if ax == 'y':
-                result = success = self.hbs_ctr.op.init_ypos()
-            elif ax == 'z':
-                result = self.hbs_ctr.op.init_zpos()
-            else:
-                result = self.hbs_ctr.op.init_xpos()
+        # Warm restart: axes, which are still at the position saved at the last shutdown, are not initialized
+        confirmed = self.hbs_ctr.restore_position()
+        if confirmed:
+            self.ut.print_msg("warm_start", ''.join(sorted(confirmed)).upper())
+
+        # Y first, the fork must be in the default position before X or Z move
+        result = Msg.okay
+        if 'y' not in confirmed or self.hbs_ctr.op.get_ypos() is not YPos.DEFAULT:
+            self.ut.print_msg("init_y")
+            result = self.hbs_ctr.op.init_ypos()
             self.ut.print_msg(result.name)
-            if result is not Msg.okay:
-                self.set_status(SysStatus.error)
-                return False
+        inits = [(ax, init) for ax, init in (('z', self.hbs_ctr.op.init_zpos), ('x', self.hbs_ctr.op.init_xpos))
+                 if ax not in confirmed]
+        if result is Msg.okay and inits:
+            # X and Z are independent of each other (move_xzpos moves them simultaneously as well)
+            for ax, _ in inits:
+                self.ut.print_msg("init_" + ax)
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="init") as pool:
+                futures = [pool.submit(init) for _, init in inits]
+                results = [future.result() for future in futures]
+            for result in results:
+                self.ut.print_msg(result.name)
+            result = next((r for r in results if r is not Msg.okay), Msg.okay)
+        if result is not Msg.okay:
+            self.set_status(SysStatus.error)
+            return False
         
         self.set_status(SysStatus.ready)
         return True
 
     
     def run_manual(self):
-        """ Checks teh keyboard for any input, and takes action if needed. """
-        bts = self.ut.get_buttons()
-        
-        # Check green and yellow button -> program end
-        if bts[1] and bts[2]:
-            self._prog_end = True
-            
-        # Check green and red button -> system shutdown
-        if bts[1] and bts[3]:
-            self._prog_end = True
-            self._sys_shutdown = True
-        
-        # Check blue button
-        if bts[0] == True:
-            if self._manual_axis < 0:
-                self._manual_axis = 0
-            else:
-                self._manual_axis += 1
-                if self._manual_axis >= 3:
-                    self._manual_axis = 0
+        """ Handles the button events of the user terminal, and takes action if needed. """
+        while not self._prog_end:
+            event = self.ut.get_button_event()
+            if event is None:
+                break
+            button, pressed = event
+            if not pressed:
+                continue
+            bts = self.ut.get_buttons()
             
-            self.ut.show_axis(self._manual_axis, self.hbs_ctr)
-            # Wait for the button to be released
-            while self.ut.get_buttons()[0]:
-                time.sleep(0.05)
+            # Check green and yellow button -> program end
+            if bts[1] and bts[2]:
+                self._prog_end = True
                 
-        if self._manual_axis >= 0:
-            # check green button
-            if bts[1] == True:
-                if self._manual_axis == 0:
-                    if self.hbs_ctr.x > 1:
-                        self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
-                        self.hbs_ctr.op.move_xpos(self.hbs_ctr.x - 1)
-                elif self._manual_axis == 1:
-                    if self.hbs_ctr.y.value >= 1:
-                        self.hbs_ctr.op.move_ypos(YPos(self.hbs_ctr.y.value - 1))
+            # Check green and red button -> system shutdown
+            if bts[1] and bts[3]:
+                self._prog_end = True
+                self._sys_shutdown = True
+            
+            # Blue button while the emergency stop is latched -> reset by the operator
+            if button == 0 and self.ut.get_bt_red():
+                if self.ut.reset_emergency():
+                    self.ut.set_ready()
+                    self.ut.print_msg("emrg_reset")
+                    if self._status is SysStatus.error:
+                        self.set_status(SysStatus.ready)
                 else:
-                    if self.hbs_ctr.z > 0:
-                        self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
-                        self.hbs_ctr.op.move_zpos(self.hbs_ctr.z - 1)
-                        
+                    self.ut.print_msg(Msg.err_emrg_stop.name)
+                continue
+            
+            # Check blue button
+            if button == 0:
+                if self._manual_axis < 0:
+                    self._manual_axis = 0
+                else:
+                    self._manual_axis += 1
+                    if self._manual_axis >= 3:
+                        self._manual_axis = 0
                 self.ut.show_axis(self._manual_axis, self.hbs_ctr)
-                while self.ut.get_buttons()[1]:
-                    time.sleep(0.05)
-            # check yellow button        
-            elif bts[2] == True:
-                if self._manual_axis == 0:
-                    if self.hbs_ctr.x < 10:
-                        self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
-                        self.hbs_ctr.op.move_xpos(self.hbs_ctr.x + 1)
-                elif self._manual_axis == 1:
-                    if self.hbs_ctr.y.value < 2:
-                        self.hbs_ctr.op.move_ypos(YPos(self.hbs_ctr.y.value + 1))
+                    
+            elif self._manual_axis >= 0 and not self._prog_end and button in (1, 2):
+                if self.ut.get_bt_red():
+                    self.ut.print_msg(Msg.err_emrg_stop.name)
+                    continue
+                # check green button
+                if button == 1:
+                    if self._manual_axis == 0:
+                        if self.hbs_ctr.x > 1:
+                            self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
+                            self.hbs_ctr.op.move_xpos(self.hbs_ctr.x - 1)
+                    elif self._manual_axis == 1:
+                        if self.hbs_ctr.y.value >= 1:
+                            self.hbs_ctr.op.move_ypos(YPos(self.hbs_ctr.y.value - 1))
+                    else:
+                        if self.hbs_ctr.z > 0:
+                            self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
+                            self.hbs_ctr.op.move_zpos(self.hbs_ctr.z - 1)
+                # check yellow button        
                 else:
-                    if self.hbs_ctr.z < 10:
-                        self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
-                        self.hbs_ctr.op.move_zpos(self.hbs_ctr.z + 1)
-                        
+                    if self._manual_axis == 0:
+                        if self.hbs_ctr.x < 10:
+                            self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
+                            self.hbs_ctr.op.move_xpos(self.hbs_ctr.x + 1)
+                    elif self._manual_axis == 1:
+                        if self.hbs_ctr.y.value < 2:
+                            self.hbs_ctr.op.move_ypos(YPos(self.hbs_ctr.y.value + 1))
+                    else:
+                        if self.hbs_ctr.z < 10:
+                            self.hbs_ctr.op.move_ypos(YPos.DEFAULT)
+                            self.hbs_ctr.op.move_zpos(self.hbs_ctr.z + 1)
                 self.ut.show_axis(self._manual_axis, self.hbs_ctr)
-                while self.ut.get_buttons()[2]:
-                    time.sleep(0.05)
+                self.publish_state()
                 
                 
     def decode_json(self, payload):
-        """ Decords the received message. Checks fpr the right syntax. Extracts command and arguments.
+        """ Decodes the received message. Checks for the right syntax. Extracts command and arguments.
             Returns: message, command, arguments. """
-        logname = "HBS:decode_json"
-        if DEBUG:
-            print(logname + ": " + payload)
-            
-        # Convert json format to Python dictionary
-        json_format_okay = True
-        try:
-            json_dict = json.loads(payload)
-        except json.JSONDecodeError:
-            json_format_okay = False
-        if not json_format_okay:
-            msg = logname + ": JSON format error"
-            logging.error(msg)
-            print(msg)
-            return Msg.err_json_format, "", []
-        # Extract the requested action
-        if "operation" not in json_dict.keys():
-            msg = logname + ": keyword 'operation' missing"
-            logging.error(msg)
-            print(msg)
-            return Msg.err_json_noop, "", []
-        # Check if the command is available
-        cmd = json_dict["operation"]
-        if DEBUG:
-            print(logname + " command: '" + cmd + "'")
-        if cmd not in self._cmd_functions:
-            msg = logname + ": command not recognized: '" + cmd + "'"
-            logging.error(msg)
-            print(msg)
-            return Msg.err_cmd_unknown, "", []
-        # Find arguments
-        arg_cnt = self._cmd_functions[cmd][1]
-        if DEBUG:
-            print(logname + ": number of arguments: " + str(arg_cnt))
-        args = []
-        arg_error = False
-        for idx, arg in enumerate(("x", "z", "x_new", "z_new")):
-            if idx >= arg_cnt:
-                break
-            if arg in json_dict.keys():
-                args.append(json_dict[arg])
-            else:
-                arg_error = True
-        if arg_error:
-            msg = logname + ": wrong arguments"
-            logging.error(msg)
-            print(msg)
-            return Msg.err_wrong_args, "", []
-        # Success!
-        if DEBUG:
-            print("Okay! Command:", cmd, "Arguments:", args)
-        return Msg.okay, cmd, args
+        return self._commands.decode(payload)
                     
     
     def run(self):
@@ -275,29 +410,37 @@ class HBS:
         print()
         print(logname + ": " + msg)
         self.ut.print_msg("mqtt_ready")
+        self._running = True
         
         try:
             while not self._prog_end:
                 
-                if len(self._cmd_buffer) > 0:
+                if len(self._cmd_buffer) > 0 and self.ut.get_bt_red():
+                    # Emergency stop latched: hold the commands until the operator resets it (blue button)
+                    if self._status is not SysStatus.error:
+                        self.set_status(SysStatus.error)
+                        self.ut.print_msg(Msg.err_emrg_stop.name)
+                    self.run_manual()
+                    self._cmd_event.wait(0.1)
+                    self._cmd_event.clear()
+                    
+                elif len(self._cmd_buffer) > 0:
                     self.set_status(SysStatus.busy)
-                    result, cmd, args = self.decode_json(self._cmd_buffer[0])
-                    del(self._cmd_buffer[0])
+                    # The commands have been decoded by the MQTT message handler.
+                    # The look-ahead of the MQTT thread must see the next job together with the current one.
+                    with self._lookahead_lock:
+                        result, cmd, args, entry = self._cmd_buffer.pop(0)
+                        self._current_cmd = cmd
+                    self.trace.started(entry, self.hbs_ctr.occupancy_bits)
+                    self.mqttc.send_queue_depth(len(self._cmd_buffer))
+                    self._look_ahead()
                     # If the decoding was okay, then let's run the command
                     if result is Msg.okay:
-                        if len(args) == 0:
-                            self.ut.print_msg(cmd)
-                            result = self._cmd_functions[cmd][0]()
-                        elif len(args) == 2:
-                            self.ut.print_msg(cmd, str(args[0]) + '/' + str(args[1]))
-                            result = self._cmd_functions[cmd][0](args[0], args[1])
-                        elif len(args) == 4:
-                            self.ut.print_msg(cmd, str(args[0]) + '/' + str(args[1]) +
-                                                   ' ' + str(args[2]) + '/' + str(args[3]))
-                            result = self._cmd_functions[cmd][0](args[0], args[1], args[2], args[3])
-                        else:
-                            result = Msg.err_wrong_arg_cnt
-                            logging.error(logname + ": internal error! " + result.name)
+                        self.ut.print_msg(cmd.name, cmd.lcd_text(args))
+                        result = cmd.handler(*args)
+                    with self._lookahead_lock:
+                        self._current_cmd = None
+                        self.hbs_ctr.op.stage_next = False
                     # Check and handle the result
                     if isinstance(result, Msg):
                         # If the result is a Msg, let's deal with it
@@ -315,19 +458,41 @@ class HBS:
                         logging.error(logname + ": " + result.name)
                         self.ut.print_msg(result.name)
                         
+                    self.trace.finished(entry, result, self.hbs_ctr.occupancy_bits)
+                    self.publish_state()
                     print(logname + ": Done!")
                     
                 else:
-                    # no pending command, set status to "ready"
-                    if self._status is not SysStatus.error:
+                    # no pending command, set status to "ready", unless the emergency stop is latched
+                    if self.ut.get_bt_red():
+                        self.set_status(SysStatus.error)
+                    elif self._status is not SysStatus.error:
                         self.set_status(SysStatus.ready)
                     self.run_manual()
-                    time.sleep(0.1)
+                    # Wait for the next command, the buttons are checked every 0.1 s
+                    self._cmd_event.wait(0.1)
+                    self._cmd_event.clear()
 
         except KeyboardInterrupt:
             pass
+        finally:
+            self._running = False
             
         
+    def publish_state(self):
+        """ Publishes occupancy and crane position as retained MQTT topics. Only changes are sent. """
+        logname = "HBS.publish_state"
+        if self.hbs_ctr.occupancy:
+            occupancy = self.hbs_ctr.occupancy_bits
+            if occupancy != self._published_occupancy:
+                taken, freed = occupancy.diff(self._published_occupancy)
+                logging.info("%s: occupancy changed, taken %s, freed %s", logname, taken, freed)
+                self.mqttc.send_occupancy(occupancy)
+                self._published_occupancy = occupancy
+        self._position = self.hbs_ctr.op.read_sensors()
+        self.mqttc.send_position(*self._position)
+        
+        
     def set_status(self, status):
         """ Sets and publishes system status. """
         if status != self._status:
@@ -341,6 +506,15 @@ class HBS:
         return Msg.shutdown
 
 
+    def stop_logging(self):
+        """ Writes the statistics, flushes and closes the log files """
+        self.hbs_ctr.stats.dump(STATS_FILE)
+        self.hbs_ctr.save_statistics()
+        hbs_logging.events.stop()
+        self.trace.stop()
+        self._log_listener.stop()
+
+
     @property
     def sys_shutdown(self):
         return self._sys_shutdown
@@ -350,10 +524,8 @@ class HBS:
         
 hbs = HBS()
 
-if hbs.start_mqtt():
-    if hbs.start_operator():
-        if hbs.load_storage():
-            hbs.run()            
+if hbs.startup():
+    hbs.run()
 
 hbs.mqttc.send_status(Msg.sys_exit.name)
 hbs.ut.print_msg("mqtt_disconnect")
@@ -364,12 +536,17 @@ msg = "Program ended"
 logging.info(msg)
 print(msg)
 hbs.ut.print_msg("sys_exit")
+hbs.hbs_ctr.op.conveyor.stop()
+hbs.hbs_ctr.save_position()
 
 if hbs.sys_shutdown:
     msg = "System shutdown"
     logging.info(msg)
     print(msg)
     hbs.ut.print_msg("poweroff")
-    if not DEBUG:
-        check_call(['sudo', 'poweroff'])
+hbs.ut.close()
+hbs.stop_logging()
+
+if hbs.sys_shutdown and not DEBUG:
+    check_call(['sudo', 'poweroff'])
         
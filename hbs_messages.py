@@ -0,0 +1,130 @@
+""" hbs_messages.py
+
+Message catalogue of the user terminal.
+
+The messages are defined in text files per language (hbs_messages_<language>.dat, one 'key: text' per line,
+comments start with '#'). A catalogue is compiled once: the umlauts are translated to the character codes
+of the LCD, and the result is cached as binary file. The cache is rebuilt when the text file changes.
+Messages missing in a language file are taken from the default language.
+
+The language is selected by the environment variable HBS_LANG or at runtime with MessageCatalogue.load().
+
+SLW 05/2025
+"""
+
+import os
+import pickle
+import logging
+
+DEFAULT_LANGUAGE = "de"
+LANGUAGE = os.environ.get("HBS_LANG", DEFAULT_LANGUAGE)
+MESSAGE_FILE = "hbs_messages_{}.dat"
+CACHE_DIR = "obj"
+CACHE_FILE = "hbs_messages_{}.cache"
+CACHE_VERSION = 1
+
+# Umlauts of the LCD. The CharLCD is opened with charmap='A02' (UserTerminal), whose codec writes the
+# characters chr(225), chr(239), chr(245) unchanged as the codes 0xE1, 0xEF, 0xF5. The character ROM
+# of the display is the A00 ROM, which shows these codes as ä, ö, ü.
+LCD_CHARMAP = {'ä': chr(225), 'ö': chr(239), 'ü': chr(245)}
+LCD_TABLE = str.maketrans(LCD_CHARMAP)
+
+
+def to_lcd(text):
+    """ Translates a string to the character codes of the LCD """
+    return text.translate(LCD_TABLE)
+
+
+def parse(filename):
+    """ Reads a message file. Returns a dictionary key -> text (unicode) """
+    messages = {}
+    with open(filename, "r", encoding="UTF-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            key, sep, text = line.partition(':')
+            if sep and key.strip():
+                messages[key.strip()] = text.strip()
+    return messages
+
+
+def compile_catalogue(language, cache_dir=CACHE_DIR):
+    """ Returns the LCD strings of a language as dictionary, from the cache if it is up to date.
+        Raises IOError, if the message file can't be read. """
+    logname = "hbs_messages.compile_catalogue"
+    filename = MESSAGE_FILE.format(language)
+    stat = os.stat(filename)
+    source = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    cache_file = os.path.join(cache_dir, CACHE_FILE.format(language))
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached["source"] == source:
+            return cached["messages"]
+    except (IOError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    messages = {key: to_lcd(text) for key, text in parse(filename).items()}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            pickle.dump({"source": source, "messages": messages}, f, pickle.HIGHEST_PROTOCOL)
+    except IOError as err:
+        logging.error("%s: cache not written: %s", logname, err)
+    logging.info("%s: %s compiled, %d messages", logname, filename, len(messages))
+    return messages
+
+
+class MessageCatalogue:
+    """ Precompiled LCD strings of the messages in the selected language """
+
+    def __init__(self, language=LANGUAGE):
+        self._default = compile_catalogue(DEFAULT_LANGUAGE)
+        self._messages = self._default
+        self.language = DEFAULT_LANGUAGE
+        self.load(language)
+
+
+    def load(self, language):
+        """ Selects the language. Returns True on success, otherwise the current language is kept. """
+        logname = "MessageCatalogue.load"
+        if language == DEFAULT_LANGUAGE:
+            self._messages = self._default
+        else:
+            try:
+                messages = compile_catalogue(language)
+            except IOError as err:
+                logging.error("%s: language %s not available: %s", logname, language, err)
+                return False
+            self._messages = dict(self._default, **messages)
+        self.language = language
+        return True
+
+
+    def text(self, key, add_on=""):
+        """ Returns the LCD string of a message, with an optional add-on (e.g. a position).
+            A message missing in the catalogue is shown by its key. """
+        message = self._messages.get(key)
+        if message is None:
+            logging.warning("MessageCatalogue.text: no message for '%s'", key)
+            message = to_lcd(key)
+        if add_on:
+            return message + ' ' + to_lcd(add_on)
+        return message
+
+
+    def __getitem__(self, key):
+        return self._messages[key]
+
+
+    def __contains__(self, key):
+        return key in self._messages
+
+
+    @property
+    def languages(self):
+        """ Languages with a message file in the current directory """
+        prefix, suffix = MESSAGE_FILE.split("{}")
+        return sorted(name[len(prefix):-len(suffix)] for name in os.listdir('.')
+                      if name.startswith(prefix) and name.endswith(suffix))
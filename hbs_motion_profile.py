@@ -0,0 +1,132 @@
+""" hbs_motion_profile.py
+
+Braking profile of the X axis.
+
+The X motor is switched to slow speed before every stop, so that the crane stops exactly at the sensor of
+the target column. Running slowly for the whole last column pitch is safe, but wastes time on every X move.
+XBrakeProfile learns per direction, how long the crane may keep running at full speed after it has passed
+the sensor in front of the target (the brake delay):
+- the travel time of the last segment at full speed is taken from the recorded segment times (CycleStats).
+  The segment in front of a target is usually travelled slowly, so the time of the previous segment is used,
+  if it has not been recorded often enough at full speed,
+- the brake delay is a fraction of this time. The fraction grows in small steps as long as the crane stops
+  accurately. It is reduced at once, if the crane has overshot the target (sensor of the target column not
+  active after the stop) or has reached the target before the brake point. After an overshoot, the fraction
+  never grows beyond the last step below it again (the latest safe brake point).
+  An overshoot doesn't fail the job: the operator returns to the target at slow speed (HBSOperator._creep_x),
+  the overshoot only serves as learning signal.
+Until enough travel times have been recorded, the brake delay is 0: the last segment is travelled slowly.
+
+SLW 05/2025
+"""
+
+import pickle
+import logging
+import threading
+
+MIN_SAMPLES = 20        # recorded full speed travel times of a segment required for a brake delay
+STEP = 0.05             # increase of the fraction after STREAK accurate stops
+STREAK = 10             # accurate stops required for the next step
+MAX_FRACTION = 0.7      # upper limit of the fraction of the segment time travelled at full speed
+BACKOFF = 0.5           # factor for the fraction after an overshoot
+
+
+class BrakeState:
+    """ Learned brake point of one direction """
+
+    def __init__(self):
+        self.fraction = 0.0     # fraction of the full speed segment time before switching to slow speed
+        self.limit = MAX_FRACTION       # upper limit, lowered by overshoots
+        self.streak = 0         # accurate stops since the last change of the fraction
+        self.stops = 0
+        self.overshoots = 0
+        self.early = 0          # target reached before the brake point
+
+
+class XBrakeProfile:
+    """ Learns the latest safe point to switch the X axis to slow speed, per direction """
+
+    def __init__(self, stats):
+        self._stats = stats     # CycleStats with the segment travel times
+        self._states = {"up": BrakeState(), "down": BrakeState()}
+        self._lock = threading.Lock()   # status() may be called from another thread
+
+
+    @staticmethod
+    def direction(pos, target):
+        return "up" if target > pos else "down"
+
+
+    def delay(self, pos, target):
+        """ Returns the time in seconds after passing the sensor pos, until the motor must run slowly
+            to stop at the neighbouring target. 0 -> slow speed from the sensor on. """
+        state = self._states[self.direction(pos, target)]
+        if state.fraction <= 0.0:
+            return 0.0
+        step = target - pos
+        for key in (("x", pos, target, False), ("x", pos - step, pos, False)):
+            hist = self._stats.segment_histogram(key)
+            if hist is not None and len(hist) >= MIN_SAMPLES:
+                # The fastest recorded times give the earliest arrival at the target sensor
+                return state.fraction * hist.percentile(5)
+        return 0.0
+
+
+    def stopped(self, direction, accurate, early=False):
+        """ Records the result of a stop after the last segment.
+            accurate: the target sensor is active after the stop
+            early:    the target has been reached before the brake point (at full speed) """
+        logname = "XBrakeProfile.stopped"
+        with self._lock:
+            state = self._states[direction]
+            state.stops += 1
+            if not accurate or early:
+                if not accurate:
+                    state.overshoots += 1
+                    state.limit = max(0.0, round(state.fraction - STEP, 3))
+                else:
+                    state.early += 1
+                fraction = round(state.fraction * BACKOFF, 3) if state.fraction > STEP else 0.0
+                logging.warning("%s: %s %s, fraction %.2f -> %.2f", logname, direction,
+                                "overshoot" if not accurate else "arrived at full speed", state.fraction, fraction)
+                state.fraction = fraction
+                state.streak = 0
+                return
+            state.streak += 1
+            if state.streak >= STREAK and state.fraction < state.limit:
+                state.fraction = min(state.limit, round(state.fraction + STEP, 3))
+                state.streak = 0
+                logging.info("%s: %s fraction %.2f", logname, direction, state.fraction)
+
+
+    def status(self):
+        """ Returns a dictionary with the learned fractions and the stop counters per direction """
+        with self._lock:
+            return {direction: {"fraction": state.fraction, "limit": state.limit, "stops": state.stops,
+                                "overshoots": state.overshoots, "early": state.early}
+                    for direction, state in self._states.items()}
+
+
+    def reset(self):
+        """ Forgets the learned brake points, e.g. after maintenance of the X drive """
+        with self._lock:
+            self._states = {"up": BrakeState(), "down": BrakeState()}
+
+
+    def save(self, filename):
+        """ Saves the learned brake points to a file """
+        with self._lock:
+            with open(filename, 'wb') as f:
+                pickle.dump(self._states, f, pickle.HIGHEST_PROTOCOL)
+
+
+    def load(self, filename):
+        """ Loads the learned brake points from a file. Returns True on success. """
+        try:
+            with open(filename, 'rb') as f:
+                states = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return False
+        with self._lock:
+            self._states.update(states)
+        return True
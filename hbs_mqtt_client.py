@@ -2,13 +2,31 @@
 
 MQTT client for the high bay storage system
 
+The client uses a persistent session with a stable client id, so the broker keeps the subscription
+and queues the commands (QoS 1) while the connection is down. paho reconnects automatically with
+an increasing delay. Messages with QoS 1 are queued by paho while the connection is down and sent
+after the reconnect. Results and warnings, which paho has not accepted (QoS 0 or a full queue), are kept
+in a bounded outbox and published after the reconnect.
+
+The current state (status, occupancy, crane position, number of queued commands) is published as
+retained messages below hochregallager/state/, so that new clients get it from the broker immediately.
+A state topic is only published, if its value has changed. If the connection is lost, the broker
+publishes the status 'offline' (last will).
+
 SLW 03/2025
 """
 
 
 import time
-import paho.mqtt.client as mqtt
+import json
+import socket
+import threading
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:     # no MQTT client, e.g. load generator on a PC with the local broker
+    mqtt = None
 import logging
+from collections import deque
 
 """
 Example:
@@ -22,8 +40,23 @@ SERVER_PORT = 1883
 TOPIC_SUB = "hochregallager/set"
 TOPIC_STATUS = "hochregallager/status"
 TOPIC_RESULT = "hochregallager/result"
+TOPIC_WARNING = "hochregallager/warning"
+TOPIC_STATE_STATUS = "hochregallager/state/status"
+TOPIC_STATE_OCCUPANCY = "hochregallager/state/occupancy"
+TOPIC_STATE_POSITION = "hochregallager/state/position"
+TOPIC_STATE_QUEUE = "hochregallager/state/queue"
 MQTT_USERNAME = 'dhbw-mqtt'
 MQTT_PASSWORD = 'daisy56'
+CLIENT_ID = "hbs-" + socket.gethostname()
+KEEPALIVE = 60              # seconds
+RECONNECT_MIN_DELAY = 1     # seconds, doubled after each failed attempt ...
+RECONNECT_MAX_DELAY = 30    # ... up to this limit
+OUTBOX_SIZE = 100           # results and warnings kept while the connection is down
+# Quality of service per topic
+QOS = {TOPIC_SUB: 1, TOPIC_STATUS: 0, TOPIC_RESULT: 1, TOPIC_WARNING: 1,
+       TOPIC_STATE_STATUS: 1, TOPIC_STATE_OCCUPANCY: 1, TOPIC_STATE_POSITION: 1, TOPIC_STATE_QUEUE: 1}
+# Topics, which are kept in the outbox while the connection is down
+BUFFERED_TOPICS = (TOPIC_RESULT, TOPIC_WARNING)
 
 
 class MQTTClient:
@@ -35,19 +68,30 @@ class MQTTClient:
                  server_ip: str = SERVER_IP,
                  server_port: int = SERVER_PORT,
                  mqtt_username: str = MQTT_USERNAME,
-                 mqtt_password: str = MQTT_PASSWORD):
+                 mqtt_password: str = MQTT_PASSWORD,
+                 client_id: str = CLIENT_ID,
+                 qos: dict = None):
         """Initialisiert den MQTT-Client mit den angegebenen Verbindungsdaten"""
    
         self.server_ip = server_ip
         self.server_port = server_port
         self.mqtt_username = mqtt_username
         self.mqtt_password = mqtt_password
+        self.qos = dict(QOS, **(qos or {}))
         
-        self.client = mqtt.Client()
+        self.client = mqtt.Client(client_id=client_id, clean_session=False)
         self.client.username_pw_set(mqtt_username, mqtt_password)
+        self.client.reconnect_delay_set(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
         self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.will_set(TOPIC_STATE_STATUS, "offline", self.qos[TOPIC_STATE_STATUS], retain=True)
 
         self._connected = False
+        self._connect_event = threading.Event()     # set by _on_connect
+        self._started = False
+        self._outbox = deque(maxlen=OUTBOX_SIZE)    # (topic, payload) not yet published
+        self._state = {}                            # state topic -> last payload
+        self._lock = threading.Lock()
 
 
     def connect(self, message_handler):
@@ -55,26 +99,25 @@ class MQTTClient:
         logname = "MQTTClient.connect"
         
         success = True
-        if self._connected:
+        if self._started:
             logging.info(logname + "MQTT Client connected already")
             return success
             
         logging.info(logname + ": Connect to MQTT-Broker " + self.server_ip + ':' + str(self.server_port))
+        self.client.on_message = message_handler 	# callback function for messages
         try:
-            self.client.connect(self.server_ip, self.server_port, 60)
-        except ConnectionRefusedError as err:
+            # The network thread of paho connects, and reconnects after a connection loss
+            self.client.connect_async(self.server_ip, self.server_port, KEEPALIVE)
+            self.client.loop_start()
+        except (OSError, ValueError) as err:
             msg = logname + ": " + str(err)
             logging.error(msg)
             print(msg)
             return False
-
-        self.client.subscribe(TOPIC_SUB)
-        logging.info(logname + ": Subscription started on: " + TOPIC_SUB)
-        self.client.on_message = message_handler 	# callback function for messages
-        self.client.loop_start()
+        self._started = True
         
         print()
-        print("MQTT connected and subscription started!")
+        print("MQTT client started, the subscription starts with the connection!")
         start_msg =  "\nUse: 'mosquitto_pub -h " + self.server_ip
         start_msg += ' -t "' + TOPIC_SUB + '"'
         start_msg += ' -u "' + MQTT_USERNAME + '"'
@@ -88,10 +131,16 @@ class MQTTClient:
 
     def disconnect(self) -> None:
         """Trennt die Verbindung zum MQTT-Broker"""
-        if self._connected:
-            self.client.loop_stop()
-            self.client.disconnect()
-            self._connected = False
+        logname = "MQTTClient.disconnect"
+        if not self._started:
+            return
+        self._started = False
+        if self._outbox:
+            logging.warning("%s: %d messages not published", logname, len(self._outbox))
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._connected = False
+        self._connect_event.clear()
             
                     
     def _on_connect(self, client, userdata, flags, rc) -> None:
@@ -100,8 +149,14 @@ class MQTTClient:
         
         if rc == 0:
             self._connected = True
-            logging.info(logname + "connected!")
+            self._connect_event.set()
+            logging.info(logname + "connected, session present: " + str(flags.get("session present")))
             print(logname + "connected!")
+            # (Re-)subscribe, in case the broker has lost the session
+            self.client.subscribe(TOPIC_SUB, self.qos[TOPIC_SUB])
+            logging.info(logname + "subscription started on: " + TOPIC_SUB)
+            self._flush_outbox()
+            self._publish_all_states()
             
         else:
             self._connected = False
@@ -109,14 +164,111 @@ class MQTTClient:
             print("connection failed with code " + str(rc))
 
     
+    def _on_disconnect(self, client, userdata, rc) -> None:
+        """ Callback-Funktion bei Verbindungsabbruch, paho verbindet sich automatisch neu """
+        logname = "MQTTClient._on_disconnect: "
+        self._connected = False
+        self._connect_event.clear()
+        if rc != 0:
+            logging.warning(logname + "connection lost (" + mqtt.error_string(rc) + "), reconnecting ...")
+            print(logname + "connection lost, reconnecting ...")
+
+
+    def publish(self, topic, payload):
+        """ Publishes a message with the QoS of the topic.
+            Results and warnings, which paho has not accepted, are kept in the outbox. """
+        with self._lock:
+            qos = self.qos.get(topic, 0)
+            # Keep the order: older messages in the outbox first
+            if not self._outbox and (self._connected or qos > 0):
+                rc = self.client.publish(topic, payload, qos).rc
+                if rc == mqtt.MQTT_ERR_SUCCESS:
+                    return True
+                if rc == mqtt.MQTT_ERR_NO_CONN and qos > 0:
+                    # Queued by paho, sent after the reconnect of the persistent session
+                    return False
+            if topic in BUFFERED_TOPICS:
+                if len(self._outbox) == self._outbox.maxlen:
+                    logging.warning("MQTTClient.publish: outbox full, dropped %s", self._outbox[0])
+                self._outbox.append((topic, payload))
+            return False
+
+
+    def _flush_outbox(self):
+        """ Publishes the messages of the outbox after a reconnect """
+        logname = "MQTTClient._flush_outbox"
+        with self._lock:
+            if self._outbox:
+                logging.info("%s: publishing %d buffered messages", logname, len(self._outbox))
+            while self._outbox:
+                topic, payload = self._outbox[0]
+                qos = self.qos.get(topic, 0)
+                rc = self.client.publish(topic, payload, qos).rc
+                if rc != mqtt.MQTT_ERR_SUCCESS and not (rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+                    break
+                self._outbox.popleft()
+
+    
+    def publish_state(self, topic, payload):
+        """ Publishes a retained state topic, if the payload has changed.
+            While the connection is down, only the latest payload is kept. """
+        with self._lock:
+            if self._state.get(topic) == payload:
+                return False
+            self._state[topic] = payload
+            if self._connected:
+                self.client.publish(topic, payload, self.qos.get(topic, 1), retain=True)
+        return True
+
+
+    def _publish_all_states(self):
+        """ Publishes all state topics after a reconnect (the broker may have been restarted) """
+        with self._lock:
+            for topic, payload in self._state.items():
+                self.client.publish(topic, payload, self.qos.get(topic, 1), retain=True)
+
+    
     def send_status(self, status):
         """ Publishes the system status via MQTT """
-        self.client.publish(TOPIC_STATUS, status)
+        self.publish(TOPIC_STATUS, status)
+        self.publish_state(TOPIC_STATE_STATUS, status)
+
+
+    def send_occupancy(self, occupancy):
+        """ Publishes the occupancy (OccupancyBitset) as retained state, base64 encoded bitset """
+        self.publish_state(TOPIC_STATE_OCCUPANCY, occupancy.to_base64())
+
+
+    def send_position(self, xpos, ypos, zpos):
+        """ Publishes the crane position as retained state, e.g. '{"x": 3, "y": "DEFAULT", "z": 2}' """
+        self.publish_state(TOPIC_STATE_POSITION, json.dumps({"x": xpos, "y": ypos.name, "z": zpos}))
+
+
+    def send_queue_depth(self, depth):
+        """ Publishes the number of pending commands as retained state """
+        self.publish_state(TOPIC_STATE_QUEUE, str(depth))
         
         
     def send_result(self, result):
         """ Publishes the result of an operation via MQTT """
-        self.client.publish(TOPIC_RESULT, result)        
+        self.publish(TOPIC_RESULT, result)
+
+    
+    def send_warning(self, warning):
+        """ Publishes a warning (e.g. predictive maintenance) via MQTT """
+        self.publish(TOPIC_WARNING, warning)
+
+
+    @property
+    def pending(self):
+        """ Number of messages in the outbox """
+        return len(self._outbox)
+
+    
+    def wait_connected(self, timeout):
+        """ Waits until the connection to the broker has been acknowledged.
+            Returns True, if connected. """
+        return self._connect_event.wait(timeout)
 
     
     @property
@@ -133,8 +285,7 @@ if __name__ == "__main__":
         print(payload)         
          
     mqttc = MQTTClient()
-    success = True
-    mqttc.connect(message_handler)
+    success = mqttc.connect(message_handler) and mqttc.wait_connected(10)
     
     if success:
         for idx in range(10):
@@ -9,28 +9,51 @@ import logging
 import time
 import os
 import io_extension
+import hbs_sensors
 
 from hbs_collections import Msg
 from hbs_collections import YPos
 from hbs_collections import IOPins
-from hbs_user_terminal import UserTerminal
+from hbs_logging import events
+from hbs_stats import CycleStats
+from hbs_stats import timed
+from hbs_stats import SegmentTimer
+from hbs_drift import DriftDetector
+from hbs_motion_profile import XBrakeProfile
+from hbs_conveyor import Conveyor
 
 DEBUG = False
 SIMULATION = False
 
+# Learned segment timeouts: p99 of the travel times * TIMEOUT_FACTOR, not below TIMEOUT_MIN
+TIMEOUT_FACTOR = 1.5
+TIMEOUT_MIN = 0.3           # seconds
+TIMEOUT_MIN_SAMPLES = 20    # recorded travel times required before the learned timeout is used
+CONFLICT_LOG_INTERVAL = 10.0    # seconds between two log entries of a sensor conflict per axis
+
 
 class HBSOperator:
     """ Operator for a high bay storage """
 
-    def __init__(self, ut):  # Requires the user terminal as argument. 
+    def __init__(self, ut, io=None):  # Requires the user terminal as argument, io: e.g. a simulated board
         logname = "HBSOperator.__init__: "
         if DEBUG: print(logname)
         
         self._break_time = 0.1
         self._x_timeout, self._y_timeout, self._z_timeout = 2.0, 2.5, 1.5  # Timeout in seconds
-        self.io = io_extension.IOExtension()
+        # Upper limits for the learned segment timeouts
+        self._timeouts = {"x": self._x_timeout, "x_slow": self._x_timeout, "x_brake": self._x_timeout,
+                          "y": self._y_timeout, "z": self._z_timeout}
+        self.io = io if io is not None else io_extension.IOExtension()
         self.pins = IOPins()
         self.ut = ut
+        self.stats = CycleStats()
+        self.drift = DriftDetector()
+        self.brake = XBrakeProfile(self.stats)
+        self.conveyor = Conveyor(self.io, self.pins, self.ut.get_bt_red)
+        self.stage_next = False     # True, if the next job stores a box: stage it when the belts are free
+        self.sensor_conflicts = {"x": 0, "y": 0, "z": 0}    # reads with several active sensors per axis
+        self._conflict_logged = {}                          # axis -> time of the last log entry
         self._sim_x, self._sim_y, self._sim_z = -1, YPos.UNDEFINED, -1
         
         
@@ -47,9 +70,7 @@ class HBSOperator:
         if DEBUG: print(logname)             
                
         if not 1 <= x <= 10:
-            msg = logname + "X-target of " + str(x) + " is out of range. The valid range is 1 to 10."
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
+            logging.error("%s: X-target of %s is out of range. The valid range is 1 to 10.", logname, x)
             self.ut.set_error()
             return False
         else:
@@ -64,9 +85,7 @@ class HBSOperator:
         if DEBUG: print(logname)
 
         if not 1 <= z <= 10:
-            msg = "Z-target of " + str(z) + " is out of range. The valid range is 1 to 10."
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
+            logging.error("%s: Z-target of %s is out of range. The valid range is 1 to 10.", logname, z)
             self.ut.set_error()
             return False
         else:
@@ -81,9 +100,7 @@ class HBSOperator:
         if DEBUG: print(logname)
         
         if not 1 <= z_level <= 5:
-            msg = "Z-level of " + str(z_level) + " is out of range. The valid range is 1 to 5."
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
+            logging.error("%s: Z-level of %s is out of range. The valid range is 1 to 5.", logname, z_level)
             self.ut.set_error()
             return False
         else:
@@ -97,9 +114,7 @@ class HBSOperator:
         logname = "HBSOperator:check_xdf"
         if DEBUG: print(logname)
         if (SIMULATION and self._sim_x < 0) or (self.get_xpos() < 0):
-            msg = logname + ": X position is undefined"
-            logging.error(msg)
-            print(msg)
+            logging.error("%s: X position is undefined", logname)
             self.ut.set_error()
             return Msg.err_x_udf
         else:
@@ -111,10 +126,8 @@ class HBSOperator:
             If not, this function raises an error message """
         logname = "HBSOperator:check_ydf"
         if DEBUG: print(logname)
-        if (SIMULATION and (self._sim_y is YPos.UNDEFINED)) or (self.get_zpos() is YPos.UNDEFINED):
-            msg = logname + ": Y position is undefined"
-            logging.error(msg)
-            print(msg)
+        if (SIMULATION and (self._sim_y is YPos.UNDEFINED)) or (self.get_ypos().value < 0):
+            logging.error("%s: Y position is undefined", logname)
             self.ut.set_error()
             return Msg.err_y_udf
         else:
@@ -127,9 +140,7 @@ class HBSOperator:
         logname = "HBSOperator:check_zdf"
         if DEBUG: print(logname)
         if (SIMULATION and self._sim_z < 0) or (self.get_zpos() < 0):
-            msg = logname + ": Z position is undefined"
-            logging.error(msg)
-            print(msg)
+            logging.error("%s: Z position is undefined", logname)
             self.ut.set_error()
             return Msg.err_z_udf
         else:
@@ -138,7 +149,7 @@ class HBSOperator:
     
     def check_ydefault(self):
         """ Checks whether the y position is at default, so that x and/or z can start moving """
-        logname = "HBSOperator.check_ydefault: "
+        logname = "HBSOperator.check_ydefault"
         if DEBUG: print(logname)
         if SIMULATION:
             if self._sim_y is YPos.UNDEFINED:
@@ -147,9 +158,7 @@ class HBSOperator:
                 return True
         
         if not self.get_ypos() is YPos.DEFAULT:
-            msg = "Can't move in x-direction while ypos is not YPos.DEFAULT"
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
+            logging.error("%s: Can't move in x-direction while ypos is not YPos.DEFAULT", logname)
             self.ut.set_error()
             return False
         else:
@@ -168,60 +177,87 @@ class HBSOperator:
             self.io.set_port(0, idx, False)
         for idx in range(3):
             self.io.set_port(1, idx, False)
+
+
+    def stop_axes(self):
+        """ Stops the motors of the axes, the belts of the I/O stations keep running """
+        for pin in (self.pins.x_up, self.pins.x_down, self.pins.y_in, self.pins.y_out,
+                    self.pins.z_up, self.pins.z_down):
+            self.io.set_port(pin, False)
             
     # Get functions ----------------------------------------------------------------------------------
 
     def get_xpos(self) -> int:
         """ Get the x-axis position of the operator.
-            Returns -1 for undefined positions """
+            Returns -1 for undefined positions, -2 if several sensors are active """
         
         if SIMULATION:
             return self._sim_x
         
-        cnt = 0
-        for port in self.io.read_port(0):
-            cnt += 1
-            if port:
-                return cnt
-        for port in self.io.read_port(1):
-            cnt += 1
-            if not cnt <= 10:
-                break
-            if port:
-                return cnt
-        return -1
+        xpos = hbs_sensors.decode_x(self.io.read_byte(0), self.io.read_byte(1))
+        if xpos == hbs_sensors.CONFLICT:
+            self._sensor_conflict("x")
+        return xpos
     
 
     def get_ypos(self) -> YPos:
         """ Get the y-axis position of the operator.
-            Returns YPos.UNDEFINED for undefined positions """
+            Returns YPos.UNDEFINED for undefined positions, YPos.CONFLICT if several sensors are active """
 
         if SIMULATION:
             return self._sim_y
         
-        cnt = 0
-        for port in self.io.read_port(1)[2:5]:
-            if port:
-                return YPos(cnt)
-            cnt += 1
-        return YPos.UNDEFINED
+        ypos = hbs_sensors.decode_y(self.io.read_byte(1))
+        if ypos is YPos.CONFLICT:
+            self._sensor_conflict("y")
+        return ypos
 
 
     def get_zpos(self) -> int:
         """ Return the z-axis position of the operator.
-            Returns -1 for undefined positions """
+            Returns -1 for undefined positions, -2 if several sensors are active """
         
         if SIMULATION:
             return self._sim_z
         
-        ports = self.io.read_port(1)[5:8] + self.io.read_port(2)[0:7]
-        ports.reverse()
-        cnt = 1
-        for port in ports:
-            if port:
-                return cnt
-            cnt += 1
-        return -1
+        zpos = hbs_sensors.decode_z(self.io.read_byte(1), self.io.read_byte(2))
+        if zpos == hbs_sensors.CONFLICT:
+            self._sensor_conflict("z")
+        return zpos
+
+
+    def read_sensors(self):
+        """ Reads all position sensors with a single snapshot of the input ports.
+            Returns (xpos, ypos, zpos), -1 or YPos.UNDEFINED for undefined positions,
+            -2 or YPos.CONFLICT if several sensors of an axis are active """
+        
+        if SIMULATION:
+            return self._sim_x, self._sim_y, self._sim_z
+        
+        port_0, port_1, port_2 = self.io.read_byte(0), self.io.read_byte(1), self.io.read_byte(2)
+        xpos = hbs_sensors.decode_x(port_0, port_1)
+        ypos = hbs_sensors.decode_y(port_1)
+        zpos = hbs_sensors.decode_z(port_1, port_2)
+        if xpos == hbs_sensors.CONFLICT:
+            self._sensor_conflict("x")
+        if ypos is YPos.CONFLICT:
+            self._sensor_conflict("y")
+        if zpos == hbs_sensors.CONFLICT:
+            self._sensor_conflict("z")
+        return xpos, ypos, zpos
+
+
+    def _sensor_conflict(self, axis):
+        """ Counts a read with several active sensors of an axis. The conflict is logged at most
+            every CONFLICT_LOG_INTERVAL seconds per axis, the positioning loops read the sensors continuously. """
+        logname = "HBSOperator._sensor_conflict"
+        self.sensor_conflicts[axis] += 1
+        now = time.monotonic()
+        if now - self._conflict_logged.get(axis, -CONFLICT_LOG_INTERVAL) >= CONFLICT_LOG_INTERVAL:
+            self._conflict_logged[axis] = now
+            logging.warning("%s: several %s sensors active (%d reads)", logname, axis.upper(),
+                            self.sensor_conflicts[axis])
+            events.record("sensor_conflict", axis=axis, level=logging.WARNING)
         
     # Move axis --------------------------------------------------------------------------------------------------
     """ The following operators are moving the axis.
@@ -261,31 +297,41 @@ class HBSOperator:
             return Msg.okay      
             
         # Start moving ...
+        t_start, polls, loops = time.monotonic(), self.io.read_count, 0
+        distance = abs(target_pos - current_pos)
+        direction = self.brake.direction(current_pos, target_pos)
         self.ut.set_busy()
-        self.io.set_port(self.pins.x_slow, abs(target_pos - current_pos) <= 1)
+        seg = SegmentTimer(current_pos, t_start)
+        axis, t_brake = self._x_segment(seg, target_pos)
+        self.io.set_port(self.pins.x_slow, axis == "x_slow")
         if current_pos < target_pos:
             self.io.set_port(self.pins.x_up, True)
         else:
             self.io.set_port(self.pins.x_down, True)
         
-        # Run the motors, watch for timeout
-        t_end = time.time() + self._x_timeout
-        time_reset = False
-        while time.time() < t_end:
+        # Run the motors, watch for the timeout of the current segment
+        t_end = t_start + self._segment_timeout(axis, seg, target_pos)
+        while True:
+            loops += 1
+            now = time.monotonic()
+            if now > t_end:
+                break
             # Check for emergency stop
             if self.ut.get_bt_red():
-                return self.emergency_stop()
+                return self._move_done("x", target_pos, distance, t_start, polls, loops, self.emergency_stop())
+            # Switch to slow speed at the learned brake point
+            if t_brake is not None and now >= t_brake:
+                self.io.set_port(self.pins.x_slow, True)
+                t_brake = None
             # Check the current position
             current_pos = self.get_xpos()
-            if current_pos == target_pos:
-                break
-            if current_pos >= 0:
-                self.io.set_port(self.pins.x_slow, abs(target_pos - current_pos) <= 1)
-                if time_reset:
-                    t_end = time.time() + self._x_timeout
-                    time_reset = False
-            else:
-                time_reset = True
+            if current_pos >= 0 and current_pos != seg.pos:
+                self._segment_done(seg, axis, current_pos)
+                if current_pos == target_pos:
+                    break
+                axis, t_brake = self._x_segment(seg, target_pos)
+                self.io.set_port(self.pins.x_slow, axis == "x_slow")
+                t_end = seg.t + self._segment_timeout(axis, seg, target_pos)
         
         # Arrived
         self.io.set_port(self.pins.x_up, False)
@@ -294,11 +340,18 @@ class HBSOperator:
         time.sleep(self._break_time)
         
         # All okay?
-        if self.get_xpos() == target_pos:
-            return Msg.okay
+        accurate = self.get_xpos() == target_pos
+        if current_pos == target_pos and distance > 1:
+            self.brake.stopped(direction, accurate, early=t_brake is not None)
+        if accurate:
+            result = Msg.okay
+        elif current_pos == target_pos:
+            # Overshoot: the target sensor has been passed, return slowly
+            result = self._creep_x(target_pos, direction)
         else:
             self.log_error(logname, "X positioning unsuccessful!")
-            return Msg.err_x_pos
+            result = Msg.err_x_pos
+        return self._move_done("x", target_pos, distance, t_start, polls, loops, result)
         
         
     def move_ypos(self, target_pos: YPos):
@@ -307,9 +360,7 @@ class HBSOperator:
         if DEBUG: print(logname)
         
         if target_pos == YPos.UNDEFINED:
-            msg = "Can't move Y to undefined position"
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
+            logging.error("%s: Can't move Y to undefined position", logname)
             self.ut.set_error()
             return Msg.err_wrong_y_target
         
@@ -336,29 +387,29 @@ class HBSOperator:
             return Msg.okay     
             
         # Start moving ...
+        t_start, polls, loops = time.monotonic(), self.io.read_count, 0
+        distance = abs(target_pos.value - current_pos.value)
         self.ut.set_busy()
         if current_pos.value < target_pos.value:
             self.io.set_port(self.pins.y_in, True)
         elif current_pos.value > target_pos.value:
             self.io.set_port(self.pins.y_out, True)
 
-        # Run the motors, watch for timeout
-        t_end = time.time() + self._y_timeout
-        time_reset = False
-        while time.time() < t_end:
+        # Run the motors, watch for the timeout of the current segment
+        seg = SegmentTimer(current_pos.value, t_start)
+        t_end = t_start + self._segment_timeout("y", seg, target_pos.value)
+        while time.monotonic() < t_end:
+            loops += 1
             # Check for emergency stop
             if self.ut.get_bt_red():
-                return self.emergency_stop()
+                return self._move_done("y", target_pos, distance, t_start, polls, loops, self.emergency_stop())
             # Check the current position
             current_pos = self.get_ypos()
-            if current_pos is target_pos:
-                break
-            if current_pos != YPos.UNDEFINED:
-                if time_reset:
-                    t_end = time.time() + self._y_timeout
-                    time_reset = False
-            else:
-                time_reset = True
+            if current_pos.value >= 0 and current_pos.value != seg.pos:
+                self._segment_done(seg, "y", current_pos.value)
+                if current_pos is target_pos:
+                    break
+                t_end = seg.t + self._segment_timeout("y", seg, target_pos.value)
 
         # Arrived
         self.io.set_port(self.pins.y_out, False)
@@ -368,10 +419,11 @@ class HBSOperator:
         
         # All okay?
         if self.get_ypos() is target_pos:
-            return Msg.okay
+            result = Msg.okay
         else:
             self.log_error(logname, "Y positioning unsuccessful!")
-            return Msg.err_y_pos
+            result = Msg.err_y_pos
+        return self._move_done("y", target_pos, distance, t_start, polls, loops, result)
         
 
     def move_zpos(self, target_pos: int):
@@ -405,29 +457,29 @@ class HBSOperator:
             return Msg.okay      
             
         # Start moving ...
+        t_start, polls, loops = time.monotonic(), self.io.read_count, 0
+        distance = abs(target_pos - current_pos)
         self.ut.set_busy()
         if current_pos < target_pos:
             self.io.set_port(self.pins.z_up, True)
         else:
             self.io.set_port(self.pins.z_down, True)
 
-        # Run the motors, watch for timeout
-        t_end = time.time() + self._z_timeout
-        time_reset = False
-        while time.time() < t_end:
+        # Run the motors, watch for the timeout of the current segment
+        seg = SegmentTimer(current_pos, t_start)
+        t_end = t_start + self._segment_timeout("z", seg, target_pos)
+        while time.monotonic() < t_end:
+            loops += 1
             # Check for emergency stop
             if self.ut.get_bt_red():
-                return self.emergency_stop()
+                return self._move_done("z", target_pos, distance, t_start, polls, loops, self.emergency_stop())
             # Check the current position
             current_pos = self.get_zpos()
-            if current_pos == target_pos:
-                break
-            if current_pos >= 0:
-                if time_reset:
-                    t_end = time.time() + self._z_timeout
-                    time_reset = False
-                else:
-                    time_reset = True
+            if current_pos >= 0 and current_pos != seg.pos:
+                self._segment_done(seg, "z", current_pos)
+                if current_pos == target_pos:
+                    break
+                t_end = seg.t + self._segment_timeout("z", seg, target_pos)
             
         # Arrived    
         self.io.set_port(self.pins.z_up, False)
@@ -436,10 +488,11 @@ class HBSOperator:
         
         # All okay?
         if self.get_zpos() == target_pos:
-            return Msg.okay
+            result = Msg.okay
         else:
             self.log_error(logname, "Z positioning unsuccessful!")
-            return Msg.err_z_pos
+            result = Msg.err_z_pos
+        return self._move_done("z", target_pos, distance, t_start, polls, loops, result)
 
 
     def move_xzpos(self, target_xpos: int, target_zpos: int):
@@ -485,12 +538,18 @@ class HBSOperator:
             return Msg.okay      
 
         # Start moving
+        t_start, polls, loops = time.monotonic(), self.io.read_count, 0
+        target = (target_xpos, target_zpos)
+        distance = (abs(target_xpos - current_xpos), abs(target_zpos - current_zpos))
         self.ut.set_busy()
+        x_seg, z_seg = SegmentTimer(current_xpos, t_start), SegmentTimer(current_zpos, t_start)
+        x_axis, t_brake = self._x_segment(x_seg, target_xpos)
+        direction = self.brake.direction(current_xpos, target_xpos)
         # Start x motor
         if current_xpos == target_xpos:
             x_okay = True
         else:
-            self.io.set_port(self.pins.x_slow, abs(target_xpos - current_xpos) <= 1)
+            self.io.set_port(self.pins.x_slow, x_axis == "x_slow")
             if current_xpos < target_xpos:
                 self.io.set_port(self.pins.x_up, True)
             else:
@@ -506,61 +565,77 @@ class HBSOperator:
                 self.io.set_port(self.pins.z_up, True)
             z_okay = False
 
-        # Run the motors, watch for timeout
-        t_end_x = time.time() + self._x_timeout
-        t_end_z = time.time() + self._z_timeout
-        x_time_reset, z_time_reset = False, False
+        # Run the motors, watch for the timeouts of the current segments
+        t_end_x = t_start + self._segment_timeout(x_axis, x_seg, target_xpos)
+        t_end_z = t_start + self._segment_timeout("z", z_seg, target_zpos)
         while True:
+            loops += 1
             # Check for timeout
-            now = time.time()
+            now = time.monotonic()
             if (not x_okay and now > t_end_x) or (not z_okay and now > t_end_z):
                 break
             # Check for emergency stop
             if self.ut.get_bt_red():
-                return self.emergency_stop()
-            # X axis
-            current_xpos = self.get_xpos()
-            if current_xpos >= 0:
-                if not x_okay and x_time_reset:
-                    t_end_x = time.time() + self._x_timeout
-                    x_time_reset = False
-                self.io.set_port(self.pins.x_slow, abs(target_xpos - current_xpos) <= 1)
-                if current_xpos == target_xpos:
-                    self.io.set_port(self.pins.x_up, False)
-                    self.io.set_port(self.pins.x_down, False)
-                    x_okay = True
+                return self._move_done("xz", target, distance, t_start, polls, loops, self.emergency_stop())
+            # One snapshot of the input ports while both axes are moving
+            if not x_okay and not z_okay:
+                current_xpos, _, current_zpos = self.read_sensors()
+            elif not x_okay:
+                current_xpos = self.get_xpos()
             else:
-                x_time_reset = True
+                current_zpos = self.get_zpos()
+            # X axis
+            if not x_okay:
+                if t_brake is not None and now >= t_brake:
+                    self.io.set_port(self.pins.x_slow, True)
+                    t_brake = None
+                if current_xpos >= 0 and current_xpos != x_seg.pos:
+                    self._segment_done(x_seg, x_axis, current_xpos)
+                    if current_xpos == target_xpos:
+                        self.io.set_port(self.pins.x_up, False)
+                        self.io.set_port(self.pins.x_down, False)
+                        x_okay = True
+                    else:
+                        x_axis, t_brake = self._x_segment(x_seg, target_xpos)
+                        self.io.set_port(self.pins.x_slow, x_axis == "x_slow")
+                        t_end_x = x_seg.t + self._segment_timeout(x_axis, x_seg, target_xpos)
             # Z axis
-            current_zpos = self.get_zpos()
-            if current_zpos >= 0:
-                if not z_okay and z_time_reset:
-                    t_end_z = time.time() + self._z_timeout
-                    z_time_reset = False
-                if current_zpos == target_zpos:
-                    self.io.set_port(self.pins.z_down, False)
-                    self.io.set_port(self.pins.z_up, False)
-                    z_okay = True
-            else:
-                z_time_reset = True
+            if not z_okay:
+                if current_zpos >= 0 and current_zpos != z_seg.pos:
+                    self._segment_done(z_seg, "z", current_zpos)
+                    if current_zpos == target_zpos:
+                        self.io.set_port(self.pins.z_down, False)
+                        self.io.set_port(self.pins.z_up, False)
+                        z_okay = True
+                    else:
+                        t_end_z = z_seg.t + self._segment_timeout("z", z_seg, target_zpos)
             # Target reached ?
             if x_okay and z_okay:
                 break
   
-        # We have arrived
-        self.stop_motion()
+        # We have arrived, a staging belt keeps running
+        self.stop_axes()
         self.ut.set_ready()
         time.sleep(self._break_time)
 
         # Check the result
+        x_accurate = self.get_xpos() == target_xpos
+        if x_okay and distance[0] > 1:
+            self.brake.stopped(direction, x_accurate, early=t_brake is not None)
+        if x_okay and distance[0] > 0 and not x_accurate:
+            # Overshoot: X has moved and passed the target sensor, return slowly
+            result = self._creep_x(target_xpos, direction)
+            if result is not Msg.okay:
+                return self._move_done("xz", target, distance, t_start, polls, loops, result)
         if not self.get_xpos() == target_xpos:
             self.log_error(logname, "X positioning unsuccessful!")
-            return Msg.err_x_pos                       
-        if not self.get_zpos() == target_zpos:
+            result = Msg.err_x_pos
+        elif not self.get_zpos() == target_zpos:
             self.log_error(logname, "Z positioning unsuccessful!")
-            return Msg.err_z_pos
-        
-        return Msg.okay
+            result = Msg.err_z_pos
+        else:
+            result = Msg.okay
+        return self._move_done("xz", target, distance, t_start, polls, loops, result)
     
         
     def move_home(self):
@@ -583,13 +658,14 @@ class HBSOperator:
     #- Box-Functions -------------------------------------------------------------------------------------------------------------
     """ The following functions are storing or destoring boxes to and from the shelf """
         
+    @timed("put_box")
     def put_box(self, xpos, z_level):
         """ Put box into a storage place.
             Arguments: 1 <= xpos <= 10, 1 <= z_level <= 5
             Returns: Message of the result (e.g. Msg.okay) """
         logname = "HBSOperator.put_box"
         if DEBUG: print(logname)
-        logging.info(logname + ": X: " + str(xpos) + " Z-Level: " + str(z_level))
+        logging.info("%s: X: %s Z-Level: %s", logname, xpos, z_level)
 
         if not self.check_xtarget(xpos):
             return Msg.err_wrong_x_target
@@ -612,12 +688,13 @@ class HBSOperator:
         return Msg.okay
 
 
+    @timed("get_box")
     def get_box(self, xpos, z_level):
         """ Get a box from a storage place.
             Returns: Message of the result (e.g. Msg.okay) """
         logname = "HBSOperator.get_box"
         if DEBUG: print(logname)
-        logging.info(logname + ": X: " + str(xpos) + " Z-Level: " + str(z_level))
+        logging.info("%s: X: %s Z-Level: %s", logname, xpos, z_level)
         
         if not self.check_xtarget(xpos):
             return Msg.err_wrong_x_target
@@ -639,6 +716,7 @@ class HBSOperator:
         return Msg.okay
 
 
+    @timed("fetch_box")
     def fetch_box(self):
         """ Fetch a a box from the input-station.
             Returns: Message of the result (e.g. Msg.okay) """
@@ -646,43 +724,36 @@ class HBSOperator:
         logging.info(logname)
         if DEBUG: print(logname)
         
-        # Move to the gripper to the input station
+        # Start the input-station, the box is staged while the gripper moves to the input station
+        self.conveyor.start_input()
         result = self.move_ypos(YPos.DEFAULT)
-        if result is not Msg.okay: return result         
-        result = self.move_xzpos(10, 1)
-        if result is not Msg.okay: return result
+        if result is Msg.okay:
+            result = self.move_xzpos(10, 1)
+        if result is not Msg.okay:
+            self.conveyor.abort_input()
+            return result
            
-        # Start the input-station
-        self.ut.set_busy()
-        self.io.set_port(self.pins.io1_in, True)
-        self.io.set_port(self.pins.io2_in, True)        
-        # Polling für 5s
-        t_end = time.time() + 5
-        while time.time() < t_end:
-            # Check for emergency stop
-            if self.ut.get_bt_red():
-                self.emergency_stop()
-            if not self.io.read_port(3)[1]:
-                time.sleep(0.3)
-                break
-        # Stop the input-station
-        self.io.set_port(self.pins.io1_in, False)
-        self.io.set_port(self.pins.io2_in, False)       
-        time.sleep(self._break_time)
-        
-        # Check the light barrier whether the box is in the right position
-        if self.io.read_port(3)[1]:
+        # Wait for the box at the light barrier
+        result = self.conveyor.wait_input()
+        if result is Msg.okay and not self.conveyor.box_staged():
+            # The box staged in advance has gone, try once more
+            self.conveyor.start_input()
+            result = self.conveyor.wait_input()
+        if result is Msg.err_emrg_stop:
+            return self.emergency_stop()
+        if result is not Msg.okay:
             self.ut.set_error()
-            msg = "Error in belt"
-            logging.error(logname + ": " + msg)
-            print(logname + ": " + msg)
-            return Msg.err_input_belt
+            logging.error("%s: Error in belt", logname)
+            return result
         
         self.ut.set_ready()
         result = self.move_ypos(YPos.DESTORE)
         if result is not Msg.okay: return result        
         result = self.move_zpos(2)
         if result is not Msg.okay: return result
+        # The box has been lifted from the belt, the belt can stage the box of the next job
+        if self.stage_next:
+            self.conveyor.start_input()
         result = self.move_ypos(YPos.DEFAULT)
         if result is not Msg.okay: return result
         
@@ -690,6 +761,7 @@ class HBSOperator:
         return Msg.okay
 
 
+    @timed("drop_box")
     def drop_box(self):
         """ Drop a box to the output-station.
             Returns: Message of the result (e.g. Msg.okay) """
@@ -709,20 +781,11 @@ class HBSOperator:
         result = self.move_ypos(YPos.DEFAULT)
         if result is not Msg.okay: return result
         
-        # Start the output-station
-        self.ut.set_busy()
-        self.io.set_port(self.pins.io1_out, True)
-        self.io.set_port(self.pins.io2_out, True)
-        end_t = time.time() + 6
-        while time.time() < end_t:
-            # Check for emergency stop
-            if self.ut.get_bt_red():
-                return Msg.err_emrg_stop
- 
-        # Stop the output-station
-        self.io.set_port(self.pins.io1_out, False)
-        self.io.set_port(self.pins.io2_out, False)
-        time.sleep(self._break_time)
+        # Start the output-station, the belt discharges the box in the background
+        self.conveyor.start_output()
+        # The box of the next job is staged after the discharge
+        if self.stage_next:
+            self.conveyor.start_input()
 
         # Done
         self.ut.set_ready()
@@ -732,17 +795,95 @@ class HBSOperator:
     # Utility Functions --------------------------------------------------------------------------------
     
     def log_error(self, logname, msg):
-        logging.error(logname + ": " + msg)
-        print(logname + ": " + msg)
+        logging.error("%s: %s", logname, msg)
         self.ut.set_error()
 
 
+    def _move_done(self, axis, target, distance, t_start, polls, loops, result):
+        """ Records a finished move in the statistics and the event log. Returns the result.
+            polls: value of the sensor read counter at the start of the move """
+        duration = time.monotonic() - t_start
+        self.stats.record_move(axis, distance, duration, self.io.read_count - polls, loops,
+                               result is Msg.okay)
+        events.record("move", axis, target, duration, result,
+                      logging.INFO if result is Msg.okay else logging.ERROR)
+        return result
+
+
+    def _x_axis(self, pos, target):
+        """ Returns the axis name for X segments: 'x_slow' for the last segment before the target """
+        if abs(target - pos) <= 1:
+            return "x_slow"
+        return "x"
+
+
+    def _x_segment(self, seg, target):
+        """ Returns the axis name of the X segment starting at the sensor seg.pos and the time to switch
+            to slow speed (None -> no switch during the segment):
+            'x' -> full speed, 'x_slow' -> slow speed from the sensor on,
+            'x_brake' -> full speed until the learned brake point, then slow speed """
+        axis = self._x_axis(seg.pos, target)
+        if axis == "x_slow" and not seg.start:
+            delay = self.brake.delay(seg.pos, target)
+            if delay > 0:
+                return "x_brake", seg.t + delay
+        return axis, None
+
+
+    def _creep_x(self, target_pos, direction):
+        """ Moves the X axis back to the target at slow speed after an overshoot.
+            direction: direction of the move, which has passed the target ('up' or 'down').
+            Returns Msg.okay, if the sensor of the target is active. """
+        logname = "HBSOperator._creep_x"
+        logging.warning("%s: X overshoot, returning to %d", logname, target_pos)
+        pin = self.pins.x_down if direction == "up" else self.pins.x_up
+        self.ut.set_busy()
+        self.io.set_port(self.pins.x_slow, True)
+        self.io.set_port(pin, True)
+        t_end = time.monotonic() + self._x_timeout
+        while time.monotonic() < t_end:
+            if self.ut.get_bt_red():
+                return self.emergency_stop()
+            if self.get_xpos() == target_pos:
+                break
+        self.io.set_port(pin, False)
+        self.ut.set_ready()
+        time.sleep(self._break_time)
+        if self.get_xpos() == target_pos:
+            return Msg.okay
+        self.log_error(logname, "X positioning unsuccessful!")
+        return Msg.err_x_pos
+
+
+    def _segment_timeout(self, axis, seg, target):
+        """ Returns the timeout for the next segment of a move towards the target:
+            p99 of the recorded travel times multiplied with a safety factor.
+            Uses the fixed timeout of the axis until enough travel times have been recorded. """
+        default = self._timeouts[axis]
+        if axis == "x_brake":
+            # Braking later is never slower than the whole segment at slow speed
+            axis = "x_slow"
+        step = 1 if target > seg.pos else -1
+        hist = self.stats.segment_histogram((axis, seg.pos, seg.pos + step, seg.start))
+        if hist is None or len(hist) < TIMEOUT_MIN_SAMPLES:
+            return default
+        return min(default, max(TIMEOUT_MIN, hist.percentile(99) * TIMEOUT_FACTOR))
+
+
+    def _segment_done(self, seg, axis, pos):
+        """ Records the travel time between two neighbouring sensors and checks it for drift """
+        key, duration = seg.passed(axis, pos, time.monotonic())
+        self.stats.record_segment(key, duration)
+        if axis != "x_brake":       # travel time depends on the learned brake point
+            self.drift.update(key, duration)
+
+
     def emergency_stop(self):
         logname = "HBSOperator.emergency_stop"
         self.stop_motion()
         self.ut.set_error()
-        logging.error(logname + ": system halted")
-        print(logname + ": system halted")
+        logging.error("%s: system halted", logname)
+        events.record("emergency_stop", level=logging.ERROR)
         return Msg.err_emrg_stop
     
 
@@ -774,7 +915,7 @@ class HBSOperator:
     def init_ypos(self):
         """ Initializes the y-axis by finding the next valid position and moving to YPos:DEFAULT. """
         logname = "HBSOperator.init_ypos"
-        logging.info(logname + ": Initializing Y ...")
+        logging.info("%s: Initializing Y ...", logname)
         if DEBUG: print(logname + ": Initializing Y ...")
         
         if SIMULATION:
@@ -789,7 +930,7 @@ class HBSOperator:
         # Find a valid position by moving left and right
         wait_time = self._y_timeout / 2
         for pin in (self.pins.y_out, self.pins.y_in):       
-            if self.get_ypos() != YPos.UNDEFINED:
+            if self.get_ypos().value >= 0:
                 break
             self.ut.set_busy()
             end_time = time.time() + wait_time
@@ -799,14 +940,14 @@ class HBSOperator:
                 # Check for emergency stop
                 if self.ut.get_bt_red():
                     return self.emergency_stop()
-                if self.get_ypos() != YPos.UNDEFINED:
+                if self.get_ypos().value >= 0:
                     break
             self.io.set_port(pin, False)
             self.ut.set_ready()
             time.sleep(self._break_time)
 
         # Result okay?
-        if self.get_ypos() is YPos.UNDEFINED:
+        if self.get_ypos().value < 0:
             # Initialization unsuccessful
             self.log_error(logname, "Y initialization unsuccessful")
             self.ut.set_error()
@@ -819,7 +960,7 @@ class HBSOperator:
     def init_xpos(self):
         """ Initializes the x-axis by fnding the next valid position """
         logname = "HBSOperator.init_xpos"
-        logging.info(logname + ": Initializing X ...")
+        logging.info("%s: Initializing X ...", logname)
         if DEBUG: print(logname + ": Initializing X ...")        
         
         if SIMULATION:
@@ -864,7 +1005,7 @@ class HBSOperator:
     def init_zpos(self):
         """ Initializes the z-axis by finding the next valid position """
         logname = "HBSOperator.init_zpos"
-        logging.info(logname + ": Initializing Z ...")
+        logging.info("%s: Initializing Z ...", logname)
         if DEBUG: print(logname + ": Initializing Z ...")
 
         if SIMULATION:
@@ -907,6 +1048,7 @@ class HBSOperator:
 #============================================================================================
 
 if __name__ == "__main__":
+    from hbs_user_terminal import UserTerminal
     
     ut = UserTerminal()
     op = HBSOperator(ut)
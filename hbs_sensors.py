@@ -0,0 +1,67 @@
+""" hbs_sensors.py
+
+Decoding of the position sensors with lookup tables.
+
+The position of an axis is read from the raw bytes of the input ports (IOExtension.read_byte). Every port
+byte is mapped by a precomputed table of 256 entries to the position of the active sensor, so a decode
+costs a table lookup per port and allocates nothing. The inputs are low active: a 0 bit is an active sensor.
+
+    port 0: bits 0 ... 7 -> X 1 ... 8
+    port 1: bits 0, 1 -> X 9, 10    bits 2 ... 4 -> Y DESTORE, DEFAULT, STORE    bits 5 ... 7 -> Z 10, 9, 8
+    port 2: bits 0 ... 6 -> Z 7 ... 1
+
+Besides the position, a table entry reports the inconsistent states explicitly:
+UNDEFINED (-1), if no sensor of the axis is active (between two positions), and CONFLICT (-2), if several
+sensors of the axis are active at the same time, e.g. a defective sensor or a short circuit. Before, the
+first active sensor was returned in this case.
+
+SLW 05/2025
+"""
+
+from hbs_collections import YPos
+
+UNDEFINED = -1      # no sensor of the axis active
+CONFLICT = -2       # several sensors of the axis active
+
+
+def _table(bits):
+    """ Table of the raw port values 0 ... 255: position of the single active sensor,
+        UNDEFINED or CONFLICT. bits: {bit number: position} """
+    table = []
+    for value in range(256):
+        active = [pos for bit, pos in bits.items() if not value & (1 << bit)]
+        if not active:
+            table.append(UNDEFINED)
+        elif len(active) > 1:
+            table.append(CONFLICT)
+        else:
+            table.append(active[0])
+    return tuple(table)
+
+
+X_PORT0 = _table({bit: bit + 1 for bit in range(8)})
+X_PORT1 = _table({0: 9, 1: 10})
+Y_PORT1 = tuple(YPos(pos) for pos in _table({2: 0, 3: 1, 4: 2}))
+Z_PORT1 = _table({15 - z: z for z in range(8, 11)})
+Z_PORT2 = _table({7 - z: z for z in range(1, 8)})
+
+
+def _combine(pos_a, pos_b):
+    """ Position of an axis with sensors on two ports """
+    if pos_a == UNDEFINED:
+        return pos_b
+    if pos_b == UNDEFINED:
+        return pos_a
+    return CONFLICT
+
+
+def decode_x(port_0, port_1):
+    return _combine(X_PORT0[port_0], X_PORT1[port_1])
+
+
+def decode_y(port_1):
+    return Y_PORT1[port_1]
+
+
+def decode_z(port_1, port_2):
+    return _combine(Z_PORT2[port_2], Z_PORT1[port_1])
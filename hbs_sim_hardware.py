@@ -0,0 +1,157 @@
+""" hbs_sim_hardware.py
+
+Simulated hardware of the high bay storage system, e.g. for benchmarks on a PC.
+
+SimBus replaces the I2C bus (smbus2.SMBus) of IOExtension. It emulates the registers of the three MCP23017
+expanders: the output port switches the motors, the input ports deliver the sensors of a kinematic crane
+model. So the complete code path of IOExtension and HBSOperator is executed, only the bus is simulated.
+- the axes move with a constant speed per segment (X: half speed while x_slow is on),
+- a sensor is active within a small window around its position (inputs are low active),
+- the input belt stages a box after a fixed time, the box leaves the light barrier when the gripper
+  lifts it at the input station.
+time_scale > 1 runs the crane faster than real time.
+
+SimTerminal replaces the user terminal (LEDs and emergency stop button).
+
+Usage: op = HBSOperator(SimTerminal(), io=IOExtension(bus=SimBus()))
+
+SLW 05/2025
+"""
+
+import time
+import threading
+
+from hbs_collections import IOPins
+
+# Addresses of the MCP23017 expanders and registers, as used by IOExtension
+IN_DEVICES = (0x20, 0x24)
+OUT_DEVICE = 0x22
+GPIOA, GPIOB = 0x12, 0x13
+
+SEGMENT_TIME = {"x": 0.5, "y": 1.0, "z": 0.4}   # seconds per segment at full speed
+SENSOR_WINDOW = 0.08                            # half width of a sensor in segments
+BELT_TIME = 2.0                                 # seconds to stage a box at the input station
+
+
+def _bit(pin):
+    """ Bit mask of an output pin (port, pin): port 0 -> bits 0 ... 7, port 1 -> bits 8 ... 15 """
+    return 1 << (pin[0] * 8 + pin[1])
+
+
+class SimBus:
+    """ I2C bus with the three MCP23017 of the I/O board and a kinematic model of the crane """
+
+    def __init__(self, x=10, y=1, z=1, time_scale=1.0):
+        self.pos = {"x": float(x), "y": float(y), "z": float(z)}
+        self.time_scale = time_scale
+        self.box_staged = False
+        self.reads = 0
+        self._out = 0                   # output port A (bits 0 ... 7) and B (bits 8 ... 15)
+        self._belt_time = 0.0           # simulated seconds the input belt has been running
+        self._t = time.monotonic()
+        self._pins = IOPins()
+        self._lock = threading.Lock()   # belts run in separate threads
+
+
+    def write_byte_data(self, address, register, value):
+        with self._lock:
+            self._update()
+            if address == OUT_DEVICE and register == GPIOA:
+                self._out = (self._out & 0xff00) | value
+            elif address == OUT_DEVICE and register == GPIOB:
+                self._out = (self._out & 0x00ff) | (value << 8)
+
+
+    def read_byte_data(self, address, register):
+        with self._lock:
+            self._update()
+            self.reads += 1
+            if address not in IN_DEVICES:
+                return 0
+            return self._input_port(IN_DEVICES.index(address) * 2 + (register == GPIOB))
+
+
+    def _on(self, pin):
+        return self._out & _bit(pin)
+
+
+    def _update(self):
+        """ Moves the axes and the belt according to the outputs since the last call """
+        now = time.monotonic()
+        dt = (now - self._t) * self.time_scale
+        self._t = now
+        pins, pos = self._pins, self.pos
+        x_speed = 1.0 / SEGMENT_TIME["x"] / (2.0 if self._on(pins.x_slow) else 1.0)
+        if self._on(pins.x_up):
+            pos["x"] += dt * x_speed
+        if self._on(pins.x_down):
+            pos["x"] -= dt * x_speed
+        if self._on(pins.y_in):
+            pos["y"] += dt / SEGMENT_TIME["y"]
+        if self._on(pins.y_out):
+            pos["y"] -= dt / SEGMENT_TIME["y"]
+        if self._on(pins.z_up):
+            pos["z"] += dt / SEGMENT_TIME["z"]
+        if self._on(pins.z_down):
+            pos["z"] -= dt / SEGMENT_TIME["z"]
+        # Input belt
+        if self._on(pins.io1_in) and not self.box_staged:
+            self._belt_time += dt
+            if self._belt_time >= BELT_TIME:
+                self.box_staged, self._belt_time = True, 0.0
+        # The gripper lifts the box from the input station
+        if self.box_staged and round(pos["x"]) == 10 and round(pos["y"]) == 0 and pos["z"] > 1.5:
+            self.box_staged = False
+
+
+    def _sensor(self, axis):
+        """ Number of the active sensor of an axis, None between two sensors """
+        p = self.pos[axis]
+        n = round(p)
+        return n if abs(p - n) <= SENSOR_WINDOW else None
+
+
+    def _input_port(self, port):
+        """ Raw value of an input port, low active: 0 bit -> sensor active """
+        active = 0
+        x, y, z = self._sensor("x"), self._sensor("y"), self._sensor("z")
+        if port == 0:
+            if x is not None and 1 <= x <= 8:
+                active |= 1 << (x - 1)
+        elif port == 1:
+            if x in (9, 10):
+                active |= 1 << (x - 9)
+            if y is not None and 0 <= y <= 2:
+                active |= 1 << (y + 2)
+            if z is not None and 8 <= z <= 10:
+                active |= 1 << (15 - z)
+        elif port == 2:
+            if z is not None and 1 <= z <= 7:
+                active |= 1 << (7 - z)
+        elif port == 3:
+            # Light barrier: high if a box interrupts it
+            return 0xff if self.box_staged else 0xff & ~0x02
+        return 0xff & ~active
+
+
+class SimTerminal:
+    """ User terminal without display: the LEDs are ignored, the emergency stop can be set """
+
+    def __init__(self):
+        self.emergency = False
+
+
+    def get_bt_red(self):
+        return self.emergency
+
+
+    def set_busy(self):
+        pass
+
+
+    def set_ready(self):
+        pass
+
+
+    def set_error(self):
+        pass
@@ -0,0 +1,435 @@
+""" hbs_simulator.py
+
+Discrete event simulator for the capacity planning of the high bay storage system.
+
+The simulator answers questions like "how many boxes per hour can the rack sustain under our order
+profile" without running the physical machine:
+- the slot logic is the one of HBSController (store, destore, rearrange, random places),
+- SimOperator replaces the operator. It executes the same move sequences as HBSOperator, but advances a
+  simulated clock instead of driving the motors. The travel times come from a kinematic model per axis,
+  or from the calibrated travel time matrix (CALIBRATE, obj/travel_times.pkl) if available,
+- the jobs arrive by a random process (Poisson or constant rate) or are read from a trace file,
+  one JSON message per line like the MQTT commands, with the arrival time in seconds:
+  {"t": 12.5, "operation": "STORE", "x": 3, "z": 2}
+- the crane executes the jobs in the order of arrival (FIFO), like the command buffer of hbs_main.
+
+The report contains throughput, crane utilisation, waiting times (percentiles) and queue lengths.
+
+Usage: python3 hbs_simulator.py --rate 40 --hours 8 --policy nearest
+
+SLW 05/2025
+"""
+
+import sys
+import json
+import heapq
+import random
+import logging
+import argparse
+import contextlib
+from collections import deque
+
+from hbs_collections import Msg
+from hbs_collections import YPos
+from hbs_controller import HBSController
+from hbs_calibration import TravelTimeMatrix
+from hbs_conveyor import OUTPUT_TIME
+from hbs_stats import CycleStats
+from hbs_stats import Histogram
+
+N_PLACES = 50
+INPUT_TIME = 3.0        # seconds the input belt needs to stage a box
+BREAK_TIME = 0.1        # seconds after every move, like HBSOperator._break_time
+HOME = (10, YPos.DEFAULT, 1)
+# Commands without crane moves, skipped in traces
+QUERIES = ("show_occupancy", "occupancy", "occupancy_bits", "slot", "position", "queue", "stats", "drift",
+           "travel_times")
+
+
+class AxisModel:
+    """ Travel time of an axis: start + distance * segment, the last segment may be slower """
+
+    def __init__(self, segment, start=0.0, last=None):
+        self.segment = segment      # seconds per segment at full speed
+        self.start = start          # additional seconds for the acceleration
+        self.last = segment if last is None else last   # seconds for the last segment (slow speed)
+
+
+    def time(self, distance):
+        if distance == 0:
+            return 0.0
+        return self.start + (distance - 1) * self.segment + self.last
+
+
+class KinematicModel:
+    """ Travel times of the crane moves. Uses the calibrated travel times, if available,
+        otherwise the axis models. """
+
+    def __init__(self, matrix=None):
+        self.matrix = matrix
+        self.x = AxisModel(0.45, start=0.2, last=0.9)
+        self.z = AxisModel(0.35, start=0.1)
+        self.y = AxisModel(1.1)
+
+
+    def _calibrated(self, value, default):
+        return default if value is None else value
+
+
+    def x_time(self, start, target):
+        t = self.x.time(abs(target - start)) + BREAK_TIME
+        if self.matrix is not None:
+            t = self._calibrated(self.matrix.axis_time("x", start, target), t)
+        return t
+
+
+    def z_time(self, start, target):
+        t = self.z.time(abs(target - start)) + BREAK_TIME
+        if self.matrix is not None:
+            t = self._calibrated(self.matrix.axis_time("z", start, target), t)
+        return t
+
+
+    def y_time(self, start, target):
+        t = self.y.time(abs(target.value - start.value)) + BREAK_TIME
+        if self.matrix is not None:
+            t = self._calibrated(self.matrix.y_time(start, target), t)
+        return t
+
+
+    def xz_time(self, start, target):
+        if self.matrix is not None:
+            t = self.matrix.move_time(start, target)
+            if t is not None:
+                return t
+        return max(self.x.time(abs(target[0] - start[0])), self.z.time(abs(target[1] - start[1]))) + BREAK_TIME
+
+
+class SimOperator:
+    """ Operator with the move sequences of HBSOperator on a simulated clock """
+
+    def __init__(self, model):
+        self.model = model
+        self.stats = CycleStats()   # required by the timed decorator of the controller
+        self.x, self.y, self.z = HOME
+        self.now = 0.0              # simulated time in seconds
+        self.belt_free = 0.0        # time when the output belt has discharged the last box
+        self.staged = None          # time when the box at the input station is ready, None -> not started
+
+
+    def check_xtarget(self, x):
+        return 1 <= x <= 10
+
+
+    def check_ztarget(self, z):
+        return 1 <= z <= 10
+
+
+    def check_zlevel(self, z_level):
+        return 1 <= z_level <= 5
+
+
+    def move_ypos(self, target):
+        self.now += self.model.y_time(self.y, target)
+        self.y = target
+        return Msg.okay
+
+
+    def move_zpos(self, target):
+        self.now += self.model.z_time(self.z, target)
+        self.z = target
+        return Msg.okay
+
+
+    def move_xzpos(self, x, z):
+        self.now += self.model.xz_time((self.x, self.z), (x, z))
+        self.x, self.z = x, z
+        return Msg.okay
+
+
+    def stage_input(self):
+        """ Starts the input belt, after the output belt has finished (the I/O stations share the belts) """
+        if self.staged is None:
+            self.staged = max(self.now, self.belt_free) + INPUT_TIME
+
+
+    def fetch_box(self):
+        self.stage_input()
+        self.move_ypos(YPos.DEFAULT)
+        self.move_xzpos(10, 1)
+        self.now = max(self.now, self.staged)
+        self.staged = None
+        self.move_ypos(YPos.DESTORE)
+        self.move_zpos(2)
+        return self.move_ypos(YPos.DEFAULT)
+
+
+    def put_box(self, xpos, z_level):
+        self.move_ypos(YPos.DEFAULT)
+        self.move_xzpos(xpos, z_level * 2)
+        self.move_ypos(YPos.STORE)
+        self.move_zpos(z_level * 2 - 1)
+        return self.move_ypos(YPos.DEFAULT)
+
+
+    def get_box(self, xpos, z_level):
+        self.move_ypos(YPos.DEFAULT)
+        self.move_xzpos(xpos, z_level * 2 - 1)
+        self.move_ypos(YPos.STORE)
+        self.move_zpos(z_level * 2)
+        return self.move_ypos(YPos.DEFAULT)
+
+
+    def drop_box(self):
+        self.move_ypos(YPos.DEFAULT)
+        self.move_xzpos(1, 2)
+        self.move_ypos(YPos.DESTORE)
+        self.move_zpos(1)
+        self.move_ypos(YPos.DEFAULT)
+        self.belt_free = max(self.now, self.belt_free) + OUTPUT_TIME
+        return Msg.okay
+
+
+class SimController(HBSController):
+    """ HBSController with the storage places in memory instead of the storage file """
+
+    def __init__(self, op, fill=0.0, rng=random):
+        super().__init__(None, op)
+        for place_nr in range(1, N_PLACES + 1):
+            self._storage_places[place_nr] = {'x': (place_nr - 1) % 10 + 1, 'z': (place_nr - 1) // 10 + 1,
+                                              'taken': False, 'timestamp': None}
+        for place_nr in rng.sample(range(1, N_PLACES + 1), int(round(fill * N_PLACES))):
+            self._storage_places[place_nr].update(taken=True, timestamp=0.0)
+            self._occupancy.set(place_nr)
+        self._update_snapshot()
+
+
+    def save_to_file(self):
+        self._update_snapshot()
+
+
+    def free_places(self):
+        return [nr for nr, place in self._storage_places.items() if not place['taken']]
+
+
+    def taken_places(self):
+        return [nr for nr, place in self._storage_places.items() if place['taken']]
+
+
+# Storage policies: functions (controller, model) -> result of the store/destore job without a place
+
+def _store_random(ctr, model):
+    if not ctr.free_places():
+        return Msg.err_storage_full
+    return ctr.store_box_random()
+
+
+def _destore_random(ctr, model):
+    if not ctr.taken_places():
+        return Msg.err_storage_empty
+    return ctr.destore_box_random()
+
+
+def _store_ascending(ctr, model):
+    free = ctr.free_places()
+    if not free:
+        return Msg.err_storage_full
+    place = ctr.occupancy[free[0]]
+    return ctr.store_box(place['x'], place['z'])
+
+
+def _destore_ascending(ctr, model):
+    taken = ctr.taken_places()
+    if not taken:
+        return Msg.err_storage_empty
+    place = ctr.occupancy[taken[0]]
+    return ctr.destore_box(place['x'], place['z'])
+
+
+def _store_nearest(ctr, model):
+    """ Free place with the shortest travel time from the input station """
+    free = ctr.free_places()
+    if not free:
+        return Msg.err_storage_full
+    place = min((ctr.occupancy[nr] for nr in free),
+                key=lambda p: model.xz_time((10, 2), (p['x'], p['z'] * 2)))
+    return ctr.store_box(place['x'], place['z'])
+
+
+def _destore_oldest(ctr, model):
+    taken = ctr.taken_places()
+    if not taken:
+        return Msg.err_storage_empty
+    place = min((ctr.occupancy[nr] for nr in taken), key=lambda p: p['timestamp'])
+    return ctr.destore_box(place['x'], place['z'])
+
+
+POLICIES = {
+    "random": (_store_random, _destore_random),
+    "ascending": (_store_ascending, _destore_ascending),
+    "nearest": (_store_nearest, _destore_oldest),
+}
+
+
+class Job:
+    """ Job of the simulation: arrival time and MQTT-like message """
+    __slots__ = ("t", "operation", "args", "start", "end", "result")
+
+    def __init__(self, t, operation, args=()):
+        self.t = t
+        self.operation = operation.lower()
+        self.args = tuple(args)
+        self.start = self.end = None
+        self.result = None
+
+
+def random_jobs(rate, hours, store_share=0.5, process="poisson", rng=random):
+    """ Returns the jobs of a random arrival process: rate in jobs per hour, store_share: ratio of stores """
+    jobs, t = [], 0.0
+    interval = 3600.0 / rate
+    while True:
+        t += rng.expovariate(1.0 / interval) if process == "poisson" else interval
+        if t > hours * 3600.0:
+            return jobs
+        jobs.append(Job(t, "store" if rng.random() < store_share else "destore"))
+
+
+def read_trace(filename):
+    """ Reads the jobs from a trace file, one JSON message per line: {"t": 12.5, "operation": "STORE", ...}
+        Skipped: queries, commands rejected by the system (result 'err_...') and invalid messages """
+    arg_names = {"store": ("x", "z"), "destore": ("x", "z"), "rearrange": ("x", "z", "x_new", "z_new")}
+    jobs = []
+    with open(filename, "r", encoding="UTF-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            msg = json.loads(line)
+            operation = msg.get("operation") if isinstance(msg, dict) else None
+            if not isinstance(operation, str) or operation.lower() in QUERIES:
+                continue
+            result = msg.get("result")
+            if isinstance(result, str) and result.startswith("err_"):
+                continue
+            operation = operation.lower()
+            args = [msg.get(name) for name in arg_names.get(operation, ())]
+            if any(type(arg) is not int for arg in args):
+                continue
+            jobs.append(Job(float(msg["t"]), operation, args))
+    jobs.sort(key=lambda job: job.t)
+    return jobs
+
+
+class Simulator:
+    """ Runs the jobs on the simulated crane and collects the results """
+
+    def __init__(self, model=None, policy="random", fill=0.5, seed=None):
+        self.rng = random.Random(seed)
+        random.seed(seed)           # the random places of HBSController
+        self.model = model or KinematicModel()
+        self.op = SimOperator(self.model)
+        self.ctr = SimController(self.op, fill, self.rng)
+        self.store, self.destore = POLICIES[policy]
+
+
+    def _execute(self, job):
+        """ Executes a job on the simulated crane. Returns the result message. """
+        ctr, operation = self.ctr, job.operation
+        if operation == "store":
+            return ctr.store_box(*job.args) if job.args else self.store(ctr, self.model)
+        if operation == "destore":
+            return ctr.destore_box(*job.args) if job.args else self.destore(ctr, self.model)
+        if operation == "store_random":
+            return ctr.store_box_random()
+        if operation == "destore_random":
+            return ctr.destore_box_random()
+        if operation == "rearrange":
+            return ctr.rearrange_box(*job.args)
+        return Msg.err_cmd_unknown
+
+
+    def run(self, jobs):
+        """ Simulates the jobs (sorted by arrival). Returns the report as dictionary. """
+        events = [(job.t, n, "arrival", job) for n, job in enumerate(jobs)]
+        heapq.heapify(events)
+        seq = len(events)
+        queue = deque()
+        busy = False
+        t_last, queue_area, queue_max = 0.0, 0.0, 0
+        while events:
+            t, _, kind, job = heapq.heappop(events)
+            queue_area += len(queue) * (t - t_last)
+            t_last = t
+            if kind == "arrival":
+                queue.append(job)
+                queue_max = max(queue_max, len(queue))
+            else:
+                busy = False
+            if not busy and queue:
+                job = queue.popleft()
+                job.start = self.op.now = t
+                job.result = self._execute(job)
+                job.end = self.op.now
+                busy = True
+                heapq.heappush(events, (job.end, seq, "done", job))
+                seq += 1
+        return self.report(jobs, queue_area, queue_max)
+
+
+    def report(self, jobs, queue_area, queue_max):
+        done = [job for job in jobs if job.result is Msg.okay]
+        failed = {}
+        for job in jobs:
+            if job.result is not Msg.okay:
+                failed[job.result.name] = failed.get(job.result.name, 0) + 1
+        makespan = max([job.end for job in jobs] + [0.0])
+        waiting, service = Histogram(len(jobs) or 1), {}
+        for job in done:
+            waiting.add(job.start - job.t)
+            service.setdefault(job.operation, Histogram(len(jobs))).add(job.end - job.start)
+        busy = sum(job.end - job.start for job in done)
+        return {"jobs": len(jobs), "done": len(done), "failed": failed,
+                "makespan_h": round(makespan / 3600.0, 3),
+                "throughput_per_h": round(len(done) / makespan * 3600.0, 1) if makespan else 0.0,
+                "utilisation": round(busy / makespan, 3) if makespan else 0.0,
+                "busy_h": round(busy / 3600.0, 4),
+                "waiting": waiting.summary(),
+                "service": {operation: hist.summary() for operation, hist in sorted(service.items())},
+                "queue": {"mean": round(queue_area / makespan, 2) if makespan else 0.0, "max": queue_max},
+                "occupied": self.ctr.occupancy_bits.count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capacity planning simulator of the high bay storage system")
+    parser.add_argument("--rate", type=float, default=30.0, help="jobs per hour (random arrivals)")
+    parser.add_argument("--hours", type=float, default=8.0, help="simulated hours (random arrivals)")
+    parser.add_argument("--store-share", type=float, default=0.5, help="ratio of store jobs (random arrivals)")
+    parser.add_argument("--process", choices=("poisson", "constant"), default="poisson", help="arrival process")
+    parser.add_argument("--trace", help="trace file with the jobs instead of random arrivals")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random", help="storage place selection")
+    parser.add_argument("--fill", type=float, default=0.5, help="initial fill level of the rack (0 ... 1)")
+    parser.add_argument("--travel-times", help="calibrated travel times, e.g. obj/travel_times.pkl")
+    parser.add_argument("--seed", type=int, help="seed of the random generators")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    matrix = None
+    if args.travel_times:
+        matrix = TravelTimeMatrix()
+        if not matrix.load(args.travel_times):
+            print("travel times not loaded: " + args.travel_times, file=sys.stderr)
+            return 1
+    sim = Simulator(KinematicModel(matrix), args.policy, args.fill, args.seed)
+    if args.trace:
+        jobs = read_trace(args.trace)
+    else:
+        jobs = random_jobs(args.rate, args.hours, args.store_share, args.process, sim.rng)
+    # The controller prints rejected jobs (e.g. shelf occupied), the report is written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        report = sim.run(jobs)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+""" hbs_startup.py
+
+Startup sequence of the high bay storage system.
+
+Most phases of the startup (network detection, MQTT connection, loading of the storage file,
+initialization of the axes) do not depend on each other. StartupSequencer runs them in background
+threads, measures the duration of each phase and reports the timings, so that a slow phase is
+easy to identify.
+
+SLW 05/2025
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from hbs_logging import events
+
+
+class StartupSequencer:
+    """ Runs startup phases concurrently and records their durations """
+
+    def __init__(self):
+        self._t_start = time.monotonic()
+        self._timings = {}          # phase -> duration in seconds
+        self._results = {}          # background phase -> result
+        self._threads = {}          # background phase -> thread
+        self._lock = threading.Lock()
+
+
+    @contextmanager
+    def phase(self, name):
+        """ Measures the duration of a phase, e.g. 'with seq.phase("network"): ...' """
+        t_start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - t_start
+            with self._lock:
+                self._timings[name] = duration
+            events.record("startup", target=name, duration=duration)
+
+
+    def start(self, name, func, *args):
+        """ Runs func(*args) as phase in a background thread """
+        thread = threading.Thread(target=self._task, args=(name, func, args), name="Startup-" + name, daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+
+    def run(self, name, func, *args):
+        """ Runs func(*args) as phase in the calling thread and returns its result """
+        with self.phase(name):
+            return func(*args)
+
+
+    def wait(self, name):
+        """ Waits for the end of a background phase and returns its result """
+        self._threads.pop(name).join()
+        return self._results.get(name)
+
+
+    def report(self):
+        """ Logs and returns the durations of the phases and the total startup time in seconds """
+        logname = "StartupSequencer.report"
+        with self._lock:
+            timings = {name: round(duration, 3) for name, duration in self._timings.items()}
+        timings["total"] = round(time.monotonic() - self._t_start, 3)
+        logging.info("%s: %s", logname, timings)
+        return timings
+
+
+    def _task(self, name, func, args):
+        logname = "StartupSequencer._task"
+        result = None
+        with self.phase(name):
+            try:
+                result = func(*args)
+            except Exception:
+                logging.exception("%s: phase %s failed", logname, name)
+        self._results[name] = result
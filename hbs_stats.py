@@ -0,0 +1,215 @@
+""" hbs_stats.py
+
+Cycle time statistics for the high bay storage system.
+
+Every axis move is recorded with duration, distance, number of sensor polls and loop iterations.
+High level operations (fetch_box, drop_box, store, ...) are recorded with their duration.
+The travel times between neighbouring sensors (segments) are recorded separately.
+The samples are aggregated into histograms, which provide percentiles (p50/p95/p99) per axis,
+per axis and distance, per segment and per operation.
+
+SLW 05/2025
+"""
+
+import json
+import time
+import pickle
+import functools
+import threading
+from collections import deque
+
+
+class Histogram:
+    """ Keeps the most recent samples of a value and provides percentiles """
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._sorted = None     # sorted samples, cached for repeated percentile queries
+
+
+    def add(self, value):
+        self._sorted = None
+        self._samples.append(value)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+    def percentile(self, p):
+        """ Returns the p-th percentile (0 ... 100) of the recent samples, None if there are no samples """
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[int(round(p / 100 * (len(self._sorted) - 1)))]
+
+
+    def summary(self):
+        """ Returns a dictionary with count, mean, p50, p95, p99 and max """
+        if self.count == 0:
+            return {"count": 0}
+        return {"count": self.count,
+                "mean": round(self.total / self.count, 4),
+                "p50": round(self.percentile(50), 4),
+                "p95": round(self.percentile(95), 4),
+                "p99": round(self.percentile(99), 4),
+                "max": round(self.max, 4)}
+
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CycleStats:
+    """ Statistics of axis moves and high level operations """
+
+    def __init__(self, size=500):
+        self._size = size
+        self._moves = {}        # (axis, distance) -> Histogram of durations, distance None -> all moves
+        self._polls = {}        # axis -> Histogram of sensor polls per move
+        self._loops = {}        # axis -> Histogram of loop iterations per move
+        self._ops = {}          # operation -> Histogram of durations
+        self._segments = {}     # (axis, from_pos, to_pos, start) -> Histogram of travel times
+        self._errors = {}       # axis or operation -> number of failed moves/operations
+        self._lock = threading.Lock()   # summary() may be called from another thread
+
+
+    def _hist(self, table, key):
+        hist = table.get(key)
+        if hist is None:
+            hist = table[key] = Histogram(self._size)
+        return hist
+
+
+    def record_move(self, axis, distance, duration, polls, loops, success=True):
+        """ Records an axis move """
+        with self._lock:
+            self._hist(self._moves, (axis, None)).add(duration)
+            self._hist(self._moves, (axis, distance)).add(duration)
+            self._hist(self._polls, axis).add(polls)
+            self._hist(self._loops, axis).add(loops)
+            if not success:
+                self._errors[axis] = self._errors.get(axis, 0) + 1
+
+
+    def record_op(self, name, duration, success=True):
+        """ Records a high level operation """
+        with self._lock:
+            self._hist(self._ops, name).add(duration)
+            if not success:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+
+    def record_segment(self, key, duration):
+        """ Records the travel time of a segment, key = (axis, from_pos, to_pos, start) """
+        with self._lock:
+            self._hist(self._segments, key).add(duration)
+
+
+    def segment_histogram(self, key):
+        """ Returns the histogram of the segment travel times, None if nothing has been recorded """
+        return self._segments.get(key)
+
+
+    def move_histogram(self, axis, distance=None):
+        """ Returns the histogram of the move durations, None if nothing has been recorded """
+        return self._moves.get((axis, distance))
+
+
+    def summary(self):
+        """ Returns all statistics as a dictionary (JSON compatible) """
+        with self._lock:
+            return self._summary()
+
+
+    def _summary(self):
+        moves = {}
+        for (axis, distance), hist in sorted(self._moves.items(), key=lambda item: str(item[0])):
+            axis_dict = moves.setdefault(axis, {"distance": {}})
+            if distance is None:
+                axis_dict.update(hist.summary())
+                axis_dict["polls"] = self._polls[axis].summary()
+                axis_dict["loops"] = self._loops[axis].summary()
+            else:
+                axis_dict["distance"][_distance_key(distance)] = hist.summary()
+        ops = {name: hist.summary() for name, hist in sorted(self._ops.items())}
+        segments = {'/'.join(str(k) for k in key): hist.summary()
+                    for key, hist in sorted(self._segments.items(), key=lambda item: str(item[0]))}
+        return {"moves": moves, "operations": ops, "segments": segments, "errors": dict(self._errors)}
+
+
+    def to_json(self):
+        return json.dumps(self.summary(), separators=(',', ':'))
+
+
+    def dump(self, filename):
+        """ Writes the statistics as JSON file """
+        with open(filename, "w", encoding="UTF-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+    def save(self, filename):
+        """ Saves all samples to a file, so that they survive a restart """
+        with self._lock:
+            state = {key: value for key, value in self.__dict__.items() if key != "_lock"}
+            with open(filename, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+
+    def load(self, filename):
+        """ Loads the samples from a file. Returns True on success. """
+        try:
+            with open(filename, 'rb') as f:
+                state = pickle.load(f)
+            with self._lock:
+                self.__dict__.update(state)
+        except (IOError, pickle.UnpicklingError, EOFError):
+            return False
+        return True
+
+
+class SegmentTimer:
+    """ Measures the travel times between neighbouring sensors during a move """
+    __slots__ = ("pos", "t", "start")
+
+    def __init__(self, pos, t):
+        self.pos = pos          # last sensor passed
+        self.t = t              # time when the sensor has been reached
+        self.start = True       # first segment of the move, includes the acceleration
+
+
+    def passed(self, axis, pos, now):
+        """ Called when the next sensor has been reached. Returns segment key and travel time. """
+        key = (axis, self.pos, pos, self.start)
+        duration = now - self.t
+        self.pos, self.t, self.start = pos, now, False
+        return key, duration
+
+
+def _distance_key(distance):
+    if isinstance(distance, tuple):
+        return '/'.join(str(d) for d in distance)
+    return str(distance)
+
+
+def timed(name):
+    """ Decorator for methods of classes with a 'stats' attribute (CycleStats).
+        Records duration and result of the operation. """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            t_start = time.monotonic()
+            result = func(self, *args, **kwargs)
+            self.stats.record_op(name, time.monotonic() - t_start, _is_okay(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def _is_okay(result):
+    name = getattr(result, "name", "")
+    return not name.startswith("err_")
@@ -0,0 +1,197 @@
+""" hbs_trace.py
+
+Workload trace of the high bay storage system: capture and replay.
+
+TraceRecorder writes every received command as a JSON line to logfiles/hbs_trace_<date>_<time>.jsonl
+(one file per program start). A line contains the fields of the MQTT message and
+- t, start, end: arrival, start and end of the command in seconds since the program start,
+- time: wall clock time of the arrival,
+- result: result message (or the operation name of a query result),
+- taken, freed: storage places, which have been occupied or cleared by the command.
+The format can be read by the simulator as well (hbs_simulator.py --trace).
+
+The replay tool re-injects a trace into a running system via MQTT, at the original or an accelerated
+speed, or runs it on the simulator:
+
+    python3 hbs_trace.py logfiles/hbs_trace_20250512_080000.jsonl --broker 192.168.1.94 --speed 10
+    python3 hbs_trace.py logfiles/hbs_trace_20250512_080000.jsonl --simulate
+
+SLW 05/2025
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+
+LOG_DIR = "logfiles"
+TRACE_FILE = "hbs_trace_{}.jsonl"
+# Keys added by the recorder, all other keys are the fields of the MQTT message
+TRACE_KEYS = ("t", "time", "start", "end", "result", "taken", "freed")
+
+
+class TraceEntry:
+    """ A received command, completed while it is executed """
+    __slots__ = ("t", "time", "payload", "start", "end", "occupancy")
+
+    def __init__(self, t, wall_time, payload):
+        self.t = t
+        self.time = wall_time
+        self.payload = payload      # received MQTT message, decoded when the entry is written
+        self.start = self.end = None
+        self.occupancy = None       # occupancy bitset at the start of the command
+
+
+class TraceRecorder:
+    """ Records the received commands with their timing and result """
+
+    def __init__(self):
+        self._t0 = time.monotonic()
+        self._file = None
+        self._lock = threading.Lock()       # commands and queries finish in different threads
+
+
+    def start(self, log_dir=LOG_DIR):
+        """ Opens a new trace file """
+        logname = "TraceRecorder.start"
+        filename = os.path.join(log_dir, TRACE_FILE.format(time.strftime("%Y%m%d_%H%M%S")))
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            self._file = open(filename, "a", encoding="UTF-8")
+        except IOError as err:
+            logging.error("%s: trace not recorded: %s", logname, err)
+            return False
+        return True
+
+
+    def stop(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+    def received(self, payload):
+        """ Called when a message has been received. Returns the entry of the command. """
+        return TraceEntry(time.monotonic() - self._t0, time.time(), payload)
+
+
+    def started(self, entry, occupancy=None):
+        """ Called when the execution of the command starts, occupancy: OccupancyBitset of the rack """
+        entry.start = time.monotonic() - self._t0
+        entry.occupancy = occupancy
+
+
+    def finished(self, entry, result, occupancy=None):
+        """ Called when the command has been executed. Writes the entry to the trace file. """
+        entry.end = time.monotonic() - self._t0
+        if entry.start is None:
+            entry.start = entry.end
+        if hasattr(result, "name"):     # Msg
+            result = result.name
+        elif isinstance(result, str):
+            result = result.partition(':')[0]   # query results: only the name, e.g. 'occupancy'
+        try:
+            record = json.loads(entry.payload)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            payload = entry.payload
+            record = {"payload": payload.decode(errors="replace") if isinstance(payload, bytes) else str(payload)}
+        record.update(t=round(entry.t, 3), time=round(entry.time, 3), start=round(entry.start, 3),
+                      end=round(entry.end, 3), result=result)
+        if entry.occupancy is not None and occupancy is not None:
+            taken, freed = occupancy.diff(entry.occupancy)
+            if taken:
+                record["taken"] = taken
+            if freed:
+                record["freed"] = freed
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+
+def read_trace(filename):
+    """ Returns the records of a trace file, sorted by arrival """
+    records = []
+    with open(filename, "r", encoding="UTF-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and line[0] != '#':
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def message(record):
+    """ Returns the original MQTT message of a trace record as JSON string """
+    if "payload" in record:
+        return record["payload"]
+    return json.dumps({key: value for key, value in record.items() if key not in TRACE_KEYS})
+
+
+def replay(records, publish, speed=1.0):
+    """ Publishes the messages of the trace records with the original time gaps divided by speed.
+        publish: function(payload). Returns the number of published messages. """
+    if not records:
+        return 0
+    t_first = records[0]["t"]
+    t_start = time.monotonic()
+    for record in records:
+        delay = t_start + (record["t"] - t_first) / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        publish(message(record))
+    return len(records)
+
+
+def replay_mqtt(records, broker, speed=1.0):
+    """ Replays the trace records to the MQTT broker of a running system """
+    import paho.mqtt.client as mqtt
+    from hbs_mqtt_client import SERVER_PORT, TOPIC_SUB, MQTT_USERNAME, MQTT_PASSWORD, QOS
+
+    client = mqtt.Client()
+    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    client.connect(broker, SERVER_PORT)
+    client.loop_start()
+    infos = []
+    count = replay(records, lambda payload: infos.append(client.publish(TOPIC_SUB, payload, QOS[TOPIC_SUB])), speed)
+    for info in infos:
+        info.wait_for_publish()
+    client.loop_stop()
+    client.disconnect()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays a workload trace of the high bay storage system")
+    parser.add_argument("trace", help="trace file, e.g. logfiles/hbs_trace_20250512_080000.jsonl")
+    parser.add_argument("--broker", help="address of the MQTT broker of the running system")
+    parser.add_argument("--speed", type=float, default=1.0, help="acceleration factor of the replay")
+    parser.add_argument("--simulate", action="store_true", help="run the trace on the simulator")
+    parser.add_argument("--fill", type=float, default=0.5, help="initial fill level of the simulated rack")
+    args = parser.parse_args(argv)
+
+    records = read_trace(args.trace)
+    if args.simulate:
+        import contextlib
+        from hbs_simulator import Simulator
+        from hbs_simulator import read_trace as read_jobs
+        with contextlib.redirect_stdout(sys.stderr):
+            report = Simulator(fill=args.fill).run(read_jobs(args.trace))
+        print(json.dumps(report, indent=2))
+    elif args.broker:
+        count = replay_mqtt(records, args.broker, args.speed)
+        print("{} messages replayed".format(count))
+    else:
+        parser.error("either --broker or --simulate is required")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+""" hbs_ui_worker.py
+
+Background worker for the human interface of the user terminal (LEDs and LCD).
+
+The control functions never wait for the display or the LEDs:
+- LED changes only store the latest requested state of each pin. The worker applies the changes,
+  so a sequence of set_busy() / set_ready() within a short time results in a single GPIO write.
+- Display operations are put into a queue and executed by the worker in the given order.
+  They only change the frame buffer of the LCD renderer, which is sent to the LCD at a limited
+  refresh rate. Only the latest text of each line reaches the display.
+
+SLW 05/2025
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+MAX_REFRESH = 10        # maximum refresh rate of the LCD in Hz
+
+
+class UIWorker:
+    """ Executes LED and display updates in a background thread """
+
+    def __init__(self, renderer, output_func, max_refresh=MAX_REFRESH):
+        self._renderer = renderer
+        self._output = output_func          # e.g. GPIO.output(pin, value)
+        self._period = 1.0 / max_refresh
+        self._queue = deque()               # display operations: (function, args)
+        self._outputs = {}                  # pin -> latest requested value
+        self._applied = {}                  # pin -> value written to the GPIO
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="UIWorker", daemon=True)
+        self._thread.start()
+
+
+    def submit(self, func, *args):
+        """ Queues a display operation """
+        self._queue.append((func, args))
+        self._wake.set()
+
+
+    def set_outputs(self, outputs):
+        """ Requests new states of output pins, e.g. {16: True, 20: False} """
+        with self._lock:
+            self._outputs.update(outputs)
+        self._wake.set()
+
+
+    def output_state(self, pin):
+        """ Returns the value last written to the output pin """
+        return self._applied.get(pin, False)
+
+
+    def stop(self):
+        """ Stops the worker after all pending updates have been executed """
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+
+
+    def _apply_outputs(self):
+        with self._lock:
+            outputs = self._outputs
+            self._outputs = {}
+        for pin, value in outputs.items():
+            if self._applied.get(pin) != value:
+                self._output(pin, value)
+                self._applied[pin] = value
+
+
+    def _run(self):
+        next_flush = 0.0
+        while True:
+            # Sleep until something changes, or the next refresh of the display is allowed
+            timeout = None
+            if self._renderer.pending:
+                timeout = max(0.0, next_flush - time.monotonic())
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+            self._apply_outputs()
+            while self._queue:
+                func, args = self._queue.popleft()
+                try:
+                    func(*args)
+                except Exception as err:
+                    logging.error("UIWorker._run: %s failed: %s", func.__name__, err)
+
+            now = time.monotonic()
+            if self._renderer.pending and (now >= next_flush or self._stop):
+                self._renderer.flush()
+                next_flush = now + self._period
+            if self._stop and not self._queue:
+                break
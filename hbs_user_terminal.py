@@ -17,6 +17,16 @@ Buttons:
 
 - green + yellow -> program end
 - green + red -> system shutdown
+- blue while the emergency stop is latched -> reset of the emergency stop
+
+The buttons are handled by GPIO edge interrupts with software debouncing. Presses and releases are
+published as events to a queue. The level of a button is read again at the end of the debounce time,
+so a short tap within the debounce time can't get lost.
+The red button sets the emergency stop flag directly in the interrupt. The flag is latched: queued commands
+are held until the operator resets it with the blue button.
+
+The network is not probed in the constructor. detect_network() is called by the startup sequence
+of the main program, so it can run concurrently with the initialization of the hardware.
 
 SLW 03/2025
 """
@@ -27,13 +37,21 @@ import time
 import subprocess
 import logging
 import sys
+import queue
+import threading
+
+from hbs_lcd_renderer import LCDRenderer
+from hbs_ui_worker import UIWorker
+from hbs_messages import MessageCatalogue, LANGUAGE, to_lcd
 
 
-MESSAGE_FILE = "hbs_messages_de.dat"
+NET_TIMEOUT = 10.0      # seconds to wait for the network connection
+NET_POLL = 0.5          # seconds between two network probes
+DEBOUNCE_TIME = 0.03    # seconds, edges within this time after a change are checked again after it
 
 class UserTerminal:
     
-    def __init__(self):
+    def __init__(self, language=LANGUAGE):
         self._led_green, self._led_yellow, self._led_red, self._led_blue = 16, 20, 26, 19
         self._bt_blue, self._bt_green, self._bt_yellow, self._bt_red = 8, 25, 24, 23
         GPIO.setwarnings(False)
@@ -46,7 +64,16 @@ class UserTerminal:
         GPIO.setup(self._bt_green, GPIO.IN, GPIO.PUD_UP)
         GPIO.setup(self._bt_yellow, GPIO.IN, GPIO.PUD_UP)
         GPIO.setup(self._bt_red, GPIO.IN, GPIO.PUD_UP)
-        self.ae, self.oe, self.ue,  = 225, 239, 245
+        # Buttons: debounced state, time of the last change, events (index, pressed)
+        self._bt_pins = (self._bt_blue, self._bt_green, self._bt_yellow, self._bt_red)
+        self._bt_state = [False, False, False, False]
+        self._bt_time = [0.0, 0.0, 0.0, 0.0]
+        self._bt_recheck = [False, False, False, False]     # level check after the debounce time pending
+        self._bt_lock = threading.Lock()                    # interrupt thread and recheck timers
+        self._bt_events = queue.SimpleQueue()
+        self._emrg_stop = threading.Event()
+        for pin in self._bt_pins:
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=self._button_callback)
         self._chr_shelf_0 = bytearray([0x00, 0x00, 0x00, 0xff, 0x00, 0x00, 0x00, 0xff])
         self._chr_shelf_1 = bytearray([0x00, 0x00, 0x00, 0xff, 0x00, 0x0e, 0x0e, 0xff])
         self._chr_shelf_2 = bytearray([0x00, 0x0e, 0x0e, 0xff, 0x00, 0x00, 0x00, 0xff])
@@ -55,20 +82,17 @@ class UserTerminal:
         self._chr_shelf_5 = bytearray([0x00, 0x00, 0x00, 0x00, 0x00, 0x0e, 0x0e, 0xff])
         self._chr_shelf_6 = bytearray([0x02, 0x02, 0x02, 0x02, 0x02, 0x02, 0x02, 0x02])
         self._chr_shelf_7 = bytearray([0x08, 0x08, 0x08, 0x08, 0x08, 0x08, 0x08, 0x08])
-        self.ip = ""
-        
-        # Show LEDs
-        self._show_leds()
+        self._ip_address = ""
 
         # Initialize display
         self._n_rows, self._n_columns = 4, 20
-        self._frame_buf = ['', '', '', '']
+        self._lines = ['', '', '', '']
         self._lcd = CharLCD(i2c_expander='PCF8574', address=0x27, port=1,
                             cols=self._n_columns, rows=self._n_rows, dotsize=8,
                             charmap='A02',
                             auto_linebreaks=True,
                             backlight_enabled=True)
-        self._row, self._display_row = 0, 0
+        self._row, self._col = 0, 0
         self._lcd.create_char(0, self._chr_shelf_0)
         self._lcd.create_char(1, self._chr_shelf_1)
         self._lcd.create_char(2, self._chr_shelf_2)
@@ -78,117 +102,139 @@ class UserTerminal:
         self._lcd.create_char(6, self._chr_shelf_6)
         self._lcd.create_char(7, self._chr_shelf_7)
         time.sleep(0.1)
-        self.clear()
+        # From now on, the display and the LEDs are only written by the UI worker
+        self._renderer = LCDRenderer(self._lcd, self._n_rows, self._n_columns)
+        self._ui = UIWorker(self._renderer, GPIO.output)
+        self._leds_ready = {self._led_green: True, self._led_yellow: False, self._led_red: False}
+        self._leds_busy = {self._led_green: False, self._led_yellow: True, self._led_red: False}
+        self._leds_error = {self._led_green: False, self._led_yellow: False, self._led_red: True}
         
-        # Read message file
+        # Load the message catalogue
         try:
-            with open(MESSAGE_FILE, "r", encoding="UTF-8") as f:
-                lines = f.readlines()
+            self.msg = MessageCatalogue(language)
         except IOError:
             msg = "Messages file error"
             self.print_str(msg)
             logging.error(msg)
             self.set_error()
+            self.close()
             sys.exit()
-            
-        self.msg = {}
-        for l in lines:
-            l = l.strip(' ')
-            if l[0] == '#':
-                continue
-            if l.find(':') > 0:
-                key, value = l.split(':')
-                self.msg[key.strip()] = value.strip()
                 
-        # Show welcome message
+        # Show welcome message and LEDs
         self.print_line(self.msg["wlc_01"])
         self.print_line(self.msg["wlc_02"])
-        
-        # Show SSID and IP address
-        for idx in range(10):
+        self._ui.submit(self._show_leds)
+
+
+    def detect_network(self, timeout=NET_TIMEOUT):
+        """ Waits for the network connection and shows IP address and SSID.
+            Returns True, if the network is available. """
+        logname = "UserTerminal.detect_network"
+        end_time = time.monotonic() + timeout
+        waiting = False
+        while True:
             ip_address = subprocess.check_output(['hostname', '-I'])
             if len(ip_address) > 5:
                 break
-            else:
-                self.print_str('.')
-                time.sleep(1)
-        self.carret()
+            if time.monotonic() >= end_time:
+                logging.error("%s: No network connection", logname)
+                if waiting:
+                    self.carret()
+                self.print_msg("err_nonet")
+                self.print_msg("sys_exit")
+                self.set_error()
+                return False
+            self.print_str('.')
+            waiting = True
+            time.sleep(NET_POLL)
+        if waiting:
+            self.carret()
 
-        if idx < 9:
-            ip_address = ip_address.decode("UTF-8")
-            self._ip_address = ip_address.split(' ')[0]
-            self.print_line("IP: " + self._ip_address)
-            ssid = subprocess.check_output(["iwgetid -r"], shell=True).decode("UTF-8")
-            ssid = ssid.strip('\n')
-            self.print_line("SSID: " + ssid)
-        else:
-            logging.error("No network connection")
-            self.print_msg("err_nonet")
-            self.print_msg("sys_exit")
-            self.set_error()
+        ip_address = ip_address.decode("UTF-8")
+        self._ip_address = ip_address.split(' ')[0]
+        self.print_line("IP: " + self._ip_address)
+        ssid = subprocess.check_output(["iwgetid -r"], shell=True).decode("UTF-8")
+        ssid = ssid.strip('\n')
+        self.print_line("SSID: " + ssid)
+        logging.info("%s: IP %s, SSID %s", logname, self._ip_address, ssid)
+        return True
 
 
     def get_ip(self):
         return self._ip_address
+
+
+    def set_language(self, language):
+        """ Selects the language of the messages. Returns True on success. """
+        return self.msg.load(language)
         
 
     # display --------------------------------------------------------------------------        
+    """ The display functions only queue the operation for the UI worker and return immediately.
+        The worker changes the text lines in the frame buffer of the renderer
+        and sends the changes to the LCD. """
+    
     def print_str(self, s):
-        if self._display_row > 3:
-            self.scroll_up()
-            self._display_row = 3
-        s = s.replace('ä', chr(self.ae))
-        s = s.replace('ö', chr(self.oe))
-        s = s.replace('ü', chr(self.ue))
-        l = len(self._frame_buf[self._row])
-        diff = self._n_columns - l
-        if diff > 0:
-            s = s[: diff]
-            self._frame_buf[self._row] += s
-            self._lcd.write_string(s)
+        """ Prints a string at the current position of the display """
+        self._ui.submit(self._print_str, to_lcd(s))
     
     def print_line(self, s):
         """ Prints a line to the display. """
-        self.print_str(s)
-        self.newline()
-        
-    def scroll_up(self):
-        self._lcd.clear()
-        cursor = self._row + 1
-        if cursor > 3:
-            cursor = 0
-        for idx in range(3):
-            self._lcd.cursor_pos = (idx, 0)
-            self._lcd.write_string(self._frame_buf[cursor])
-            cursor += 1
-            if cursor > 3:
-                cursor = 0
-        self._frame_buf[self._row] = ''
-        self._lcd.cursor_pos = (3, 0)
+        self._ui.submit(self._print_line, to_lcd(s))
         
     def print_msg(self, msg_key, add_on = ""):
-        msg = self.msg[msg_key]
-        if len(add_on) > 0:
-            msg += ' ' + add_on
-        self.print_line(msg)
-        
+        """ Prints a message of the catalogue, the LCD string is precompiled """
+        self._ui.submit(self._print_line, self.msg.text(msg_key, add_on))
                                         
     def clear(self):
-        self._lcd.clear()
-        self._frame_buf = ['', '', '', '']
-        self._row, self._display_row = 0, 0
+        self._ui.submit(self._clear)
 
     def carret(self):
-        """ carriage return """
-        self._frame_buf[self._row] = ''
-        self._lcd.cursor_pos = (self._display_row, 0)
+        """ carriage return, the next string overwrites the current line """
+        self._ui.submit(self._carret)
        
     def newline(self):
-        self._row += 1
-        self._display_row += 1
+        """ The next string starts a new line. The display scrolls with the next string, if needed. """
+        self._ui.submit(self._newline)
+        
+    def close(self):
+        """ Executes the pending display and LED updates and stops the UI worker """
+        self._ui.stop()
+        
+    # The following functions are executed by the UI worker
+    
+    def _print_str(self, s):
         if self._row > 3:
-            self._row = 0
-        self._lcd.cursor_pos = (self._row, 0)
+            self._scroll_up()
+        s = s[: self._n_columns - self._col]
+        if s:
+            line = self._lines[self._row]
+            self._lines[self._row] = line[: self._col] + s + line[self._col + len(s):]
+            self._col += len(s)
+            self._renderer.set_line(self._row, self._lines[self._row])
+    
+    def _print_line(self, s):
+        self._print_str(s)
+        self._newline()
+        
+    def _scroll_up(self):
+        """ Scrolls the display up by one line, the cursor moves to the start of the last line """
+        del self._lines[0]
+        self._lines.append('')
+        self._row, self._col = 3, 0
+        self._renderer.set_lines(self._lines)
+                                        
+    def _clear(self):
+        self._lines = ['', '', '', '']
+        self._row, self._col = 0, 0
+        self._renderer.clear()
+
+    def _carret(self):
+        self._col = 0
+       
+    def _newline(self):
+        self._row += 1
+        self._col = 0
         
     
     def show_axis(self, ax, hbs_ctr):
@@ -238,58 +284,103 @@ class UserTerminal:
         
         
     # LEDs -------------------------------------------------------------------
+    """ The LED functions only request the new state. The UI worker writes the GPIOs. """
+    
     def _show_leds(self):
+        """ LED test, executed by the UI worker """
         for led in (self._led_green, self._led_yellow, self._led_red, self._led_blue):
             GPIO.output(led, True)
             time.sleep(0.1)
-            GPIO.output(led, False)
+            GPIO.output(led, self._ui.output_state(led))
     
     def set_ready(self):
-        GPIO.output(self._led_green, True)
-        GPIO.output(self._led_yellow, False)
-        GPIO.output(self._led_red, False)
+        self._ui.set_outputs(self._leds_ready)
         
     def set_busy(self):
-        GPIO.output(self._led_green, False)
-        GPIO.output(self._led_yellow, True)
-        GPIO.output(self._led_red, False)
+        self._ui.set_outputs(self._leds_busy)
 
     def set_error(self):
-        GPIO.output(self._led_green, False)
-        GPIO.output(self._led_yellow, False)
-        GPIO.output(self._led_red, True)
+        self._ui.set_outputs(self._leds_error)
         
     def set_full(self):
-        GPIO.output(self._led_blue, True)
+        self._ui.set_outputs({self._led_blue: True})
         
     def clear_full(self):
-        GPIO.output(self._led_blue, False)
+        self._ui.set_outputs({self._led_blue: False})
       
       
     # Buttons-------------------------------------------------------------------
+    def _button_callback(self, pin):
+        """ GPIO interrupt for both edges of all buttons. Runs in the thread of RPi.GPIO. """
+        idx = self._bt_pins.index(pin)
+        # The emergency stop does not wait for the debouncing
+        if idx == 3 and not GPIO.input(pin):
+            self._emrg_stop.set()
+        self._button_update(idx)
+
+    def _button_update(self, idx):
+        """ Takes over the level of a button. Within the debounce time after the last change, the level
+            is read again at the end of the debounce time, so the final level of a bouncing edge is kept. """
+        with self._bt_lock:
+            now = time.monotonic()
+            wait = self._bt_time[idx] + DEBOUNCE_TIME - now
+            if wait > 0:
+                if not self._bt_recheck[idx]:
+                    self._bt_recheck[idx] = True
+                    timer = threading.Timer(wait, self._button_recheck, (idx,))
+                    timer.daemon = True
+                    timer.start()
+                return
+            pressed = not GPIO.input(self._bt_pins[idx])
+            if pressed == self._bt_state[idx]:
+                return
+            self._bt_state[idx] = pressed
+            self._bt_time[idx] = now
+        self._bt_events.put((idx, pressed))
+
+    def _button_recheck(self, idx):
+        with self._bt_lock:
+            self._bt_recheck[idx] = False
+        self._button_update(idx)
+        
     def get_buttons(self):
-        return not GPIO.input(self._bt_blue), \
-               not GPIO.input(self._bt_green),  \
-               not GPIO.input(self._bt_yellow), \
-               not GPIO.input(self._bt_red)
+        """ Returns the debounced state of the buttons: blue, green, yellow, red """
+        return tuple(self._bt_state)
+    
+    def get_button_event(self, timeout=None):
+        """ Returns the next button event as tuple (index, pressed), None if there is no event.
+            index: 0 -> blue, 1 -> green, 2 -> yellow, 3 -> red
+            timeout: None -> don't wait, otherwise the maximum waiting time in seconds """
+        try:
+            if timeout is None:
+                return self._bt_events.get_nowait()
+            return self._bt_events.get(timeout=timeout)
+        except queue.Empty:
+            return None
     
     def get_bt_red(self):
-        return not GPIO.input(self._bt_red)
+        """ Returns True, if the emergency stop has been triggered. The flag is set by the interrupt
+            of the red button and remains set until reset_emergency() is called. """
+        return self._emrg_stop.is_set()
+    
+    def reset_emergency(self):
+        """ Resets the emergency stop flag, unless the red button is still pressed.
+            Returns True, if the flag has been reset. """
+        if not GPIO.input(self._bt_red):
+            return False
+        self._emrg_stop.clear()
+        return True
     
     def wait_for_any_key(self, timeout = -1):
-        if timeout > 0:
-            end_time = time.time() + timeout
-            while time.time() < end_time:
-                bts = self.get_buttons()
-                if bts[0] or bts[1] or bts[2] or bts[3]:
-                    break
-                time.sleep(0.1)
-        else:
-            while True:
-                bts = self.get_buttons()
-                if bts[0] or bts[1] or bts[2] or bts[3]:
-                    break
-                time.sleep(0.1)
+        """ Waits for a button to be pressed. timeout <= 0 -> wait forever """
+        end_time = time.monotonic() + timeout
+        while True:
+            remaining = end_time - time.monotonic() if timeout > 0 else 1.0
+            if remaining <= 0:
+                break
+            event = self.get_button_event(remaining)
+            if event is not None and event[1]:
+                break
 
 #==========================================
         
@@ -297,8 +388,9 @@ if __name__ == "__main__":
     
     ut = UserTerminal()
     ut.wait_for_any_key(1)
-    ut._lcd.clear()
-    ut._lcd.write_string("Hello there \x00\x01\x02\x03\x04\x05")
+    ut.clear()
+    ut.print_line("Hello there \x00\x01\x02\x03\x04\x05")
+    ut.close()
       
     
         
\ No newline at end of file
@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
-from smbus2 import SMBus
+import threading
+try:
+    from smbus2 import SMBus
+except ImportError:     # no I2C bus, e.g. simulation on a PC
+    SMBus = None
 
 
 class IOExtension:
     """ IO extension board for Raspberry Pi """
 
-    def __init__(self, out_a=0, out_b=0):
+    def __init__(self, out_a=0, out_b=0, bus=None):     # bus: e.g. a simulated bus, default I2C bus 1
         self._mcp23017 = (0x20, 0x24, 0x22)
         self._address_map = {
             'IODIRA': 0x00, 'IODIRB': 0x01, 'GPPUA': 0x0c, 'GPPUB': 0x0d,
             'GPIOA': 0x12, 'GPIOB': 0x13, 'GPINTENA': 0x04, 'GPINTENB': 0x05
         }
         self._in_port_map = ((0, 'GPIOA'), (0, 'GPIOB'), (1, 'GPIOA'), (1, 'GPIOB'))
-        self._bus = SMBus(1)
+        # (device address, register) of the input ports
+        self._in_registers = tuple((self._mcp23017[device], self._address_map[register])
+                                   for device, register in self._in_port_map)
+        self.read_count = 0     # number of input port reads, used for the statistics
+        self._lock = threading.Lock()   # axes may be moved by different threads (e.g. initialization)
+        self._bus = bus if bus is not None else SMBus(1)
         # enable pullup resistors for input ports for device 0 and 1
         self._bus.write_byte_data(self._mcp23017[0], self._address_map['GPPUA'], 0xff)
         self._bus.write_byte_data(self._mcp23017[0], self._address_map['GPPUB'], 0xff)
@@ -33,12 +42,18 @@ class IOExtension:
         self._bus.write_byte_data(self._mcp23017[1], self._address_map['GPINTENB'], 0xFF)
 
 
+    def read_byte(self, port: int) -> int:
+        """ Returns the raw value of the input port 0 ... 3. The inputs are low active (0 bit -> active).
+            Used by the position decoding (hbs_sensors.py), no list is created. """
+        self.read_count += 1
+        return self._bus.read_byte_data(*self._in_registers[port])
+
+
     def read_port(self, port: int) -> list:
         """ Returns a list of booleans showing the current setting of the input port.
             Select port with an integer range 0 ... 3 """
         if port < 4:
-            result = self._bus.read_byte_data(self._mcp23017[self._in_port_map[port][0]],
-                                              self._address_map[self._in_port_map[port][1]])
+            result = self.read_byte(port)
             return [result & (1 << mask) == 0 for mask in range(8)]
         else:
             print("Input port", port, "undefined")
@@ -61,17 +76,19 @@ class IOExtension:
             value = parm2
         if port_pin < 8:
             if port == 0:
-                if value:
-                    self._out_a |= (1 << port_pin)
-                else:
-                    self._out_a &= ~(1 << port_pin)
-                self._bus.write_byte_data(self._mcp23017[2], self._address_map['GPIOA'], self._out_a)
+                with self._lock:
+                    if value:
+                        self._out_a |= (1 << port_pin)
+                    else:
+                        self._out_a &= ~(1 << port_pin)
+                    self._bus.write_byte_data(self._mcp23017[2], self._address_map['GPIOA'], self._out_a)
             elif port == 1:
-                if value:
-                    self._out_b |= (1 << port_pin)
-                else:
-                    self._out_b &= ~(1 << port_pin)
-                self._bus.write_byte_data(self._mcp23017[2], self._address_map['GPIOB'], self._out_b)
+                with self._lock:
+                    if value:
+                        self._out_b |= (1 << port_pin)
+                    else:
+                        self._out_b &= ~(1 << port_pin)
+                    self._bus.write_byte_data(self._mcp23017[2], self._address_map['GPIOB'], self._out_b)
             else:
                 print("Output port", port, "undefined")
         else:
@@ -0,0 +1,11 @@
+""" tests/conftest.py
+
+The modules of the high bay storage system are located in the repository root.
+
+SLW 05/2025
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
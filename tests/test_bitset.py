@@ -0,0 +1,58 @@
+""" tests/test_bitset.py
+
+Occupancy bitset: encodings and differences.
+
+SLW 05/2025
+"""
+
+from hbs_bitset import OccupancyBitset
+
+
+def _places(taken, size=50):
+    return {nr: {'taken': nr in taken, 'timestamp': None} for nr in range(1, size + 1)}
+
+
+def test_from_places():
+    bitset = OccupancyBitset.from_places(_places({1, 3, 50}))
+    assert bitset.size == 50
+    assert bitset.bits == 1 | 1 << 2 | 1 << 49
+    assert bitset[1] and not bitset[2] and bitset[3] and bitset[50]
+    assert bitset.count() == 3
+
+
+def test_bytes_and_base64():
+    bitset = OccupancyBitset.from_places(_places({2, 9, 17, 50}))
+    data = bitset.to_bytes()
+    assert len(data) == 7
+    assert data[0] == 0x02 and data[1] == 0x01     # little endian: place 9 -> bit 0 of byte 1
+    assert OccupancyBitset.from_bytes(data, 50) == bitset
+    assert OccupancyBitset.from_base64(bitset.to_base64(), 50) == bitset
+    assert OccupancyBitset(50).to_base64() == "AAAAAAAAAA=="
+
+
+def test_to_string():
+    bitset = OccupancyBitset(8)
+    bitset.set(2)
+    bitset.set(8)
+    assert bitset.to_string() == "_*_____*"
+    bitset.set(2, False)
+    assert bitset.to_string('1', '0') == "00000001"
+
+
+def test_diff():
+    old = OccupancyBitset.from_places(_places({1, 5, 20}))
+    new = old.copy()
+    new.set(5, False)
+    new.set(7)
+    new.set(50)
+    assert new.diff(old) == ([7, 50], [5])
+    assert old.diff(new) == ([5], [7, 50])
+    assert new.diff(new) == ([], [])
+    # The copy is independent
+    assert old[5] and not old[7]
+
+
+def test_equality():
+    assert OccupancyBitset(50, 3) == OccupancyBitset(50, 3)
+    assert OccupancyBitset(50, 3) != OccupancyBitset(40, 3)
+    assert OccupancyBitset(50, 3) != 3
@@ -0,0 +1,87 @@
+""" tests/test_calibration.py
+
+Travel time matrix: interpolation of the calibrated travel times.
+
+SLW 05/2025
+"""
+
+import pytest
+
+from hbs_calibration import TravelTimeMatrix
+from hbs_calibration import _interpolate, place_position, location_position, STATIONS
+from hbs_collections import YPos
+
+
+def test_interpolate():
+    points = [(1, 1.0), (3, 2.0), (5, 4.0)]
+    assert _interpolate([], 2) is None
+    assert _interpolate([(2, 1.0)], 4) == pytest.approx(2.0)       # single point: proportional
+    assert _interpolate(points, 1) == pytest.approx(1.0)
+    assert _interpolate(points, 2) == pytest.approx(1.5)
+    assert _interpolate(points, 4) == pytest.approx(3.0)
+    assert _interpolate(points, 7) == pytest.approx(6.0)           # extrapolated from the last two points
+    assert _interpolate([(2, 2.0), (3, 2.1)], 0) == pytest.approx(1.8)
+    assert _interpolate([(1, 1.0), (2, 3.0)], 0) == 0.0             # never negative
+
+
+def test_positions():
+    assert place_position(1) == (1, 2)
+    assert place_position(10) == (10, 2)
+    assert place_position(11) == (1, 4)
+    assert place_position(50) == (10, 10)
+    assert location_position("input") == STATIONS["input"]
+    assert location_position(23) == (3, 6)
+
+
+@pytest.fixture
+def matrix():
+    matrix = TravelTimeMatrix()
+    for distance, duration in ((1, 1.0), (3, 2.0), (5, 3.0)):
+        matrix.record_axis("x", 1, 1 + distance, duration)
+        matrix.record_axis("x", 1, 1 + distance, duration + 0.2)   # mean of both measurements
+        matrix.record_axis("x", 1 + distance, 1, 2 * duration)
+        matrix.record_axis("z", 1, 1 + distance, duration / 2)
+    matrix.record_y(YPos.DEFAULT, YPos.STORE, 1.5)
+    return matrix
+
+
+def test_axis_time(matrix):
+    assert matrix.axis_time("x", 4, 4) == 0.0
+    assert matrix.axis_time("x", 2, 5) == pytest.approx(2.1)
+    assert matrix.axis_time("x", 3, 5) == pytest.approx(1.6)          # between 1 and 3
+    assert matrix.axis_time("x", 5, 2) == pytest.approx(4.0)          # direction down
+    assert matrix.axis_time("z", 5, 2) is None                        # not calibrated
+
+
+def test_y_time(matrix):
+    assert matrix.y_time(YPos.DEFAULT, YPos.STORE) == pytest.approx(1.5)
+    assert matrix.y_time(YPos.STORE, YPos.STORE) == 0.0
+    assert matrix.y_time(YPos.STORE, YPos.DEFAULT) is None
+
+
+def test_move_time(matrix):
+    # Without XZ measurements the axes overlap completely
+    assert matrix.overlap == 1.0
+    assert matrix.move_time((1, 1), (4, 1)) == pytest.approx(2.1)
+    assert matrix.move_time((1, 1), (4, 2)) == pytest.approx(2.1)       # max(x 2.1, z 0.5)
+    assert matrix.move_time((4, 2), (1, 1)) is None                     # z down not calibrated
+    # A measured XZ move is used as is and gives the overlap factor for the others
+    matrix.record_xz((1, 1), (4, 4), 2.52)
+    assert matrix.move_time((1, 1), (4, 4)) == pytest.approx(2.52)
+    assert matrix.overlap == pytest.approx(1.2)
+    assert matrix.move_time((1, 1), (6, 2)) == pytest.approx(3.1 * 1.2)
+
+
+def test_build_and_save(matrix, tmp_path):
+    for distance in range(1, 10):
+        matrix.record_axis("z", 1 + distance, 1, 0.5 * distance)
+    matrix.build()
+    assert matrix.travel_time(1, 1) == 0.0
+    assert matrix.travel_time(1, "input") == pytest.approx(matrix.move_time((1, 2), STATIONS["input"]))
+    filename = str(tmp_path / "travel_times.pkl")
+    matrix.save(filename)
+    loaded = TravelTimeMatrix()
+    assert loaded.load(filename)
+    assert loaded.summary() == matrix.summary()
+    assert loaded.travel_time(12, "output") == matrix.travel_time(12, "output")
+    assert not TravelTimeMatrix().load(str(tmp_path / "missing.pkl"))
@@ -0,0 +1,73 @@
+""" tests/test_commands.py
+
+Decoding and validation of the MQTT commands (CommandRegistry).
+
+SLW 05/2025
+"""
+
+import pytest
+
+from hbs_collections import Msg
+from hbs_commands import CommandRegistry
+from hbs_commands import ARGS_XZ, ARGS_XZ_NEW
+
+
+@pytest.fixture
+def registry():
+    registry = CommandRegistry()
+    registry.register("store", None, ARGS_XZ)
+    registry.register("rearrange", None, ARGS_XZ_NEW)
+    registry.register("store_random", None)
+    registry.register("position", None, read_only=True)
+    return registry
+
+
+def test_decode_valid(registry):
+    result, cmd, args = registry.decode(b'{"operation": "store", "x": 3, "z": 2}')
+    assert result is Msg.okay
+    assert cmd.name == "store"
+    assert args == (3, 2)
+
+
+def test_decode_str_payload(registry):
+    result, cmd, args = registry.decode('{"operation": "STORE_RANDOM"}')
+    assert result is Msg.okay
+    assert cmd.name == "store_random"
+    assert args == ()
+
+
+def test_decode_case_insensitive(registry):
+    result, cmd, args = registry.decode(b'{"Operation": "ReArrange", "X": 1, "Z": 2, "X_NEW": 3, "z_new": 4}')
+    assert result is Msg.okay
+    assert args == (1, 2, 3, 4)
+
+
+def test_decode_read_only(registry):
+    result, cmd, args = registry.decode(b'{"operation": "position"}')
+    assert result is Msg.okay
+    assert cmd.read_only
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (b'no json', Msg.err_json_format),
+    (b'[1, 2]', Msg.err_json_format),
+    (b'"store"', Msg.err_json_format),
+    (b'{"x": 3, "z": 2}', Msg.err_json_noop),
+    (b'{"operation": 5}', Msg.err_json_noop),
+    (b'{"operation": "fly"}', Msg.err_cmd_unknown),
+    (b'{"operation": "store", "x": 3}', Msg.err_wrong_args),
+    (b'{"operation": "store", "x": "3", "z": 2}', Msg.err_wrong_args),
+    (b'{"operation": "store", "x": 3.0, "z": 2}', Msg.err_wrong_args),
+    (b'{"operation": "store", "x": true, "z": 2}', Msg.err_wrong_args),
+])
+def test_decode_errors(registry, payload, expected):
+    result, cmd, args = registry.decode(payload)
+    assert result is expected
+    assert cmd is None
+    assert args == ()
+
+
+def test_registry_lookup(registry):
+    assert "STORE" in registry
+    assert registry["Store"].args == ARGS_XZ
+    assert set(registry.names) == {"store", "rearrange", "store_random", "position"}
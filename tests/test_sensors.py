@@ -0,0 +1,74 @@
+""" tests/test_sensors.py
+
+Lookup table decoding of the position sensors (hbs_sensors.py), compared with the bitwise decoding
+of the port lists used before.
+
+SLW 05/2025
+"""
+
+import pytest
+
+import hbs_sensors
+from hbs_collections import YPos
+
+
+def _bits(value):
+    """ Port value as list of booleans, True -> sensor active (low active inputs) """
+    return [value & (1 << bit) == 0 for bit in range(8)]
+
+
+def _reference_x(port_0, port_1):
+    active = [idx + 1 for idx, port in enumerate(_bits(port_0) + _bits(port_1)[0:2]) if port]
+    return active[0] if len(active) == 1 else (-1 if not active else hbs_sensors.CONFLICT)
+
+
+def _reference_y(port_1):
+    active = [YPos(idx) for idx, port in enumerate(_bits(port_1)[2:5]) if port]
+    return active[0] if len(active) == 1 else (YPos.UNDEFINED if not active else YPos.CONFLICT)
+
+
+def _reference_z(port_1, port_2):
+    z_ports = _bits(port_1)[5:8] + _bits(port_2)[0:7]
+    z_ports.reverse()
+    active = [idx + 1 for idx, port in enumerate(z_ports) if port]
+    return active[0] if len(active) == 1 else (-1 if not active else hbs_sensors.CONFLICT)
+
+
+@pytest.mark.parametrize("port_1", range(256))
+def test_decode_x(port_1):
+    for port_0 in range(256):
+        assert hbs_sensors.decode_x(port_0, port_1) == _reference_x(port_0, port_1)
+
+
+def test_decode_y():
+    for port_1 in range(256):
+        assert hbs_sensors.decode_y(port_1) is _reference_y(port_1)
+
+
+@pytest.mark.parametrize("port_1", range(256))
+def test_decode_z(port_1):
+    for port_2 in range(256):
+        assert hbs_sensors.decode_z(port_1, port_2) == _reference_z(port_1, port_2)
+
+
+def test_single_sensors():
+    # All inputs high: no sensor active
+    assert hbs_sensors.decode_x(0xff, 0xff) == hbs_sensors.UNDEFINED
+    assert hbs_sensors.decode_y(0xff) is YPos.UNDEFINED
+    assert hbs_sensors.decode_z(0xff, 0xff) == hbs_sensors.UNDEFINED
+    assert hbs_sensors.decode_x(0xff & ~0x08, 0xff) == 4
+    assert hbs_sensors.decode_x(0xff, 0xff & ~0x02) == 10
+    assert hbs_sensors.decode_y(0xff & ~0x08) is YPos.DEFAULT
+    assert hbs_sensors.decode_z(0xff, 0xff & ~0x40) == 1
+    assert hbs_sensors.decode_z(0xff & ~0x20, 0xff) == 10
+
+
+def test_conflicts():
+    # Sensors on the same port and on different ports
+    assert hbs_sensors.decode_x(0xff & ~0x03, 0xff) == hbs_sensors.CONFLICT
+    assert hbs_sensors.decode_x(0xff & ~0x80, 0xff & ~0x01) == hbs_sensors.CONFLICT
+    assert hbs_sensors.decode_y(0xff & ~0x14) is YPos.CONFLICT
+    assert hbs_sensors.decode_z(0xff & ~0x80, 0xff & ~0x01) == hbs_sensors.CONFLICT
+    # Port bits of other axes don't disturb the decoding
+    assert hbs_sensors.decode_x(0xff & ~0x01, 0xff & ~0xfc) == 1
+    assert hbs_sensors.decode_z(0xff & ~0x03, 0xff & ~0x80) == hbs_sensors.UNDEFINED
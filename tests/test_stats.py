@@ -0,0 +1,49 @@
+""" tests/test_stats.py
+
+Percentiles and summary of the Histogram of the cycle time statistics.
+
+SLW 05/2025
+"""
+
+from hbs_stats import Histogram
+
+
+def test_empty():
+    hist = Histogram()
+    assert hist.percentile(50) is None
+    assert hist.summary() == {"count": 0}
+    assert len(hist) == 0
+
+
+def test_percentiles():
+    hist = Histogram()
+    for value in range(1, 101):
+        hist.add(float(value))
+    assert hist.percentile(0) == 1.0
+    assert hist.percentile(50) == 51.0      # nearest rank of 100 samples: round(0.5 * 99) = 50
+    assert hist.percentile(95) == 95.0
+    assert hist.percentile(100) == 100.0
+    summary = hist.summary()
+    assert summary == {"count": 100, "mean": 50.5, "p50": 51.0, "p95": 95.0, "p99": 99.0, "max": 100.0}
+
+
+def test_unsorted_samples():
+    hist = Histogram()
+    for value in (5.0, 1.0, 3.0, 2.0, 4.0):
+        hist.add(value)
+    assert hist.percentile(50) == 3.0
+    # The sorted cache is invalidated by a new sample
+    hist.add(0.5)
+    assert hist.percentile(0) == 0.5
+
+
+def test_window():
+    hist = Histogram(size=10)
+    for value in range(100):
+        hist.add(float(value))
+    # Percentiles of the recent samples, count, mean and max of all samples
+    assert len(hist) == 10
+    assert hist.percentile(0) == 90.0
+    assert hist.count == 100
+    assert hist.max == 99.0
+    assert hist.summary()["mean"] == 49.5
@@ -0,0 +1,86 @@
+""" tests/test_storage_file.py
+
+Storage file of HBSController: creation, version 2 format and migration of version 1 files.
+
+SLW 05/2025
+"""
+
+import os
+import pickle
+
+import pytest
+
+import hbs_controller
+from hbs_bitset import OccupancyBitset
+from hbs_collections import Msg
+from hbs_controller import HBSController
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    """ Empty working directory with the directory of the storage file """
+    monkeypatch.chdir(tmp_path)
+    # The storage file is handled without an operator, no I/O board required
+    monkeypatch.setattr(hbs_controller, "HBSOperator", lambda ut: object())
+    os.makedirs(hbs_controller.STORE_DIR)
+    return tmp_path / hbs_controller.STORE_DIR
+
+
+def _controller():
+    return HBSController(None)
+
+
+def _read(store_dir):
+    with open(store_dir / hbs_controller.STORE_FILE, 'rb') as f:
+        return pickle.load(f)
+
+
+def test_create(store_dir):
+    ctr = _controller()
+    assert ctr.load_storage_file() is Msg.storage_created
+    data = _read(store_dir)
+    assert data["version"] == hbs_controller.STORE_VERSION
+    assert data["size"] == 50
+    assert data["timestamps"] == {}
+    assert ctr.occupancy[11] == {'x': 1, 'z': 2, 'taken': False, 'timestamp': None}
+
+
+def test_save_and_load(store_dir):
+    ctr = _controller()
+    ctr.load_storage_file()
+    ctr.occupy_place(3, 2)
+    ctr.occupy_place(10, 5)
+    ctr.clear_place(3, 2)
+    loaded = _controller()
+    assert loaded.load_storage_file() is Msg.storage_loaded
+    assert loaded.occupancy == ctr.occupancy
+    assert loaded.occupancy_bits.diff(ctr.occupancy_bits) == ([], [])
+    assert loaded.get_place(10, 5) and not loaded.get_place(3, 2)
+
+
+def test_migrate_version_1(store_dir):
+    # Version 1: pickled dict of the storage places
+    places = {nr: {'x': (nr - 1) % 10 + 1, 'z': (nr - 1) // 10 + 1, 'taken': False, 'timestamp': None}
+              for nr in range(1, 51)}
+    places[7].update(taken=True, timestamp=1746000000.0)
+    places[42].update(taken=True, timestamp=1746000100.0)
+    with open(store_dir / hbs_controller.STORE_FILE, 'wb') as f:
+        pickle.dump(places, f)
+
+    ctr = _controller()
+    assert ctr.load_storage_file() is Msg.storage_loaded
+    assert ctr.occupancy_bits.diff(OccupancyBitset(50)) == ([7, 42], [])
+    assert ctr.slot_state(2, 5) == {'x': 2, 'z': 5, 'taken': True, 'timestamp': 1746000100.0}
+    # The next write converts the file to version 2
+    ctr.save_to_file()
+    data = _read(store_dir)
+    assert data["version"] == hbs_controller.STORE_VERSION
+    assert data["timestamps"] == {7: 1746000000.0, 42: 1746000100.0}
+    loaded = _controller()
+    assert loaded.load_storage_file() is Msg.storage_loaded
+    assert loaded.occupancy == ctr.occupancy
+
+
+def test_load_corrupt_file(store_dir):
+    (store_dir / hbs_controller.STORE_FILE).write_bytes(b"garbage")
+    assert _controller().load_storage_file() is Msg.err_storage_io